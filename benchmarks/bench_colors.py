@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of the color utilities of treeprofiler.src.utils.
+
+Usage:
+    python benchmarks/bench_colors.py [--n 100000] [--distinct 1000]
+
+Colors n ratios (heatmap gradients) and n counts (aggregated binary
+heatmaps), with --distinct different values among them as in the nodes of
+an annotated tree, and builds gradients. Each is timed with the former
+per-call matplotlib conversions, the memoized per-call functions and the
+array functions.
+"""
+import os
+import sys
+import math
+import time
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+import numpy as np
+import matplotlib as mpl
+import matplotlib.colors as mcolors
+import matplotlib.pyplot as plt
+
+from treeprofiler.src import utils
+
+
+# former implementations, converting colors with matplotlib on every call
+def color_gradient(c1, c2, mix=0):
+    c1 = np.array(mpl.colors.to_rgb(c1))
+    c2 = np.array(mpl.colors.to_rgb(c2))
+    return mpl.colors.to_hex((1-mix)*c1 + mix*c2)
+
+def make_color_darker_scaled(hex_color, positive, maximum, base=10, scale_factor=10, min_darkness=0.6):
+    normalized_position = positive / maximum if maximum != 0 else 0
+    log_position = math.log(1 + normalized_position * (scale_factor - 1), base) / math.log(scale_factor, base)
+    if log_position >= min_darkness:
+        log_position = min_darkness
+    rgb = mcolors.hex2color(hex_color)
+    return mcolors.to_hex([(1 - log_position) * channel for channel in rgb])
+
+def build_color_gradient(n_colors, colormap_name="viridis"):
+    cmap = plt.get_cmap(colormap_name)
+    indices = np.linspace(0, 1, n_colors)
+    return {i: mcolors.rgb2hex(cmap(idx)) for i, idx in enumerate(indices, 1)}
+
+
+def timed(label, fn, baseline=None):
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    speedup = f' ({baseline / max(elapsed, 1e-9):.0f}x)' if baseline else ''
+    print(f'  {label:<10} {elapsed:.4f}s{speedup}')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n', type=int, default=100000)
+    parser.add_argument('--distinct', type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    ratios = (rng.integers(0, args.distinct, args.n) / args.distinct).tolist()
+    counts = rng.integers(0, args.distinct, args.n).tolist()
+    maximum = args.distinct
+
+    print(f'color_gradient, {args.n} ratios:')
+    base = timed('per call', lambda: [color_gradient('#EBEBEB', '#971919', mix=r) for r in ratios])
+    timed('memoized', lambda: [utils.color_gradient('#EBEBEB', '#971919', mix=r) for r in ratios], base)
+    timed('array', lambda: utils.blend_colors('#EBEBEB', '#971919', ratios), base)
+
+    print(f'make_color_darker_scaled, {args.n} counts:')
+    base = timed('per call', lambda: [make_color_darker_scaled('#971919', c, maximum) for c in counts])
+    timed('memoized', lambda: [utils.make_color_darker_scaled('#971919', c, maximum) for c in counts], base)
+    timed('array', lambda: utils.darken_colors_scaled('#971919', counts, maximum), base)
+
+    print('build_color_gradient, 1000 gradients of 20 colors:')
+    base = timed('per call', lambda: [build_color_gradient(20, 'Reds') for _ in range(1000)])
+    timed('table', lambda: [utils.build_color_gradient(20, 'Reds') for _ in range(1000)], base)
+
+
+if __name__ == '__main__':
+    main()
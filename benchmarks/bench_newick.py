@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the annotated newick/NHX output on a large random tree.
+
+Usage:
+    python benchmarks/bench_newick.py [--leaves 100000] [--props 50]
+
+Every node gets --props properties (numerical, text and list values, as
+produced by `treeprofiler annotate`). The tree is written with ete4's
+Tree.write and with the streaming writer of
+treeprofiler.src.newick_writer, plain and gzip compressed.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from ete4 import PhyloTree
+from treeprofiler.src.newick_writer import write_newick
+
+
+def build_tree(n_leaves, n_props, seed=42):
+    random.seed(seed)
+    tree = PhyloTree()
+    tree.populate(n_leaves, dist_fn=random.random)
+    props = [f'col{i}' for i in range(n_props)]
+    for node in tree.traverse():
+        for i, prop in enumerate(props):
+            if i % 10 == 0:
+                node.add_prop(prop, [random.choice('abcde') for _ in range(3)])
+            elif i % 2:
+                node.add_prop(prop, random.random())
+            else:
+                node.add_prop(prop, random.choice(['vowel', 'consonant', 'digit']))
+    return tree, props
+
+
+def timed(fn):
+    start = time.time()
+    fn()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--leaves', type=int, default=100000)
+    parser.add_argument('--props', type=int, default=50)
+    args = parser.parse_args()
+
+    start = time.time()
+    tree, props = build_tree(args.leaves, args.props)
+    print(f'built tree with {args.leaves} leaves and {args.props} props in {time.time() - start:.2f}s')
+
+    with tempfile.TemporaryDirectory() as outdir:
+        outputs = {
+            'Tree.write': (os.path.join(outdir, 'ete.nw'),
+                lambda path: tree.write(outfile=path, props=props, parser=1, format_root_node=True)),
+            'write_newick': (os.path.join(outdir, 'stream.nw'),
+                lambda path: write_newick(tree, path, props=props, parser=1)),
+            'write_newick gzip': (os.path.join(outdir, 'stream.nw.gz'),
+                lambda path: write_newick(tree, path, props=props, parser=1)),
+        }
+        for name, (path, write) in outputs.items():
+            elapsed = timed(lambda: write(path))
+            size = os.path.getsize(path) / 2**20
+            print(f'{name}: {elapsed:.2f}s, {size:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
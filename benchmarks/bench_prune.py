@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark of conditional pruning (--pruned-by) on a large random tree.
+
+Usage:
+    python benchmarks/bench_prune.py [--leaves 100000] [--condition "col1 < 0.05"]
+
+The tree gets a numerical leaf property and a categorical counter in every
+internal node, as produced by `treeprofiler annotate`, and is pruned with the
+compiled single-pass engine in treeprofiler.src.utils.conditional_prune.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from ete4 import PhyloTree
+from treeprofiler.src import utils
+
+
+def build_tree(n_leaves, seed=42):
+    random.seed(seed)
+    tree = PhyloTree()
+    tree.populate(n_leaves, dist_fn=random.random)
+    categories = ['vowel', 'consonant', 'digit']
+    for node in tree.traverse('postorder'):
+        if node.is_leaf:
+            node.add_prop('col1', random.random())
+            node.add_prop('alphabet_type', random.choice(categories))
+            node.add_prop('_counts', {node.props['alphabet_type']: 1})
+        else:
+            counts = {}
+            for child in node.children:
+                for key, value in child.props.pop('_counts').items():
+                    counts[key] = counts.get(key, 0) + value
+            node.add_prop('_counts', counts)
+            node.add_prop('alphabet_type_counter',
+                utils.dict_to_string(dict(sorted(counts.items()))))
+    tree.del_prop('_counts')
+    return tree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--leaves', type=int, default=100000)
+    parser.add_argument('--condition', action='append',
+        help="condition in --pruned-by syntax, can be given multiple times")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    conditions = args.condition or ['col1 < 0.05', 'alphabet_type_counter:vowel > 50']
+    prop2type = {
+        'name': str, 'dist': float, 'support': float,
+        'col1': float, 'alphabet_type': str, 'alphabet_type_counter': str,
+    }
+
+    start = time.time()
+    tree = build_tree(args.leaves)
+    print(f'built tree with {args.leaves} leaves in {time.time() - start:.2f}s')
+
+    for condition in conditions:
+        timings = []
+        for _ in range(args.repeat):
+            t = tree.copy()
+            start = time.time()
+            pruned = utils.conditional_prune(t, [condition], prop2type)
+            timings.append(time.time() - start)
+        remaining = sum(1 for _ in pruned.leaves())
+        print(f'--pruned-by "{condition}": best {min(timings):.3f}s, '
+              f'{remaining} leaves left')
+
+
+if __name__ == '__main__':
+    main()
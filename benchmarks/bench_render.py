@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the per-node work of the layouts over repeated zoom/pan draws.
+
+Usage:
+    python benchmarks/bench_render.py [--leaves 100000] [--draws 50] [--npx 1000]
+
+The tree gets a categorical and a boolean leaf property and their counters
+in every internal node, as produced by `treeprofiler annotate`. A scripted
+session zooms into the tree and pans around; each draw visits the nodes
+that are visible in its window (collapsing the clades thinner than a
+pixel) and gets the face parameters of a rectangle layout (color, tooltip,
+stacked bar data) and a binary layout (ratio color, tooltip) for each of
+them, either recomputing them (tooltip HTML included) as set_node_style used
+to or looking them up in the payloads of treeprofiler.src.payloads, prepared
+once, with the tooltips generated on the first draw of each node.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from ete4 import PhyloTree
+from treeprofiler.src import utils
+from treeprofiler.src.payloads import NodePayloads, Payload, counter_data, tooltip_html, heatmap_color
+from treeprofiler.src.booleans import bool_counts
+
+
+def build_tree(n_leaves, seed=42):
+    random.seed(seed)
+    tree = PhyloTree()
+    tree.populate(n_leaves, dist_fn=random.random)
+    categories = ['vowel', 'consonant', 'digit']
+    for node in tree.traverse('postorder'):
+        if node.is_leaf:
+            node.add_prop('alphabet_type', random.choice(categories))
+            node.add_prop('bool_type', random.choice(['True', 'False', 'NaN']))
+            node.add_prop('_counts', ({node.props['alphabet_type']: 1}, {node.props['bool_type']: 1}))
+        else:
+            counts = ({}, {})
+            for child in node.children:
+                for total, child_counts in zip(counts, child.props.pop('_counts')):
+                    for key, value in child_counts.items():
+                        total[key] = total.get(key, 0) + value
+            node.add_prop('_counts', counts)
+            node.add_prop('alphabet_type_counter', utils.dict_to_string(dict(sorted(counts[0].items()))))
+            node.add_prop('bool_type_counter', utils.dict_to_string(dict(sorted(counts[1].items()))))
+    tree.del_prop('_counts')
+    return tree
+
+
+def session(n_leaves, n_draws, seed=42):
+    """Windows (first leaf, last leaf) of a session zooming in and panning."""
+    random.seed(seed)
+    windows = []
+    size = n_leaves
+    start = 0
+    for i in range(n_draws):
+        if i % 5 == 0 and size > 100: # zoom in around the middle of the window
+            start += size // 4
+            size //= 2
+        else: # pan by half a window
+            start += random.choice([-1, 1]) * size // 2
+        start = min(max(start, 0), n_leaves - size)
+        windows.append((start, start + size))
+    return windows
+
+
+def visible_nodes(tree, spans, window, npx):
+    """Nodes drawn in window, clades thinner than a pixel collapsed."""
+    first, last = window
+    min_span = (last - first) / npx
+    nodes = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        start, end = spans[node]
+        if end <= first or start >= last:
+            continue
+        nodes.append(node)
+        if end - start >= min_span:
+            stack.extend(node.children)
+    return nodes
+
+
+def rect_payload(node, color_dict):
+    if node.is_leaf:
+        value = node.props.get('alphabet_type')
+        return Payload('prop', color=color_dict.get(value, ""), tooltip=(('alphabet_type', value),))
+    data = counter_data(node, 'alphabet_type_counter', color_dict)
+    return Payload('counter', tooltip='alphabet_type_counter', data=data)
+
+
+def binary_payload(node):
+    if node.is_leaf:
+        value = node.props.get('bool_type')
+        return Payload('leaf', color='#E60A0A' if value == 'True' else '#EBEBEB',
+            tooltip=(('bool_type', value),))
+    positive, total = bool_counts(node.props.get('bool_type_counter'))
+    return Payload('internal', color=heatmap_color(positive, total, max_color='#E60A0A'),
+        tooltip=(('bool_type_counter', f'{positive} / {total} '),))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--leaves', type=int, default=100000)
+    parser.add_argument('--draws', type=int, default=50)
+    parser.add_argument('--npx', type=int, default=1000, help="height of the view in pixels")
+    args = parser.parse_args()
+
+    start = time.time()
+    tree = build_tree(args.leaves)
+    print(f'built tree with {args.leaves} leaves in {time.time() - start:.2f}s')
+
+    spans = {}
+    for i, leaf in enumerate(tree.leaves()):
+        spans[leaf] = (i, i + 1)
+    for node in tree.traverse('postorder'):
+        if not node.is_leaf:
+            spans[node] = (spans[node.children[0]][0], spans[node.children[-1]][1])
+    draws = [visible_nodes(tree, spans, window, args.npx)
+             for window in session(args.leaves, args.draws)]
+    print(f'{len(draws)} draws, {sum(map(len, draws))} visible nodes in total')
+
+    color_dict = {'vowel': '#E41A1C', 'consonant': '#377EB8', 'digit': '#4DAF4A'}
+    compute_fns = [lambda node: rect_payload(node, color_dict), binary_payload]
+
+    start = time.time()
+    for nodes in draws:
+        for node in nodes:
+            for compute in compute_fns:
+                tooltip_html(node, compute(node).tooltip)
+    recompute = time.time() - start
+    print(f'recomputed on every draw: {recompute:.3f}s')
+
+    start = time.time()
+    layouts = [NodePayloads(compute) for compute in compute_fns]
+    for payloads in layouts:
+        payloads.prepare(tree)
+    prepare = time.time() - start
+
+    start = time.time()
+    for nodes in draws:
+        for node in nodes:
+            for payloads in layouts:
+                payloads.get(node)
+                payloads.tooltip(node)
+    lookup = time.time() - start
+    print(f'prepared once: {prepare:.3f}s, then {lookup:.3f}s for all the draws '
+          f'({recompute / max(lookup, 1e-9):.0f}x faster per draw)')
+
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,8 @@ def get_files(directory):
     return file_list
 
 VERSION = '1.2.4.1'
-install_requires = ['ete4', 'selenium', 'biopython','scipy']
+install_requires = ['ete4', 'biopython','scipy']
+extras_require = {'png': ['pillow']} # png figures with plot --render
 example_files = get_files('examples/')
 test_files = get_files('tests/')
 long_description = open("README.md").read()
@@ -47,6 +48,7 @@ setup(
         ('tests', test_files)
     ],
     install_requires=install_requires,
+    extras_require=extras_require,
     keywords = "tree annotation, tree visualization, phylogeny, phylogenetics, phylogenomics",
 )
 
@@ -3,6 +3,8 @@ import sys
 import os
 import tarfile
 from io import StringIO, BytesIO
+import argparse
+import pickle
 import unittest
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
@@ -11,7 +13,12 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 
 from treeprofiler import tree_annotate
+from treeprofiler.main import populate_main_args
 from treeprofiler.src import utils
+from treeprofiler.src.counters import CounterString, parse_counter
+from treeprofiler.src import table
+from treeprofiler.src.newick_writer import write_newick
+from treeprofiler.src import annotation_cache
 import time
 
 class TestAnnotate(unittest.TestCase):
@@ -203,6 +210,35 @@ class TestAnnotate(unittest.TestCase):
         self.assertEqual(test_tree_annotated.write(props=None, parser=parser),expected_tree_no_root)
         self.assertEqual(test_tree_annotated.write(props=None, parser=parser, format_root_node=True),expected_tree_with_root)
     
+    def test_annotate_newick_writer(self):
+        # streaming newick output joins list data with '||' without modifying the tree
+        internal_parser = "name"
+        parser = utils.get_internal_parser(internal_parser)
+        test_tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1):0.5):0.5);")
+
+        with NamedTemporaryFile(suffix='.tsv') as f_annotation:
+            f_annotation.write(b'#name\tlist_data\nA\ta,b,c\nB\tc,d\nD\ta,c,d,e\nE\te,d,b\n')
+            f_annotation.flush()
+
+            metadata_dict, node_props, columns, prop2type = tree_annotate.parse_csv([f_annotation.name])
+
+        expected_tree = '(A:1[&&NHX:list_data=a||b||c],(B:1[&&NHX:list_data=c||d],(E:1[&&NHX:list_data=e||d||b],D:1[&&NHX:list_data=a||c||d||e])N4:0.5[&&NHX:list_data_counter=a--1||b--1||c--1||d--2||e--2])N5:0.5[&&NHX:list_data_counter=a--1||b--1||c--2||d--3||e--2])Root[&&NHX:list_data_counter=a--2||b--2||c--3||d--3||e--2];\n'
+
+        test_tree_annotated, annotated_prop2type = tree_annotate.run_tree_annotate(test_tree, 
+            metadata_dict=metadata_dict, node_props=node_props, 
+            columns=columns, prop2type=prop2type)
+
+        output = StringIO()
+        write_newick(test_tree_annotated, output, props=['list_data', 'list_data_counter'], parser=parser, chunk_size=16)
+        self.assertEqual(output.getvalue(), expected_tree)
+        self.assertEqual(test_tree_annotated['A'].props.get('list_data'), ['a', 'b', 'c'])
+
+        with TemporaryDirectory() as temp_dir:
+            outfile = os.path.join(temp_dir, 'annotated.nw.gz')
+            write_newick(test_tree_annotated, outfile, props=['list_data', 'list_data_counter'], parser=parser)
+            reloaded_tree, eteformat_flag = utils.validate_tree(outfile, 'newick', internal_parser)
+        self.assertEqual(reloaded_tree['A'].props.get('list_data'), 'a||b||c')
+
     # def test_annotate_09():
     #     # specify datatype of each column 
     #     internal_parser = "name"
@@ -342,6 +378,235 @@ class TestAnnotate(unittest.TestCase):
         expected_tree_13 = '(A:1[&&NHX:Col1=vowel:Col2=True:Col3=a|b|c],(B:1[&&NHX:Col1=consonant:Col2=False:Col3=c|d],(E:1[&&NHX:Col1=vowel:Col2=False:Col3=e|d|b],D:1[&&NHX:Col1=consonant:Col2=True:Col3=a|c|d|e])Internal_1:0.5[&&NHX:Col1_counter=consonant--0.50||vowel--0.50:Col2_counter=False--0.50||True--0.50:Col3_counter=a--0.14||b--0.14||c--0.14||d--0.29||e--0.29])Internal_2:0.5[&&NHX:Col1_counter=consonant--0.67||vowel--0.33:Col2_counter=False--0.67||True--0.33:Col3_counter=a--0.11||b--0.11||c--0.22||d--0.33||e--0.22])Root[&&NHX:Col1_counter=consonant--0.50||vowel--0.50:Col2_counter=False--0.50||True--0.50:Col3_counter=a--0.17||b--0.17||c--0.25||d--0.25||e--0.17];'
         self.assertEqual(test_tree_annotated_13.write(props=props, parser=parser, format_root_node=True), expected_tree_13)
 
+    def test_annotate_counter_cache(self):
+        # counters keep their parsed counts and read back the same from text
+        test_tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1)Internal_1:0.5)Internal_2:0.5)Root;")
+
+        with NamedTemporaryFile(suffix='.tsv') as f_annotation:
+            f_annotation.write(b'#name\talphabet_type\nA\tvowel\nB\tconsonant\nD\tconsonant\nE\tvowel\n')
+            f_annotation.flush()
+
+            metadata_dict, node_props, columns, prop2type = tree_annotate.parse_csv([f_annotation.name])
+
+        # in process and through the multiprocessing pool of the internal nodes
+        for threads in [1, 2]:
+            test_tree_annotated, annotated_prop2type = tree_annotate.run_tree_annotate(test_tree.copy(),
+                metadata_dict=metadata_dict, node_props=node_props,
+                columns=columns, prop2type=prop2type, threads=threads)
+
+            counter = test_tree_annotated['Internal_2'].props.get('alphabet_type_counter')
+            self.assertIsInstance(counter, CounterString)
+            self.assertEqual(counter, 'consonant--2||vowel--1')
+            self.assertEqual(counter.counts, {'consonant': 2.0, 'vowel': 1.0})
+            self.assertEqual(parse_counter(counter), {'consonant': 2.0, 'vowel': 1.0})
+            self.assertEqual(parse_counter(str(counter)), parse_counter(counter))
+            self.assertEqual(utils.categorical2ratio(test_tree_annotated['Internal_2'], 'alphabet_type_counter', ['vowel', 'consonant']), [1/3, 2/3])
+
+            # pickled as plain text, readable without treeprofiler
+            self.assertIs(type(pickle.loads(pickle.dumps(counter))), str)
+            self.assertEqual(pickle.loads(pickle.dumps(counter)), 'consonant--2||vowel--1')
+
+    def test_annotate_acr_discrete(self):
+        # ancestral states of a categorical column, without the extra props of pastml
+        test_tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1)Internal_1:0.5)Internal_2:0.5)Root;")
+
+        with NamedTemporaryFile(suffix='.tsv') as f_annotation:
+            f_annotation.write(b'#name\talphabet_type\nA\tvowel\nB\tconsonant\nD\tconsonant\nE\tvowel\n')
+            f_annotation.flush()
+
+            metadata_dict, node_props, columns, prop2type = tree_annotate.parse_csv([f_annotation.name])
+
+        with TemporaryDirectory() as outdir:
+            test_tree_annotated, annotated_prop2type = tree_annotate.run_tree_annotate(test_tree,
+                metadata_dict=metadata_dict, node_props=node_props, columns=columns,
+                prop2type=prop2type, acr_discrete_columns=['alphabet_type'],
+                prediction_method='MPPA', model='F81', outdir=outdir + '/')
+
+        allowed = set(annotated_prop2type) | {'name', 'dist', 'support'}
+        for node in test_tree_annotated.traverse():
+            self.assertLessEqual(set(node.props), allowed)
+        self.assertIn(test_tree_annotated['Internal_1'].props.get('alphabet_type'), ['vowel', 'consonant'])
+
+    def test_clear_extra_features(self):
+        test_tree = utils.ete4_parse("(A:1[&&NHX:col1=a:tmp=1],B:1[&&NHX:col1=b])Root;")
+        test_tree['B'].add_prop('states', {'x', 'y'})
+        utils.clear_extra_features([test_tree], ['col1', 'states'])
+        self.assertEqual(test_tree['A'].props.get('col1'), 'a')
+        self.assertNotIn('tmp', test_tree['A'].props)
+        self.assertEqual(sorted(test_tree['B'].props['states'].split(',')), ['x', 'y'])
+
+    def test_annotate_progress(self):
+        # stages are reported, and a progress function stops the annotation by raising
+        test_tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1)Internal_1:0.5)Internal_2:0.5)Root;")
+
+        with NamedTemporaryFile(suffix='.tsv') as f_annotation:
+            f_annotation.write(b'#name\talphabet_type\nA\tvowel\nB\tconsonant\nD\tconsonant\nE\tvowel\n')
+            f_annotation.flush()
+
+            metadata_dict, node_props, columns, prop2type = tree_annotate.parse_csv([f_annotation.name])
+
+        stages = []
+        tree_annotate.run_tree_annotate(test_tree.copy(), metadata_dict=metadata_dict,
+            node_props=node_props, columns=columns, prop2type=dict(prop2type),
+            progress=stages.append)
+        self.assertEqual(stages, ['annotating leaves', 'summarizing internal nodes',
+                                  'annotating taxonomy'])
+
+        class Cancelled(Exception):
+            pass
+        def cancel_at_summary(stage):
+            if stage == 'summarizing internal nodes':
+                raise Cancelled
+        with self.assertRaises(Cancelled):
+            tree_annotate.run_tree_annotate(test_tree.copy(), metadata_dict=metadata_dict,
+                node_props=node_props, columns=columns, prop2type=dict(prop2type),
+                progress=cancel_at_summary)
+
+    def test_annotate_data_matrix(self):
+        # clade statistics of a data matrix, leaves without data are not counted
+        test_tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1)Internal_1:0.5)Internal_2:0.5)Root;")
+        array_dict = {'matrix.tsv': {'A': [1.0, 10.0], 'B': [2.0, 20.0], 'E': [4.0, 40.0]}}
+
+        test_tree_annotated = tree_annotate.run_array_annotate(test_tree, array_dict, num_stat='all')
+
+        self.assertEqual(test_tree_annotated['E'].props.get('matrix.tsv'), [4.0, 40.0])
+        self.assertEqual(test_tree_annotated['Internal_1'].props.get('matrix.tsv_avg'), [4.0, 40.0])
+        self.assertEqual(test_tree_annotated['Internal_1'].props.get('matrix.tsv_std'), [0.0, 0.0])
+        self.assertEqual(test_tree_annotated['Internal_2'].props.get('matrix.tsv_sum'), [6.0, 60.0])
+        self.assertEqual(test_tree_annotated['Internal_2'].props.get('matrix.tsv_std'), [1.0, 10.0])
+        self.assertEqual(test_tree_annotated['Root'].props.get('matrix.tsv_min'), [1.0, 10.0])
+        self.assertEqual(test_tree_annotated['Root'].props.get('matrix.tsv_max'), [4.0, 40.0])
+
+    def test_annotate_data_matrix_file(self):
+        # matrix file loaded as array, non-numeric rows skipped, binary cache reused
+        test_tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1)Internal_1:0.5)Internal_2:0.5)Root;")
+
+        with TemporaryDirectory() as temp_dir:
+            matrix_file = os.path.join(temp_dir, 'matrix.tsv')
+            with open(matrix_file, 'w') as f:
+                f.write('A\t1\t10\nB\t2\t20\nD\tx\t30\nE\t4\t\n')
+            cache_dir = os.path.join(temp_dir, 'cache')
+
+            array_dict = tree_annotate.parse_tsv_to_array([matrix_file], cache_dir=cache_dir)
+            cached_array_dict = tree_annotate.parse_tsv_to_array([matrix_file], cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            self.assertEqual(cached_array_dict['matrix.tsv'].names, ['A', 'B', 'D', 'E'])
+            self.assertEqual(cached_array_dict['matrix.tsv'].get('A'), [1.0, 10.0])
+            self.assertIsNone(cached_array_dict['matrix.tsv'].get('D'))
+
+            test_tree_annotated = tree_annotate.run_array_annotate(test_tree, cached_array_dict, num_stat='all')
+
+        self.assertEqual(array_dict['matrix.tsv'].get('B'), [2.0, 20.0])
+        self.assertIsNone(test_tree_annotated['D'].props.get('matrix.tsv'))
+        self.assertEqual(test_tree_annotated['Internal_1'].props.get('matrix.tsv_avg')[0], 4.0)
+        self.assertEqual(test_tree_annotated['Internal_2'].props.get('matrix.tsv_sum')[0], 6.0)
+        self.assertEqual(test_tree_annotated['Root'].props.get('matrix.tsv_max')[0], 4.0)
+
+    def test_annotate_cache(self):
+        # annotated tree cached by content of inputs and options, least recently used evicted
+        test_tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1)Internal_1:0.5)Internal_2:0.5)Root;")
+
+        with TemporaryDirectory() as temp_dir:
+            metadata_file = os.path.join(temp_dir, 'metadata.tsv')
+            with open(metadata_file, 'w') as f:
+                f.write('#name\tcol1\nA\t1\nB\t2\nD\t3\nE\t4\n')
+            metadata_dict, node_props, columns, prop2type = tree_annotate.parse_csv([metadata_file])
+            test_tree_annotated, annotated_prop2type = tree_annotate.run_tree_annotate(test_tree,
+                metadata_dict=metadata_dict, node_props=node_props,
+                columns=columns, prop2type=prop2type)
+
+            cache_dir = os.path.join(temp_dir, 'cache')
+            key = annotation_cache.cache_key({'metadata': [metadata_file]}, {'num_stat': 'all'})
+            self.assertEqual(key, annotation_cache.cache_key({'metadata': [metadata_file]}, {'num_stat': 'all'}))
+            self.assertNotEqual(key, annotation_cache.cache_key({'metadata': [metadata_file]}, {'num_stat': 'avg'}))
+            self.assertIsNone(annotation_cache.load(cache_dir, key))
+
+            annotation_cache.store(cache_dir, key, test_tree_annotated, annotated_prop2type)
+            cached_tree, cached_prop2type = annotation_cache.load(cache_dir, key)
+            self.assertEqual(cached_tree.write(props=None, format_root_node=True),
+                test_tree_annotated.write(props=None, format_root_node=True))
+            self.assertEqual(cached_prop2type, annotated_prop2type)
+
+            with open(metadata_file, 'a') as f:
+                f.write('C\t5\n')
+            new_key = annotation_cache.cache_key({'metadata': [metadata_file]}, {'num_stat': 'all'})
+            self.assertNotEqual(key, new_key)
+
+            # a zero size limit keeps nothing
+            annotation_cache.store(cache_dir, new_key, test_tree_annotated, annotated_prop2type, max_size=0)
+            self.assertIsNone(annotation_cache.load(cache_dir, key))
+            self.assertIsNone(annotation_cache.load(cache_dir, new_key))
+
+            # output options don't change the key of a run
+            parser = argparse.ArgumentParser()
+            populate_main_args(parser)
+            tree_annotate.populate_annotate_args(parser)
+            argv = ['--tree', metadata_file, '--metadata', metadata_file]
+            run_key = tree_annotate.annotation_cache_key(parser.parse_args(argv))
+            self.assertEqual(run_key, tree_annotate.annotation_cache_key(
+                parser.parse_args(argv + ['--outdir', temp_dir, '--quiet', '--threads', '2'])))
+            self.assertNotEqual(run_key, tree_annotate.annotation_cache_key(
+                parser.parse_args(argv + ['--num-stat', 'avg'])))
+
+    def test_annotate_incremental(self):
+        # delta metadata gives the same tree as annotating the merged metadata
+        internal_parser = "name"
+        parser = utils.get_internal_parser(internal_parser)
+
+        def annotate(metadata):
+            test_tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1)Internal_1:0.5)Internal_2:0.5)Root;")
+            with NamedTemporaryFile(suffix='.tsv') as f_annotation:
+                f_annotation.write(metadata)
+                f_annotation.flush()
+                metadata_dict, node_props, columns, prop2type = tree_annotate.parse_csv([f_annotation.name])
+            return tree_annotate.run_tree_annotate(test_tree,
+                metadata_dict=metadata_dict, node_props=node_props,
+                columns=columns, prop2type=prop2type)
+
+        test_tree_annotated, annotated_prop2type = annotate(b'#name\tcol1\talphabet_type\nA\t1\tvowel\nB\t2\tconsonant\nD\t3\tconsonant\nE\t4\tvowel\n')
+        expected_tree, expected_prop2type = annotate(b'#name\tcol1\talphabet_type\tgroup\nA\t1\tvowel\tx\nB\t2\tconsonant\t\nD\t3\tconsonant\t\nE\t10\tvowel\ty\n')
+
+        with NamedTemporaryFile(suffix='.tsv') as f_delta:
+            f_delta.write(b'#name\tcol1\tgroup\nA\t1\tx\nE\t10\ty\n')
+            f_delta.flush()
+            delta_metadata_dict, delta_node_props, delta_columns, delta_prop2type = tree_annotate.parse_csv([f_delta.name])
+
+        test_tree_updated, updated_prop2type = tree_annotate.run_incremental_annotate(test_tree_annotated,
+            delta_metadata_dict, delta_node_props, annotated_prop2type, delta_prop2type=delta_prop2type)
+
+        props = ['col1', 'col1_sum', 'col1_max', 'col1_min', 'col1_std', 'col1_avg',
+            'alphabet_type', 'alphabet_type_counter', 'group', 'group_counter']
+        self.assertEqual(test_tree_updated.write(props=props, parser=parser, format_root_node=True),
+            expected_tree.write(props=props, parser=parser, format_root_node=True))
+        self.assertEqual(updated_prop2type, expected_prop2type)
+
+    def test_annotate_table_npz(self):
+        # columnar table export, selected back by columns and leaf rows
+        test_tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1)Internal_1:0.5)Internal_2:0.5)Root;")
+
+        with NamedTemporaryFile(suffix='.tsv') as f_annotation:
+            f_annotation.write(b'#name\talphabet_type\tcol1\nA\tvowel\t1\nB\tconsonant\t2\nD\tconsonant\t3\nE\tvowel\t4\n')
+            f_annotation.flush()
+
+            metadata_dict, node_props, columns, prop2type = tree_annotate.parse_csv([f_annotation.name])
+
+        test_tree_annotated, annotated_prop2type = tree_annotate.run_tree_annotate(test_tree, 
+            metadata_dict=metadata_dict, node_props=node_props, 
+            columns=columns, prop2type=prop2type)
+
+        with TemporaryDirectory() as temp_dir:
+            outfile = os.path.join(temp_dir, 'annotated.npz')
+            tree_annotate.tree2table(test_tree_annotated, outfile=outfile, table_format='npz')
+            leaves = table.read_table(outfile, columns=['name', 'alphabet_type', 'col1'], rows='leaf')
+            internals = table.read_table(outfile, columns=['name', 'alphabet_type_counter', 'col1_sum'], rows='internal')
+
+        self.assertEqual(leaves['name'].tolist(), ['A', 'B', 'E', 'D'])
+        self.assertEqual(leaves['alphabet_type'].tolist(), ['vowel', 'consonant', 'vowel', 'consonant'])
+        self.assertEqual(leaves['col1'].tolist(), [1.0, 2.0, 4.0, 3.0])
+        self.assertEqual(internals['name'].tolist(), ['Root', 'Internal_2', 'Internal_1'])
+        self.assertEqual(internals['alphabet_type_counter'].tolist(), ['consonant--2||vowel--2', 'consonant--2||vowel--1', 'consonant--1||vowel--1'])
+        self.assertEqual(internals['col1_sum'].tolist(), [10.0, 9.0, 7.0])
+
     def test_annotate_14_a(self):
         # test different numerical stats
         # load tree
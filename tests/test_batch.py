@@ -0,0 +1,41 @@
+import sys
+import os
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from treeprofiler import tree_batch
+
+class TestBatch(unittest.TestCase):
+    def test_manifest_01(self):
+        # one job per row, relative trees next to the manifest, outputs in outdir
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = os.path.join(tmpdir, 'manifest.tsv')
+            with open(manifest, 'w') as f:
+                f.write('# figures of the gene families\n'
+                        'TREE\tOUTPUT\tOPTIONS\n'
+                        'fam1.ete\tfam1.svg\t--heatmap-layout sample1 --collapsed-by "size < 5"\n'
+                        '/data/fam2.nw\tpng/fam2.png\n')
+            jobs = tree_batch.read_manifest(manifest, outdir='figures')
+
+        self.assertEqual(jobs, [
+            (os.path.join(tmpdir, 'fam1.ete'), 'figures/fam1.svg',
+             ['--heatmap-layout', 'sample1', '--collapsed-by', 'size < 5']),
+            ('/data/fam2.nw', 'figures/png/fam2.png', [])])
+
+        tree, output, options = jobs[0]
+        self.assertEqual(tree_batch.job_argv(tree, output, options, ['--color-config', 'c.tsv']),
+            ['--tree', tree, '--color-config', 'c.tsv', '--heatmap-layout', 'sample1',
+             '--collapsed-by', 'size < 5', '--render', '--render-file', 'figures/fam1.svg'])
+
+    def test_manifest_02(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = os.path.join(tmpdir, 'manifest.tsv')
+            with open(manifest, 'w') as f:
+                f.write('fam1.ete\tfam1.svg\n')
+            with self.assertRaises(ValueError):
+                tree_batch.read_manifest(manifest)
+
+if __name__ == '__main__':
+    unittest.main()
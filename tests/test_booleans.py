@@ -0,0 +1,63 @@
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from ete4 import Tree
+
+from treeprofiler.src.booleans import to_bool, bool_column, bool_counts, TRUE, FALSE, MISSING
+from treeprofiler.src.counters import CounterString
+from treeprofiler.src import ls, utils
+
+class TestBooleans(unittest.TestCase):
+    def test_to_bool_01(self):
+        # the representations of strtobool, missing values are None
+        for value in ['True', 'yes', ' Y ', 't', 'on', '1', 1, True]:
+            self.assertIs(to_bool(value), True)
+        for value in ['False', 'NO', 'n', 'f', 'off', '0', 0, False]:
+            self.assertIs(to_bool(value), False)
+        for value in [None, 'NaN', 'nan', float('nan'), 'None', '', 'maybe']:
+            self.assertIsNone(to_bool(value))
+
+        self.assertEqual(bool_column(['True', 'no', 'NaN', None, 'x']).tolist(),
+            [TRUE, FALSE, MISSING, MISSING, MISSING])
+        self.assertEqual(bool_column([]).tolist(), [])
+
+    def test_bool_counts_01(self):
+        # missing values count in the total unless told otherwise
+        self.assertEqual(bool_counts('True--3||False--1||NaN--1'), (3, 5))
+        self.assertEqual(bool_counts('True--3||False--1||NaN--1', count_missing=False), (3, 4))
+        self.assertEqual(bool_counts('yes--2||1--3||no--1', accumulate=True), (5, 6))
+        self.assertEqual(bool_counts('yes--2||1--3||no--1'), (3, 6))
+        self.assertEqual(bool_counts({'True': 2, 'False': 2}), (2, 4))
+        self.assertEqual(bool_counts(CounterString({'False': 1, 'True': 1})), (1, 2))
+        self.assertEqual(bool_counts(None), (0, 0))
+
+        tree = Tree('(A:1,B:1)root;', parser=1)
+        tree.add_prop('bool_type_counter', 'False--49||True--1')
+        self.assertEqual(utils.counter2ratio(tree, 'bool_type_counter'), 0.05)
+        tree.add_prop('bool_type_counter', 'False--1||True--3')
+        self.assertEqual(utils.counter2ratio(tree, 'bool_type_counter'), 0.75)
+
+    def test_ls_01(self):
+        # clade counts summed bottom-up, the same metrics as counting the leaves
+        tree = Tree('(((A:1,B:1)n1:1,C:1)n2:1,(D:1,E:1)n3:1)root;', parser=1)
+        for name, value in zip('ABCDE', ['True', 'yes', 'False', 'NaN', 'True']):
+            tree[name].add_prop('trait', value)
+        counts = ls.clade_trait_counts(tree, 'trait')
+        self.assertEqual(counts[tree], (3, 5))
+        self.assertEqual(counts[tree['n2']], (2, 3))
+        self.assertEqual(counts[tree['D']], (0, 1))
+        self.assertEqual(ls.get_total_trait(tree, 'trait'), 3)
+        for node in tree.traverse():
+            self.assertEqual(ls.calculate_metrics(node, 3, 'trait', counts),
+                             ls.calculate_metrics(node, 3, 'trait'))
+
+        best_node, qualified = ls.run_ls(tree, ['trait'], precision_cutoff=1, sensitivity_cutoff=0.6)
+        self.assertEqual(best_node.name, 'n1')
+        self.assertEqual([node.name for node in qualified], ['n1'])
+        self.assertEqual(tree['n2'].props.get('trait_prec'), 2/3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import sys
+import os
+import io
+import hashlib
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from treeprofiler.src.chunked_upload import ChunkedUploads, ChecksumError
+
+DATA = b'(A:1,(B:1,C:1):0.5);\n' * 10 # 210 bytes
+CHUNK_SIZE = 64
+
+def chunk(index):
+    return DATA[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]
+
+def checksum(data):
+    return hashlib.sha256(data).hexdigest()
+
+class TestChunkedUpload(unittest.TestCase):
+    def test_write_01(self):
+        # chunks in any order, assembled at their offsets
+        with tempfile.TemporaryDirectory() as tmpdir:
+            uploads = ChunkedUploads(tmpdir)
+            key = ('tree1', 'treeFile_tree.nw')
+            path = None
+            for index in [3, 1, 0, 2]:
+                self.assertIsNone(path)
+                path = uploads.write_chunk(key, index, 4, io.BytesIO(chunk(index)),
+                                           CHUNK_SIZE, len(DATA), checksum(chunk(index)))
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), DATA)
+            self.assertEqual(uploads.received(key), []) # done, not partial anymore
+
+            # without the file size, as sent by older pages
+            for index in range(4):
+                path = uploads.write_chunk(('tree2', 'f'), index, 4, io.BytesIO(chunk(index)),
+                                           CHUNK_SIZE)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), DATA)
+
+    def test_checksum_01(self):
+        # a corrupted chunk is not received, and its retry is
+        with tempfile.TemporaryDirectory() as tmpdir:
+            uploads = ChunkedUploads(tmpdir)
+            key = ('tree1', 'f')
+            uploads.write_chunk(key, 0, 4, io.BytesIO(chunk(0)), CHUNK_SIZE, len(DATA))
+            with self.assertRaises(ChecksumError):
+                uploads.write_chunk(key, 1, 4, io.BytesIO(b'x' * CHUNK_SIZE), CHUNK_SIZE,
+                                    len(DATA), checksum(chunk(1)))
+            self.assertEqual(uploads.received(key), [0]) # resumes from here
+
+            with self.assertRaises(ValueError):
+                uploads.write_chunk(key, 4, 4, io.BytesIO(b''), CHUNK_SIZE, len(DATA))
+            with self.assertRaises(ValueError):
+                uploads.write_chunk(key, 1, 4, io.BytesIO(b'x' * 65), CHUNK_SIZE, len(DATA))
+
+            for index in [1, 2, 3]:
+                path = uploads.write_chunk(key, index, 4, io.BytesIO(chunk(index)),
+                                           CHUNK_SIZE, len(DATA), checksum(chunk(index)))
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), DATA)
+
+    def test_checksum_02(self):
+        # a received chunk sent again corrupted keeps its good data
+        with tempfile.TemporaryDirectory() as tmpdir:
+            uploads = ChunkedUploads(tmpdir)
+            key = ('tree1', 'f')
+            for index in [0, 1, 2]:
+                uploads.write_chunk(key, index, 4, io.BytesIO(chunk(index)),
+                                    CHUNK_SIZE, len(DATA), checksum(chunk(index)))
+            with self.assertRaises(ChecksumError):
+                uploads.write_chunk(key, 1, 4, io.BytesIO(b'x' * CHUNK_SIZE), CHUNK_SIZE,
+                                    len(DATA), checksum(chunk(1)))
+            with self.assertRaises(ValueError):
+                uploads.write_chunk(key, 2, 4, io.BytesIO(b'x' * 65), CHUNK_SIZE, len(DATA))
+            self.assertEqual(uploads.received(key), [0, 1, 2])
+
+            path = uploads.write_chunk(key, 3, 4, io.BytesIO(chunk(3)), CHUNK_SIZE, len(DATA),
+                                       checksum(chunk(3)))
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), DATA)
+
+    def test_size_01(self):
+        # without checksums, short chunks are not taken as complete parts
+        with tempfile.TemporaryDirectory() as tmpdir:
+            uploads = ChunkedUploads(tmpdir)
+            key = ('tree1', 'f')
+            with self.assertRaises(ValueError):
+                uploads.write_chunk(key, 1, 4, io.BytesIO(chunk(1)[:10]), CHUNK_SIZE, len(DATA), '')
+            with self.assertRaises(ValueError):
+                uploads.write_chunk(key, 3, 4, io.BytesIO(chunk(3)[:-1]), CHUNK_SIZE, len(DATA))
+            self.assertEqual(uploads.received(key), [])
+
+            # the last chunk of a file of unknown size can be short, but not empty
+            with self.assertRaises(ValueError):
+                uploads.write_chunk(('tree2', 'f'), 3, 4, io.BytesIO(b''), CHUNK_SIZE)
+            uploads.write_chunk(('tree2', 'f'), 3, 4, io.BytesIO(chunk(3)), CHUNK_SIZE)
+            self.assertEqual(uploads.received(('tree2', 'f')), [3])
+
+    def test_cleanup_01(self):
+        # abandoned partial uploads are removed
+        with tempfile.TemporaryDirectory() as tmpdir:
+            uploads = ChunkedUploads(tmpdir, timeout=60)
+            uploads.write_chunk(('tree1', 'f'), 0, 4, io.BytesIO(chunk(0)), CHUNK_SIZE, len(DATA))
+            uploads.write_chunk(('tree2', 'f'), 0, 4, io.BytesIO(chunk(0)), CHUNK_SIZE, len(DATA))
+            self.assertEqual(len(os.listdir(tmpdir)), 2)
+
+            uploads.uploads[('tree1', 'f')].updated -= 120
+            uploads.cleanup()
+            self.assertEqual(uploads.received(('tree1', 'f')), [])
+            self.assertEqual(uploads.received(('tree2', 'f')), [0])
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+
+            uploads.discard(('tree2', 'f'))
+            self.assertEqual(os.listdir(tmpdir), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+import numpy as np
+
+from treeprofiler.src import utils
+from treeprofiler.src.color_scale import ColorScale, normalize
+
+class TestColorScale(unittest.TestCase):
+    def test_color_scale_01(self):
+        # same bin as the nearest gradient position, ties to the lower bin
+        gradient = utils.build_color_gradient(20, colormap_name='Reds')
+        values = np.concatenate((np.linspace(-2, 12, 1001), [0, 10, 5]))
+        for norm_method, (low, high) in [('min-max', (0, 1)), ('mean', (-1, 1)), ('zscore', (-3, 3))]:
+            mean_val, std_val = values.mean(), values.std()
+            scale = ColorScale(gradient, 0, 10, norm_method=norm_method, mean_val=mean_val, std_val=std_val)
+            positions = np.linspace(low, high, len(gradient))
+            normalized = normalize(values, 0, 10, norm_method, mean_val=mean_val, std_val=std_val)
+            expected = [np.abs(positions - v).argmin() + 1 for v in normalized]
+            self.assertEqual(scale.bins(values).tolist(), expected)
+            self.assertEqual(scale.get(values[10]), gradient[expected[10]])
+
+    def test_color_scale_02(self):
+        # value overrides, NaN and constant ranges
+        gradient = utils.build_color_gradient(20, colormap_name='Reds')
+        scale = ColorScale(gradient, 0, 1, value2color={1: '#E60A0A'}, nan_color='#EBEBEB')
+        self.assertEqual(scale.colors([0, 1, np.nan, 0.25]).tolist(),
+            [gradient[1], '#E60A0A', '#EBEBEB', gradient[6]])
+        self.assertEqual(scale.color_map([0.25, 1, 0, 0.25]), {0.0: gradient[1], 0.25: gradient[6], 1.0: '#E60A0A'})
+        self.assertEqual(scale.get(1.0), '#E60A0A')
+        self.assertEqual(scale.get('NaN'), '#EBEBEB')
+        self.assertEqual(scale.get('x', ''), '')
+
+        constant = ColorScale(gradient, 3, 3)
+        self.assertEqual(constant.bins([3, 3]).tolist(), [1, 1])
+
+        with self.assertRaises(ValueError):
+            ColorScale(gradient, 0, 1, norm_method='log')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import sys
+import os
+import math
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+import numpy as np
+import matplotlib as mpl
+import matplotlib.colors as mcolors
+import matplotlib.pyplot as plt
+
+from treeprofiler.src import utils
+
+class TestColors(unittest.TestCase):
+    def test_colors_01(self):
+        # same colors as the matplotlib conversions, one at a time or in arrays
+        def color_gradient(c1, c2, mix):
+            c1 = np.array(mpl.colors.to_rgb(c1))
+            c2 = np.array(mpl.colors.to_rgb(c2))
+            return mpl.colors.to_hex((1-mix)*c1 + mix*c2)
+
+        mixes = np.random.default_rng(0).random(2000)
+        expected = [color_gradient('#EBEBEB', '#971919', mix) for mix in mixes]
+        self.assertEqual(utils.blend_colors('#EBEBEB', '#971919', mixes).tolist(), expected)
+        self.assertEqual([utils.color_gradient('#EBEBEB', '#971919', mix) for mix in mixes], expected)
+        self.assertEqual(utils.color_gradient('white', 'red', 0.5), color_gradient('white', 'red', 0.5))
+
+        self.assertEqual(utils.rgb_to_hex([[0, 0.5, 1], [0.2, 0.4, 0.6]]).tolist(),
+            [mcolors.to_hex((0, 0.5, 1)), mcolors.to_hex((0.2, 0.4, 0.6))])
+        with self.assertRaises(ValueError):
+            utils.rgb_to_hex([1.5, 0, 0])
+
+    def test_colors_02(self):
+        # darkened colors
+        def darker_scaled(hex_color, positive, maximum):
+            position = positive / maximum if maximum != 0 else 0
+            log_position = min(math.log(1 + position * 9, 10) / math.log(10, 10), 0.6)
+            return mcolors.to_hex([(1 - log_position) * c for c in mcolors.hex2color(hex_color)])
+
+        positives = list(range(0, 301))
+        expected = [darker_scaled('#971919', p, 300) for p in positives]
+        self.assertEqual(utils.darken_colors_scaled('#971919', positives, 300).tolist(), expected)
+        self.assertEqual([utils.make_color_darker_scaled('#971919', p, 300) for p in positives], expected)
+        self.assertEqual(utils.make_color_darker_scaled('#971919', 0, 0), '#971919')
+        with self.assertRaises(ValueError):
+            utils.make_color_darker_scaled('#971919', 5, 3)
+        with self.assertRaises(ValueError):
+            utils.darken_colors_scaled('#971919', [1, 5], 3)
+
+    def test_gradients_01(self):
+        # gradients built from lookup tables
+        for n_colors in [2, 5, 20]:
+            cmap = plt.get_cmap('Reds')
+            expected = {i: mcolors.rgb2hex(cmap(x)) for i, x in enumerate(np.linspace(0, 1, n_colors), 1)}
+            self.assertEqual(utils.build_color_gradient(n_colors, colormap_name='Reds'), expected)
+
+        gradient = utils.build_custom_gradient(5, '#ffffff', '#ff0000')
+        self.assertEqual(gradient, {1: '#ffffff', 2: '#ffbfbf', 3: '#ff8080', 4: '#ff4040', 5: '#ff0000'})
+        gradient = utils.build_custom_gradient(6, 'blue', 'red', mid_color='white')
+        self.assertEqual(gradient, {1: '#0000ff', 2: '#8080ff', 3: '#ffffff',
+                                    4: '#ffffff', 5: '#ff8080', 6: '#ff0000'})
+
+        # cached gradients are copied, callers may change them
+        utils.build_color_gradient(5)[1] = 'black'
+        self.assertNotEqual(utils.build_color_gradient(5)[1], 'black')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import sys
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from treeprofiler.src.job_queue import JobQueue, COMPLETE, FAILED, CANCELLED, QUEUED
+
+def wait_for(queue, job_id, timeout=5):
+    """Wait until job_id is finished, return its status."""
+    deadline = time.time() + timeout
+    while queue.get(job_id).finished is None and time.time() < deadline:
+        time.sleep(0.01)
+    return queue.get(job_id).status
+
+class SlowResult:
+    """Result that takes until release is set to pickle."""
+
+    def __init__(self, pickling, release):
+        self.pickling = pickling
+        self.release = release
+
+    def __reduce__(self):
+        self.pickling.set()
+        self.release.wait(5)
+        return (str, ('saved',))
+
+class TestJobQueue(unittest.TestCase):
+    def test_run_01(self):
+        queue = JobQueue(workers=2, cpu_budget=4)
+        stages = []
+
+        def run(progress, cpus):
+            progress('annotating', 50)
+            stages.append((queue.get('t1').stage, queue.get('t1').percent, cpus))
+            return 'result'
+
+        queue.submit('t1', run, cpus=6) # more than the budget
+        self.assertEqual(wait_for(queue, 't1'), COMPLETE)
+        self.assertEqual(stages, [('annotating', 50, 4)])
+        self.assertEqual(queue.get('t1').result, 'result')
+        self.assertEqual(queue.get('t1').percent, 100)
+
+        def fail(progress, cpus):
+            raise ValueError('wrong tree')
+
+        queue.submit('t2', fail)
+        self.assertEqual(wait_for(queue, 't2'), FAILED)
+        self.assertEqual(queue.get('t2').error, 'ValueError: wrong tree')
+
+    def test_budget_01(self):
+        # jobs wait for their cpus, by priority then in order
+        queue = JobQueue(workers=3, cpu_budget=2)
+        release = threading.Event()
+        order = []
+
+        def run(progress, cpus):
+            order.append(cpus)
+            release.wait(5)
+
+        queue.submit('big', run, cpus=2)
+        time.sleep(0.1)
+        queue.submit('low', run, cpus=1)
+        queue.submit('high', run, cpus=1, priority=1)
+        self.assertEqual(queue.position('high'), 0)
+        self.assertEqual(queue.position('low'), 1)
+        self.assertEqual(queue.get('low').status, QUEUED) # only 'big' runs
+
+        # a queued job is cancelled without running
+        self.assertTrue(queue.cancel('low'))
+        self.assertEqual(queue.get('low').status, CANCELLED)
+        self.assertFalse(queue.cancel('low'))
+        with self.assertRaises(ValueError):
+            queue.submit('big', run)
+
+        release.set()
+        for job_id in ['big', 'high']:
+            self.assertEqual(wait_for(queue, job_id), COMPLETE)
+        self.assertEqual(order, [2, 1])
+        self.assertEqual(queue.free_cpus, 2)
+
+    def test_cancel_01(self):
+        # a running job stops at its next progress report
+        queue = JobQueue(workers=1)
+        started = threading.Event()
+        cancelled = threading.Event()
+
+        def run(progress, cpus):
+            progress('parsing', 10)
+            started.set()
+            cancelled.wait(5)
+            progress('annotating', 50)
+            return 'never'
+
+        queue.submit('t1', run)
+        started.wait(5)
+        self.assertTrue(queue.cancel('t1'))
+        cancelled.set()
+        self.assertEqual(wait_for(queue, 't1'), CANCELLED)
+        self.assertEqual(queue.get('t1').percent, 10)
+        self.assertIsNone(queue.get('t1').result)
+
+    def test_persistence_01(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = JobQueue(workers=1, state_dir=tmpdir)
+            queue.submit('a/b', lambda progress, cpus: {'prop2type': {'size': float}})
+            self.assertEqual(wait_for(queue, 'a/b'), COMPLETE)
+
+            # a job still queued when the server stops
+            blocked = JobQueue(workers=0, state_dir=tmpdir)
+            blocked.submit('t2', lambda progress, cpus: None)
+
+            restarted = JobQueue(workers=1, state_dir=tmpdir)
+            self.assertEqual(restarted.get('a/b').status, COMPLETE)
+            self.assertEqual(restarted.get('a/b').result, {'prop2type': {'size': float}})
+            self.assertEqual(restarted.get('t2').status, FAILED)
+            self.assertEqual(restarted.get('t2').error, "interrupted by a restart of the server")
+
+    def test_save_unlocked_01(self):
+        # the queue is not blocked while a finished job is written
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = JobQueue(workers=1, state_dir=tmpdir)
+            pickling, release = threading.Event(), threading.Event()
+            queue.submit('slow', lambda progress, cpus: SlowResult(pickling, release))
+            self.assertTrue(pickling.wait(5))
+            submitted = queue.get('slow').saved
+
+            start = time.time()
+            self.assertEqual(queue.get('slow').status, COMPLETE)
+            queue.submit('t2', lambda progress, cpus: None) # the worker is saving
+            self.assertEqual(queue.position('t2'), 0)
+            queue.cancel('t2')
+            self.assertEqual(queue.get('t2').status, CANCELLED)
+            self.assertLess(time.time() - start, 2)
+            self.assertFalse(release.is_set())
+
+            release.set()
+            deadline = time.time() + 5
+            while queue.get('slow').saved == submitted and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(JobQueue(workers=0, state_dir=tmpdir).get('slow').result, 'saved')
+
+    def test_retention_01(self):
+        # only the most recent finished jobs are kept, in memory and on disk
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = JobQueue(workers=0, state_dir=tmpdir, max_finished=2)
+            for job_id in ['t1', 't2', 't3']: # finished as they are cancelled
+                queue.submit(job_id, lambda progress, cpus: None)
+                queue.cancel(job_id)
+            self.assertEqual(sorted(queue.jobs), ['t2', 't3'])
+            self.assertEqual(len(os.listdir(tmpdir)), 2)
+
+            # and only the recent enough ones, also when loaded back
+            restarted = JobQueue(workers=0, state_dir=tmpdir)
+            self.assertEqual(sorted(restarted.jobs), ['t2', 't3'])
+            restarted = JobQueue(workers=0, state_dir=tmpdir, max_age=0)
+            self.assertEqual(restarted.jobs, {})
+            self.assertEqual(os.listdir(tmpdir), [])
+
+    def test_private_state_dir_01(self):
+        # jobs are unpickled, so only from a directory no one else can write to
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_dir = os.path.join(tmpdir, 'jobs')
+            JobQueue(workers=0, state_dir=state_dir)
+            self.assertEqual(os.stat(state_dir).st_mode & 0o777, 0o700)
+
+            os.chmod(state_dir, 0o777)
+            with self.assertRaises(PermissionError):
+                JobQueue(workers=0, state_dir=state_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+import numpy as np
+
+from ete4 import Tree
+
+from treeprofiler.src.matrix import NodeMatrix, presence_matrix
+
+class TestNodeMatrix(unittest.TestCase):
+    def test_node_matrix_01(self):
+        # ragged rows are padded, None is missing
+        matrix = NodeMatrix.from_rows({'root': [0.5], 'A': [1, None], 'B': ['2', '3']})
+        self.assertEqual(matrix.names, ['root', 'A', 'B'])
+        self.assertEqual(matrix.values.dtype, np.float64)
+        self.assertEqual(matrix.ncols, 2)
+        self.assertEqual(matrix.row('B').tolist(), [2.0, 3.0])
+        self.assertTrue(np.isnan(matrix.row('root')[1]))
+        self.assertTrue(np.isnan(matrix.get('A')[1]))
+        self.assertIsNone(matrix.row('C'))
+        self.assertEqual(matrix.get('C', []), [])
+        self.assertIn('A', matrix)
+        self.assertEqual(len(matrix), 3)
+
+    def test_node_matrix_02(self):
+        # categorical values
+        matrix = NodeMatrix.from_rows({'A': ['x', None], 'B': ['y']}, dtype=object, fill='NaN')
+        self.assertEqual(matrix.get('A'), ['x', 'NaN'])
+        self.assertEqual(matrix.get('B'), ['y', 'NaN'])
+
+        empty = NodeMatrix.from_rows({})
+        self.assertEqual(empty.ncols, 0)
+        self.assertFalse(empty)
+
+    def test_presence_matrix_01(self):
+        # leaves have presence, internal nodes ratios summed bottom-up
+        tree = Tree('((A:1,B:1)n1:1,(C:1,(D:1,E:1)n3:1)n2:1)root;', parser=1)
+        leaf2columns = {'A': [0, 1], 'B': [1], 'C': [2], 'D': [0]}
+        matrix = presence_matrix(tree, lambda leaf: leaf2columns.get(leaf.name), 3,
+            has_row=lambda node: node.name != 'n3')
+        self.assertEqual(matrix.names, ['root', 'n1', 'n2', 'A', 'B', 'C', 'D'])
+        self.assertEqual(matrix.values.shape, (7, 3))
+        self.assertEqual(matrix.get('A'), [1.0, 1.0, 0.0])
+        self.assertEqual(matrix.get('n1'), [1/3, 2/3, 0.0])
+        self.assertEqual(matrix.get('n2'), [0.5, 0.0, 0.5])
+        self.assertEqual(matrix.get('root'), [0.4, 0.4, 0.2])
+        self.assertIsNone(matrix.row('n3'))
+        self.assertIsNone(matrix.row('E'))
+        self.assertEqual(matrix.values.nnz, 12)
+
+    def test_presence_matrix_02(self):
+        # small ratios are raised to the minimum
+        tree = Tree('(' + ','.join(f'L{i}:1' for i in range(30)) + ')root;', parser=1)
+        matrix = presence_matrix(tree, lambda leaf: [0] if leaf.name == 'L0' else [1], 2)
+        self.assertEqual(matrix.get('root'), [0.05, 29/30])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+import numpy as np
+from scipy import sparse
+
+from treeprofiler.src.mipmap import (ProfileMipmap, MipmapCache, representatives,
+    sparse_representatives, majorities)
+
+class TestMipmap(unittest.TestCase):
+    def test_mipmap_01(self):
+        # numerical blocks take the value closest to their mean
+        self.assertEqual(representatives([1, 2, 3, np.nan, np.nan], 2).tolist()[:2], [1, 3])
+        self.assertTrue(np.isnan(representatives([1, 2, 3, np.nan, np.nan], 2)[2]))
+
+        mipmap = ProfileMipmap([0.0, 1.0, None, 0.5, 0.2, 0.9, 0.1])
+        values, start, end = mipmap.get(0, 7, 100)
+        self.assertEqual(values[:2], [0.0, 1.0])
+        self.assertEqual((start, end), (0, 7))
+        self.assertEqual(mipmap.get(0, 7, 3), ([0.5, 0.2], 0, 7))
+        self.assertEqual(mipmap.get(0, 7, 1), ([0.5], 0, 7))
+
+        mipmap = ProfileMipmap(sparse.csr_matrix(np.array([[0, 1, 1, 1, 0, 0, 0.5, 0]])))
+        self.assertEqual(mipmap.get(0, 8, 2), ([1.0, 0.0], 0, 8))
+
+    def test_mipmap_02(self):
+        # categorical blocks take their most frequent value
+        self.assertEqual(majorities([2, 0, 0, 1, 1, 2, 2, 2], 3).tolist(), [0, 1, 2])
+
+        mipmap = ProfileMipmap('aabbbcx-', categorical=True)
+        self.assertEqual(mipmap.get(0, 8, 4), (['a', 'b', 'b', '-'], 0, 8))
+        self.assertEqual(mipmap.get(0, 8, 2), (['a', '-'], 0, 8))
+        self.assertEqual(mipmap.get(3, 8, 1), (['b'], 0, 8))
+
+        mipmap = ProfileMipmap(['x', 1, 1, 'y'], categorical=True)
+        self.assertEqual(mipmap.get(0, 4, 1), ([1], 0, 4))
+
+    def test_mipmap_03(self):
+        # at most npx blocks spanning the window
+        rng = np.random.default_rng(0)
+        for _ in range(100):
+            length = int(rng.integers(1, 3000))
+            mipmap = ProfileMipmap(rng.random(length))
+            start = int(rng.integers(0, length))
+            end = int(rng.integers(start + 1, length + 1))
+            npx = int(rng.integers(1, 500))
+            values, first, last = mipmap.get(start, end, npx)
+            self.assertLessEqual(len(values), npx)
+            self.assertLessEqual(first, start)
+            self.assertGreaterEqual(last, end)
+
+    def test_mipmap_sparse_01(self):
+        # sparse profiles give the same summaries as their dense rows
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            length, size = int(rng.integers(1, 80)), int(rng.integers(1, 20))
+            dense = np.zeros(length)
+            present = rng.random(length) < rng.random()
+            dense[present] = rng.choice([0.125, 0.25, 0.5, 1.0, np.nan], present.sum())
+            indices = np.flatnonzero(dense != 0)
+            np.testing.assert_array_equal(sparse_representatives(indices, dense[indices], length, size),
+                                          representatives(dense, size))
+
+        # without keeping the dense row
+        row = sparse.csr_matrix(([0.5, 1.0], ([0, 0], [3, 19998])), shape=(1, 20000))
+        mipmap = ProfileMipmap(row)
+        values, start, end = mipmap.get(0, 20000, 100)
+        self.assertEqual((len(values), start, end), (79, 0, 20000))
+        self.assertEqual(mipmap.get(0, 8, 8), ([0, 0, 0, 0.5, 0, 0, 0, 0], 0, 8))
+        self.assertNotIn(0, mipmap.levels)
+        self.assertTrue(all(len(level) <= 10000 for level in mipmap.levels.values()))
+
+    def test_mipmap_cache_01(self):
+        cache = MipmapCache(maxsize=2)
+        first = cache.get(0, [1.0, 2.0])
+        self.assertIs(cache.get(0, [1.0, 2.0]), first)
+        cache.get(1, [3.0])
+        cache.get(0, [1.0, 2.0]) # 1 is the least recently used now
+        cache.get(2, [4.0])
+        self.assertEqual(list(cache.mipmaps), [0, 2])
+
+        # any value made on demand, like a sequence with its mipmap
+        made = []
+        def make():
+            made.append(1)
+            return 'seq', ProfileMipmap([1.0])
+        self.assertIs(cache.get_or_make('A', make), cache.get_or_make('A', make))
+        self.assertEqual(len(made), 1)
+        self.assertEqual(len(cache), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from ete4 import Tree
+
+from treeprofiler.src import utils
+from treeprofiler.src.tree_store import copy_tree
+from treeprofiler.src.payloads import (NodePayloads, Payload, prepare_layouts,
+    counter_data, counter_tooltip, tooltip_html, heatmap_color,
+    aggregated_heatmap_color, node_tooltip)
+
+class TestPayloads(unittest.TestCase):
+    def test_node_payloads_01(self):
+        # payloads are computed once per node
+        tree = Tree('((A:1,B:1)n1:1,C:1)root;', parser=1)
+        calls = []
+        def compute(node):
+            calls.append(node.name)
+            return Payload('text', text=node.name.lower())
+
+        payloads = NodePayloads(compute)
+        self.assertEqual(payloads.get(tree['A']).text, 'a')
+        self.assertEqual(payloads.get(tree['A']).kind, 'text')
+        payloads.prepare(tree)
+        self.assertEqual(len(payloads), 5)
+        self.assertEqual(sorted(calls), ['A', 'B', 'C', 'n1', 'root'])
+        for _ in range(3):
+            for node in tree.traverse():
+                payloads.get(node)
+        self.assertEqual(len(calls), 5)
+        self.assertIn(tree['n1'], payloads)
+
+        class Layout:
+            pass
+        layout = Layout()
+        layout.payloads = NodePayloads(compute)
+        prepare_layouts(tree, [layout, lambda node: None])
+        self.assertEqual(len(layout.payloads), 5)
+
+    def test_shared_payloads_01(self):
+        # copies of a version share the payloads, a new version replaces them
+        tree = Tree('((A:1,B:1)n1:1,C:1)root;', parser=1)
+        calls = []
+        def compute(node):
+            calls.append(node.name)
+            return Payload('text', text=node.name.lower())
+
+        payloads = NodePayloads(compute).prepare(tree, version='v1')
+        copy = copy_tree(tree)
+        self.assertEqual(payloads.get(copy['n1']).text, 'n1') # not prepared, not kept
+        self.assertEqual(len(payloads.table.roots), 1)
+        payloads.prepare(copy, version='v1')
+        self.assertEqual(len(calls), 6) # not computed again for the copy
+        self.assertEqual(len(payloads.table.payloads), 5)
+        self.assertEqual(len(payloads.table.roots), 2)
+
+        pruned = copy_tree(tree)
+        pruned.prune(['A', 'C'])
+        payloads.prepare(pruned, version='v2')
+        self.assertEqual(len(payloads.table.payloads), 3)
+        self.assertEqual(list(payloads.table.roots), [pruned])
+        self.assertNotIn(tree['A'], payloads)
+
+        # without a version, every tree prepared is a new version
+        payloads.prepare(pruned)
+        payloads.prepare(copy_tree(pruned))
+        self.assertEqual(len(payloads.table.roots), 1)
+
+        # with none prepared, the first tree drawn keeps the payloads
+        payloads.clear()
+        self.assertEqual(payloads.get(tree['A']).text, 'a')
+        self.assertIn(tree['A'], payloads)
+        self.assertEqual(payloads.get(copy['A']).text, 'a')
+        self.assertNotIn(copy['A'], payloads)
+        payloads.prepare(tree, version='v3') # takes the payloads drawn
+        self.assertEqual(payloads.table.version, 'v3')
+        self.assertEqual(len(payloads), 5)
+
+    def test_counter_data_01(self):
+        tree = Tree('((A:1,B:1)n1:1,C:1)root;', parser=1)
+        tree['n1'].add_prop('alphabet_type_counter', 'vowel--2||consonant--1')
+        data = counter_data(tree['n1'], 'alphabet_type_counter', {'vowel': 'red'})
+        self.assertEqual(data, [['vowel', 2, 'red', None], ['consonant', 1, '#EBEBEB', None]])
+        self.assertEqual(counter_tooltip(tree['n1'], 'alphabet_type_counter'),
+            '<b>n1</b><br><b>vowel</b>:  2/3<br><b>consonant</b>:  1/3<br>')
+        self.assertIsNone(counter_data(tree['A'], 'alphabet_type_counter'))
+        self.assertEqual(counter_tooltip(tree['A'], 'alphabet_type_counter'), '')
+
+        self.assertEqual(node_tooltip(tree['A'], ('col1', 0.5)), '<b>A</b><br><br>col1: 0.5<br>')
+
+    def test_tooltips_01(self):
+        # tooltips are generated from their keys on first use only
+        tree = Tree('((A:1,B:1)n1:1,C:1)root;', parser=1)
+        tree['n1'].add_prop('alphabet_type_counter', 'vowel--2||consonant--1')
+        payloads = NodePayloads(lambda node: Payload('counter', tooltip='alphabet_type_counter')
+            if node.name == 'n1' else Payload('prop', tooltip=(('col1', node.name),)))
+        payloads.prepare(tree)
+        self.assertEqual(payloads.table.tooltips, [None] * 5)
+        self.assertEqual(payloads.tooltip(tree['n1']), counter_tooltip(tree['n1'], 'alphabet_type_counter'))
+        self.assertEqual(payloads.tooltip(tree['A']), '<b>A</b><br><br>col1: A<br>')
+        self.assertEqual(sum(1 for t in payloads.table.tooltips if t is not None), 2)
+
+        self.assertEqual(tooltip_html(tree['A'], None), '')
+        self.assertEqual(tooltip_html(tree['A'], ()), '<b>A</b><br>')
+
+    def test_heatmap_colors_01(self):
+        self.assertEqual(heatmap_color(3, 6), utils.color_gradient("#EBEBEB", "#971919", mix=0.5))
+        self.assertEqual(heatmap_color(1, 100), utils.color_gradient("#EBEBEB", "#971919", mix=0.05))
+        self.assertEqual(heatmap_color(6, 6, reverse=True), utils.color_gradient("#EBEBEB", "#971919", mix=0))
+        self.assertEqual(aggregated_heatmap_color(0, 10), "#EBEBEB")
+        self.assertEqual(aggregated_heatmap_color(5, 10),
+            utils.make_color_darker_scaled("#971919", 5, 10, base=10, scale_factor=10))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -190,6 +190,70 @@ class TestPrune(unittest.TestCase):
 
         self.assertEqual(pruned_tree.write(props=props, parser=parser, format_root_node=True), expected_tree)
 
+    def test_pruned_by_07(self):
+        # test multiple conditions, all of them need to be fulfilled
+        internal_parser = "name"
+        parser = utils.get_internal_parser(internal_parser)
+
+        test_tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1)Internal_1:0.5)Internal_2:0.5)Root;")
+
+        with NamedTemporaryFile(suffix='.tsv') as f_annotation:
+            f_annotation.write(b'#name\talphabet_type\nA\tvowel\nB\tconsonant\nD\tconsonant\nE\tvowel\n')
+            f_annotation.flush()
+
+            metadata_dict, node_props, columns, prop2type = tree_annotate.parse_csv([f_annotation.name])
+
+        test_tree_annotated, annotated_prop2type = tree_annotate.run_tree_annotate(test_tree, 
+            metadata_dict=metadata_dict, node_props=node_props, 
+            columns=columns, prop2type=prop2type)
+
+        expected_tree = '(A:1[&&NHX:alphabet_type=vowel],(B:1[&&NHX:alphabet_type=consonant],(E:1[&&NHX:alphabet_type=vowel])Internal_1:0.5[&&NHX:alphabet_type_counter=consonant--1||vowel--1])Internal_2:0.5[&&NHX:alphabet_type_counter=consonant--2||vowel--1])Root[&&NHX:alphabet_type_counter=consonant--2||vowel--2];'
+        props = ['alphabet_type', 'alphabet_type_counter']
+        condition_inputs = ["alphabet_type=consonant", "name contains D"]
+        pruned_tree = utils.conditional_prune(test_tree_annotated, condition_inputs, prop2type)
+
+        self.assertEqual(pruned_tree.write(props=props, parser=parser, format_root_node=True), expected_tree)
+
+    def test_pruned_by_08(self):
+        # test AND/OR query syntax with grouping
+        internal_parser = "name"
+        parser = utils.get_internal_parser(internal_parser)
+
+        test_tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1)Internal_1:0.5)Internal_2:0.5)Root;")
+
+        with NamedTemporaryFile(suffix='.tsv') as f_annotation:
+            f_annotation.write(b'#name\talphabet_type\nA\tvowel\nB\tconsonant\nD\tconsonant\nE\tvowel\n')
+            f_annotation.flush()
+
+            metadata_dict, node_props, columns, prop2type = tree_annotate.parse_csv([f_annotation.name])
+
+        test_tree_annotated, annotated_prop2type = tree_annotate.run_tree_annotate(test_tree, 
+            metadata_dict=metadata_dict, node_props=node_props, 
+            columns=columns, prop2type=prop2type)
+
+        expected_tree = '((B:1[&&NHX:alphabet_type=consonant],(E:1[&&NHX:alphabet_type=vowel])Internal_1:0.5[&&NHX:alphabet_type_counter=consonant--1||vowel--1])Internal_2:0.5[&&NHX:alphabet_type_counter=consonant--2||vowel--1])Root[&&NHX:alphabet_type_counter=consonant--2||vowel--2];'
+        props = ['alphabet_type', 'alphabet_type_counter']
+        condition_inputs = ["name=A OR (alphabet_type=consonant AND name contains D)"]
+        pruned_tree = utils.conditional_prune(test_tree_annotated, condition_inputs, prop2type)
+
+        self.assertEqual(pruned_tree.write(props=props, parser=parser, format_root_node=True), expected_tree)
+
+    def test_pruned_by_09(self):
+        # a malformed condition is reported and exits instead of crashing
+        test_tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1)Internal_1:0.5)Internal_2:0.5)Root;")
+
+        with NamedTemporaryFile(suffix='.tsv') as f_annotation:
+            f_annotation.write(b'#name\talphabet_type\nA\tvowel\nB\tconsonant\nD\tconsonant\nE\tvowel\n')
+            f_annotation.flush()
+
+            metadata_dict, node_props, columns, prop2type = tree_annotate.parse_csv([f_annotation.name])
+
+        with self.assertLogs(tree_annotate.logger, level='ERROR'), self.assertRaises(SystemExit):
+            tree_annotate.run_tree_annotate(test_tree,
+                metadata_dict=metadata_dict, node_props=node_props,
+                columns=columns, prop2type=prop2type,
+                pruned_by=["alphabet_type=vowel,consonant"])
+
 if __name__ == '__main__':
     unittest.main()
 #pytest.main(['-v'])
\ No newline at end of file
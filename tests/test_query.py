@@ -0,0 +1,54 @@
+
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from treeprofiler.src import utils
+from treeprofiler.src.columns import PropertyColumns
+from treeprofiler.src.query import (parse_query, compile_query, query_mask,
+    Comparison, And, Or, QueryError)
+
+class TestQuery(unittest.TestCase):
+    def test_parse_query(self):
+        self.assertEqual(parse_query("sample1 >= 0.5"), Comparison('sample1', '>=', '0.5', None))
+        self.assertEqual(parse_query("A in list_data"), Comparison('list_data', 'in', 'A', None))
+        self.assertEqual(parse_query("random_type_counter:high > 0.35"),
+            Comparison('random_type_counter', '>', '0.35', 'high'))
+        # AND binds tighter than OR, ',' and ';' are aliases
+        self.assertEqual(parse_query("a=1,b=2;c=3"), parse_query("a=1 AND b=2 OR c=3"))
+        self.assertEqual(parse_query("(a=1 OR b=2) AND c=3"),
+            And([Or([Comparison('a', '=', '1', None), Comparison('b', '=', '2', None)]),
+                Comparison('c', '=', '3', None)]))
+        # parentheses inside values are kept
+        self.assertEqual(parse_query("desc contains (putative)"),
+            Comparison('desc', 'contains', '(putative)', None))
+        with self.assertRaises(QueryError):
+            parse_query("(a=1 OR b=2")
+
+    def test_mask_and_closure(self):
+        tree = utils.ete4_parse("(A:1,(B:1,(E:1,D:1)Internal_1:0.5)Internal_2:0.5)Root;")
+        values = {'A': 0, 'B': 1, 'E': 2, 'D': 3}
+        for leaf in tree.leaves():
+            leaf.add_prop('sample1', values[leaf.name])
+        tree['Internal_1'].add_prop('alphabet_type_counter', 'consonant--1||vowel--1')
+        tree['Internal_2'].add_prop('alphabet_type_counter', 'consonant--2||vowel--1')
+        prop2type = {'sample1': float, 'alphabet_type_counter': str}
+
+        columns = PropertyColumns(tree.traverse())
+        queries = {
+            "sample1 = 0": ['A'],
+            "sample1 > 1 OR name = B": ['B', 'E', 'D'],
+            "(sample1 < 1 OR sample1 > 2) AND name != A": ['D'],
+            "alphabet_type_counter:consonant >= 2": ['Internal_2'],
+            "name contains Internal; sample1 contains 1": ['Internal_2', 'Internal_1'],
+        }
+        for query, expected in queries.items():
+            mask = query_mask(query, columns, prop2type)
+            predicate = compile_query(query, prop2type)
+            self.assertEqual(sorted(n.name for n, m in zip(columns.nodes, mask) if m), sorted(expected))
+            self.assertEqual(sorted(n.name for n in columns.nodes if predicate(n)), sorted(expected))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import sys
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from treeprofiler.src.graphics import (Shape, panel_shapes, bounds, to_svg,
+    to_png, write_image)
+
+# graphic elements as yielded by the smartview drawers, in tree coordinates
+GRAPHICS = [
+    ['line', (0, 0.5), (2, 0.5), '', [], {'stroke': 'red', 'type': 'dashed'}],
+    ['rect', (2, 0, 1, 1), 'face', '', {}, {'fill': '#0000ff'}],
+    ['text', (0, 1, 3, 1), 'A<B', '', 0, '', {'max_fsize': 12, 'ftype': 'mono'}],
+    ['array', (3, 0, 2, 1), ['red', 'red', None, 'blue'], ''],
+    ['nodebox', (0, 0, 3, 2), 'n1', {}, [], [], {}],
+]
+
+class TestRender(unittest.TestCase):
+    def test_panel_shapes_01(self):
+        # elements scaled by the zoom into pixels, interaction elements dropped
+        shapes = list(panel_shapes(GRAPHICS, zoom=(10, 20), offset=(5, 0)))
+        self.assertEqual([s.kind for s in shapes], ['line', 'rect', 'text', 'rect', 'rect'])
+
+        line, rect, text, run1, run2 = shapes
+        self.assertEqual(line.geometry, (5, 10, 25, 10))
+        self.assertEqual(line.style, {'stroke': 'red', 'stroke-dasharray': '5,5'})
+        self.assertEqual(rect.geometry, (25, 0, 10, 20))
+
+        x, y, content, fs, anchor, rotation = text.geometry
+        self.assertEqual((x, content, fs, anchor), (5, 'A<B', 12, 'start'))
+        self.assertEqual(text.style, {'font-family': 'mono'})
+
+        # runs of equal colors of arrays are drawn as one rectangle
+        self.assertEqual(run1, Shape('rect', (35, 0, 10, 20), {'fill': 'red'}))
+        self.assertEqual(run2, Shape('rect', (50, 0, 5, 20), {'fill': 'blue'}))
+
+        self.assertEqual(bounds(shapes)[:2], (5, 0))
+        self.assertEqual(bounds([]), (0, 0, 0, 0))
+
+    def test_panel_shapes_02(self):
+        # texts are fitted in their boxes, and not drawn when too small
+        graphics = [['text', (0, 0, 1, 1), 'long name', '', 0, '', {}],
+                    ['text', (0, 0, 0.01, 1), 'tiny', '', 0, '', {}],
+                    ['text', (0, 0, 3, 1), 'end', '', 0, '', {'text_anchor': 'right'}]]
+        fitted, right = panel_shapes(graphics, zoom=(20, 30))
+        self.assertAlmostEqual(fitted.geometry[3], 20 / (0.6 * 9))
+        self.assertEqual((right.geometry[0], right.geometry[4]), (60, 'end'))
+
+    def test_svg_01(self):
+        # a valid svg, the same for the same elements
+        shapes = list(panel_shapes(GRAPHICS, zoom=(10, 20)))
+        svg = to_svg(shapes)
+        self.assertEqual(svg, to_svg(panel_shapes(GRAPHICS, zoom=(10, 20))))
+
+        root = ET.fromstring(svg)
+        ns = '{http://www.w3.org/2000/svg}'
+        self.assertEqual(root.tag, ns + 'svg')
+        self.assertEqual([e.tag[len(ns):] for e in root],
+                         ['rect', 'line', 'rect', 'text', 'rect', 'rect'])
+        self.assertEqual(root[3].text, 'A<B')
+        self.assertEqual(root[1].get('stroke-dasharray'), '5,5')
+
+        xmin, ymin, xmax, ymax = bounds(shapes)
+        self.assertEqual(root.get('viewBox').split()[:2], [str(xmin - 10), str(ymin - 10)])
+
+        # tiles keep their box, whatever they contain
+        root = ET.fromstring(to_svg(shapes, box=(0, 0, 256, 256), background=None))
+        self.assertEqual(root.get('viewBox'), '0 0 256 256')
+        self.assertEqual(len(root), len(shapes))
+
+    def test_png_01(self):
+        shapes = [Shape('rect', (0, 0, 10, 10), {'fill': '#0000ff'}),
+                  Shape('line', (0, 20, 10, 20), {'stroke': 'red'})]
+        image = to_png(shapes, margin=5, scale=2)
+        self.assertEqual(image.size, (40, 60))
+        self.assertEqual(image.getpixel((20, 20)), (0, 0, 255, 255))
+        self.assertEqual(image.getpixel((20, 50)), (255, 0, 0, 255))
+        self.assertEqual(image.getpixel((2, 2)), (255, 255, 255, 255))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            write_image(shapes, os.path.join(tmpdir, 'tree.svg'))
+            write_image(shapes, os.path.join(tmpdir, 'tree.png'))
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['tree.png', 'tree.svg'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -171,6 +171,16 @@ class TestGTDBTaxonomy(unittest.TestCase):
         self.assertEqual(pruned_tree.write(props=props, parser=1), expected_tree_no_root)
         self.assertEqual(pruned_tree.write(props=props, parser=1, format_root_node=True), expected_tree_with_root)
 
+    def test_evol_events(self):
+        # species overlap, including a polytomy
+        test_tree = utils.ete4_parse("((a.1:1,(b.1:1,a.2:1)N2:1)N1:1,(c.1:1,c.2:1,d.1:1)N3:1,b.2:1)Root;", internal_parser="name")
+        test_tree_annotated = tree_annotate.annotate_evol_events(test_tree, sp_delimiter='.', sp_field=0)
+
+        props = ['evoltype', 'dup_sp', 'dup_percent']
+        expected_tree = '((a.1:1,(b.1:1,a.2:1)N2:1[&&NHX:evoltype=S])N1:1[&&NHX:evoltype=D:dup_sp=a:dup_percent=50.0],(c.1:1,c.2:1,d.1:1)N3:1[&&NHX:evoltype=D:dup_sp=c:dup_percent=50.0],b.2:1)Root[&&NHX:evoltype=D:dup_sp=b:dup_percent=25.0];'
+        self.assertEqual(test_tree_annotated.write(props=props, parser=1, format_root_node=True), expected_tree)
+        self.assertEqual(test_tree_annotated['a.1'].props.get('species'), {'a'})
+
 if __name__ == '__main__':
     unittest.main()
 #pytest.main(['-v'])
\ No newline at end of file
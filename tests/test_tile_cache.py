@@ -0,0 +1,83 @@
+import sys
+import os
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from treeprofiler.src.tile_cache import TileCache, layouts_key, tile_key, TILE_SUFFIX
+
+TILE = [['line', [0, 0.5], [1.0, 0.5], '', [], {'stroke': '#000000'}],
+        ['text', [1.0, 0, 2, 1], 'A', 'name', 0, '', {}]]
+
+class TestTileCache(unittest.TestCase):
+    def test_keys_01(self):
+        # same tree and layouts, same key
+        config = [{'layout_name': 'heatmap-layout', 'props': ['sample1']}]
+        key = layouts_key('(A,B);', config)
+        self.assertEqual(key, layouts_key('(A,B);', [{'props': ['sample1'], 'layout_name': 'heatmap-layout'}]))
+        self.assertNotEqual(key, layouts_key('(A,C);', config))
+        self.assertNotEqual(key, layouts_key('(A,B);', []))
+        self.assertEqual(tile_key('k', 1, 2, 3, 0), 'k-1-2-3-0')
+
+    def test_tile_cache_01(self):
+        # tiles drawn once, least recently used evicted first
+        cache = TileCache(max_tiles=2)
+        draws = []
+        def draw(name):
+            draws.append(name)
+            return iter(TILE)
+
+        self.assertEqual(cache.get_or_draw('a', lambda: draw('a')), TILE)
+        self.assertEqual(cache.get_or_draw('a', lambda: draw('a')), TILE)
+        cache.get_or_draw('b', lambda: draw('b'))
+        cache.get('a')
+        cache.get_or_draw('c', lambda: draw('c'))
+        self.assertEqual(draws, ['a', 'b', 'c'])
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+
+        # empty tiles are cached too
+        cache.get_or_draw('empty', lambda: draw('empty'))
+        cache.get_or_draw('empty', lambda: draw('empty'))
+        self.assertEqual(draws.count('empty'), 1)
+
+    def test_tile_cache_02(self):
+        # tiles on disk are shared by the caches of the same directory
+        with tempfile.TemporaryDirectory() as tmpdir:
+            TileCache(cache_dir=tmpdir).put('a', TILE)
+            self.assertEqual(os.listdir(tmpdir), ['a' + TILE_SUFFIX])
+
+            cache = TileCache(cache_dir=tmpdir)
+            self.assertIn('a', cache)
+            self.assertEqual(cache.get_or_draw('a', lambda: self.fail('drawn again')), TILE)
+            self.assertEqual(len(cache), 1)
+
+            with open(os.path.join(tmpdir, 'b' + TILE_SUFFIX), 'w') as f:
+                f.write('[["line", ')
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(os.listdir(tmpdir), ['a' + TILE_SUFFIX])
+
+    def test_tile_cache_evict_01(self):
+        # the directory is evicted only once it goes over its size
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tile_size = len(json.dumps(TILE))
+            cache = TileCache(cache_dir=tmpdir, max_size=10 * tile_size / 2**20)
+            for i in range(10):
+                cache.put(str(i), TILE)
+            self.assertEqual(len(os.listdir(tmpdir)), 10)
+            self.assertEqual(cache.disk_size, 10 * tile_size)
+
+            cache.put('10', TILE) # over the limit, down to 90% of it
+            self.assertEqual(len(os.listdir(tmpdir)), 9)
+            self.assertEqual(cache.disk_size, 9 * tile_size)
+
+            # a new cache counts what is already there
+            self.assertEqual(TileCache(cache_dir=tmpdir, max_size=cache.max_size).disk_size,
+                             9 * tile_size)
+
+if __name__ == '__main__':
+    unittest.main()
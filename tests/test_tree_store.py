@@ -0,0 +1,78 @@
+import sys
+import os
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
+
+from ete4 import Tree
+
+from treeprofiler.src.tree_store import TreeStore, copy_tree, derive_token, text_token
+
+NEWICK = '((A:1[&&NHX:size=3],B:2)AB:1,C:3);'
+
+def prune_to(names):
+    def change(tree):
+        tree.prune(names)
+        return tree
+    return change
+
+class TestTreeStore(unittest.TestCase):
+    def test_copy_tree_01(self):
+        t = Tree(NEWICK, parser=1)
+        t2 = copy_tree(t)
+        self.assertEqual(t2.write(props=None), t.write(props=None))
+        self.assertEqual(t2['A'].props.get('size'), '3')
+
+        # changing the copy keeps the original
+        t2['A'].add_prop('size', '5')
+        t2.prune(['A', 'C'])
+        self.assertEqual(t['A'].props.get('size'), '3')
+        self.assertEqual(sorted(t.leaf_names()), ['A', 'B', 'C'])
+
+    def test_versions_01(self):
+        store = TreeStore()
+        base = text_token(NEWICK)
+        store.add('t1', Tree(NEWICK, parser=1), base)
+        original = store.get('t1')
+        self.assertIs(store.get('t1'), original) # parsed once
+
+        # an edit makes a new version, the base one is kept
+        pruned = store.edit('t1', ['prune', 'A,C'], prune_to(['A', 'C']))
+        self.assertEqual(store.token('t1'), derive_token(base, ['prune', 'A,C']))
+        self.assertIs(store.get('t1'), pruned)
+        self.assertEqual(sorted(pruned.leaf_names()), ['A', 'C'])
+        self.assertEqual(sorted(original.leaf_names()), ['A', 'B', 'C'])
+
+        # edits apply to the current version, and only it is kept
+        store.edit('t1', ['prune', 'A'], prune_to(['A']))
+        self.assertEqual(len(store.versions), 2)
+
+        self.assertIs(store.reset('t1'), original)
+        self.assertEqual(store.token('t1'), base)
+        self.assertEqual(len(store.versions), 1)
+
+        store.remove('t1')
+        self.assertNotIn('t1', store)
+        self.assertEqual(store.memory, 0)
+
+    def test_spill_01(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = TreeStore(max_memory=0, spill_dir=tmpdir) # only the tree in use in memory
+            store.add('t1', Tree(NEWICK, parser=1), 'token1')
+            store.add('t2', Tree('(X,Y);'), 'token2')
+            self.assertIsNone(store.versions[('t1', 'token1')])
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+
+            # loaded back when used, and the other one goes to disk
+            t1 = store.get('t1')
+            self.assertEqual(t1['A'].props.get('size'), '3')
+            self.assertIsNone(store.versions[('t2', 'token2')])
+            self.assertEqual(store.memory, store.sizes[('t1', 'token1')])
+
+            store.remove('t2')
+            store.remove('t1')
+            self.assertEqual(os.listdir(tmpdir), [])
+
+if __name__ == '__main__':
+    unittest.main()
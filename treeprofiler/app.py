@@ -2,8 +2,7 @@ from bottle import route, run, request, redirect, template, static_file, respons
 from bottle import Bottle
 import requests
 import threading
-from tempfile import NamedTemporaryFile
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 import os
@@ -16,12 +15,41 @@ from ete4 import Tree
 from treeprofiler.tree_annotate import run_tree_annotate, parse_csv, name_nodes  # or other functions you need
 from treeprofiler import tree_plot
 from treeprofiler.src import utils
+from treeprofiler.src.payloads import prepare_layouts
+from treeprofiler.src.tile_cache import TileCache, layouts_key
+from treeprofiler.src.tree_store import TreeStore, text_token
+from treeprofiler.src.job_queue import JobQueue, COMPLETE, FAILED, CANCELLED
+from treeprofiler.src.chunked_upload import ChunkedUploads, ChecksumError, DEFAULT_CHUNK_SIZE
+from treeprofiler.src.query import QueryError
+from treeprofiler.tree_image import TileRenderer
 from treeprofiler import layouts
 
 
-# In-memory storage for chunks and complete files
+# In-memory storage for trees, and paths of the uploaded files of each tree
 trees = {}
 uploaded_chunks = {}
+
+# Files being uploaded in chunks, assembled on disk as the chunks arrive
+# (abandoned ones are removed after a while)
+chunked_uploads = ChunkedUploads()
+
+# Parsed trees, by tree name, with the versions made by prunes (trees over
+# the memory budget are kept on disk)
+tree_store = TreeStore()
+
+# Drawn tiles of the trees, shared by all the users (TileCache(cache_dir=...)
+# keeps them on disk too). Each tree has the version and layouts its tiles
+# are drawn with (its tile source), and a renderer, with its own copy of the
+# tree, is made for them on the first request of a tile. Only the renderers
+# of the MAX_TILE_RENDERERS trees with the most recent requests are kept.
+# Drawing the top levels in advance is optional (TREEPROFILER_TILE_PREWARM=1)
+# since the explore view does not request tiles.
+MAX_TILE_RENDERERS = 4
+TILE_PREWARM = os.environ.get('TREEPROFILER_TILE_PREWARM') == '1'
+tile_cache = TileCache()
+tile_sources = {} # treename -> (token, layouts key, layouts) of its tiles
+tile_renderers = OrderedDict() # treename -> renderer, least recently used first
+tile_lock = threading.Lock()
 default_paired_color = [
     '#9a312f', '#9b57d0', '#f8ce9a', '#f16017', '#28fef9', '#53707a',
     '#213b07', '#b5e5ac', '#9640b2', '#a9bd10', '#69e42b', '#b44d67',
@@ -92,8 +120,32 @@ binary_prefix = [
     "binary-matrix"
 ]
 
-# Global control variable for restarting
-job_status = {}  # Dictionary to store job statuses
+# Uploaded trees are annotated by a few workers sharing a budget of cpus.
+# Jobs are kept in JOBS_DIR, so the finished ones (and their trees) survive a
+# restart of the server, for as long as the queue keeps them (a week, and the
+# last 1000 finished). It is a private directory of the user (the queue
+# refuses one that others can write to), and the queue is only created, and
+# its jobs loaded, when the server starts. The number of workers, the cpus of
+# an annotation and the budget of cpus of all the running annotations can be
+# set with environment variables too.
+UPLOAD_WORKERS = int(os.environ.get('TREEPROFILER_UPLOAD_WORKERS', 2))
+UPLOAD_CPUS = int(os.environ.get('TREEPROFILER_UPLOAD_CPUS', 6)) # of an annotation, for its multiprocessing pools
+CPU_BUDGET = int(os.environ.get('TREEPROFILER_CPU_BUDGET', 0)) or os.cpu_count()
+JOBS_DIR = os.environ.get('TREEPROFILER_JOBS_DIR',
+    os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                 'treeprofiler', 'jobs'))
+job_queue = None
+job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Queue of the upload jobs, created on first use."""
+    global job_queue
+    with job_queue_lock:
+        if job_queue is None:
+            job_queue = JobQueue(workers=UPLOAD_WORKERS, cpu_budget=CPU_BUDGET,
+                                 state_dir=JOBS_DIR)
+        return job_queue
+
 # Global variables
 app = Bottle()
 server_thread = None
@@ -139,6 +191,7 @@ def run_server():
 def start_server():
     """Start the Bottle app in a separate thread."""
     global server_thread, stop_event
+    get_job_queue() # finished jobs loaded before the first request
     stop_event.clear()
     server_thread = threading.Thread(target=run_server)
     server_thread.start()
@@ -147,8 +200,7 @@ def start_server():
 @app.route('/stop_explore')
 def stop_explore():
     """Stop and restart the server."""
-    global server_thread, stop_event, job_status
-    job_status = {} # clean up the job status
+    global server_thread, stop_event
     print("Stopping server for restart...")
 
     # Signal the server thread to stop
@@ -163,13 +215,12 @@ def do_upload():
         print({"error": "Tree name is required"})
         return {"error": "Tree name is required"}
 
-    if treename in job_status:
+    job = get_job_queue().get(treename)
+    if job and job.status not in (FAILED, CANCELLED):
         response.status = 400
         print({"error": "A job with this tree name is already in progress"})
         return {"error": "A job with this tree name is already in progress"}
 
-    job_status[treename] = "running"
-
     # Collect all form data
     job_args = {
         "treename": treename,
@@ -210,14 +261,26 @@ def do_upload():
         "summary_methods": request.forms.get('summary_methods')
     }
 
-    # Start the upload job in a new thread
-    threading.Thread(target=process_upload_job, args=(job_args,)).start()
+    # Queue the upload job, it runs when a worker and its cpus are free
+    def run(progress, cpus):
+        try:
+            return process_upload_job(job_args, progress, cpus)
+        finally:
+            remove_uploaded_files(treename)
+
+    get_job_queue().submit(treename, run, cpus=UPLOAD_CPUS,
+                     priority=int(request.forms.get('priority') or 0))
     response.content_type = 'application/json'
     return json.dumps({"job_id": treename})
 
-def process_upload_job(job_args):
-    """Function to handle the actual processing of the uploaded data."""
+def process_upload_job(job_args, progress, threads):
+    """
+    Function to handle the actual processing of the uploaded data. It reports
+    its stages with progress(stage, percent), annotates with threads processes
+    and returns the information of the tree.
+    """
     treename = job_args['treename']
+    progress('parsing tree', 5)
     # Initialize variables and parse arguments
     separator = "\t" if job_args.get("separator") == "<tab>" else job_args.get("separator", ",")
     tree_data = job_args.get("tree_data")
@@ -245,6 +308,7 @@ def process_upload_job(job_args):
         os.remove(tree_file_path)
 
     # Process metadata
+    progress('reading metadata', 15)
     metadata_options = {}
     columns = {}
 
@@ -328,7 +392,7 @@ def process_upload_job(job_args):
     }
 
     # Run annotation
-    threads = 6
+    progress('annotating', 30)
     annotated_tree, prop2type = run_tree_annotate(
         tree,
         **metadata_options,
@@ -337,7 +401,8 @@ def process_upload_job(job_args):
         **analytic_options,
         **alignment_options,
         column2method=column2method,
-        threads=threads
+        threads=threads,
+        progress=progress
     )
 
     if job_args.get("taxon_column"):
@@ -353,6 +418,7 @@ def process_upload_job(job_args):
                 node.add_prop(key, '||'.join(node.props[key]))
     
     # Name the nodes
+    progress('writing annotated tree', 80)
     annotated_tree = name_nodes(annotated_tree)
 
     #avail_props = [key for key in prop2type.keys() if key not in ['name', 'dist', 'support']]
@@ -380,7 +446,6 @@ def process_upload_job(job_args):
         'columns': columns,
         'metadata': job_args.get("metadata"),
         'node_props': node_props,
-        "updated_tree": "",
         'annotated_tree': annotated_newick,
         'prop2type': prop2type,
         'layouts': [],
@@ -394,16 +459,14 @@ def process_upload_job(job_args):
     if alignment_file_path and os.path.exists(alignment_file_path):
         os.remove(alignment_file_path)
 
-    # Mark job as complete
-    job_status[treename] = "complete"
-        
+    # Parse the annotated tree once, requests use the parsed tree
+    progress('loading annotated tree', 90)
+    tree_store.add(treename, Tree(annotated_newick), text_token(annotated_newick))
 
-    if job_status[treename] == "failed":
-        print(f"Error processing job {treename}: {e}")
-    
-    # Remove stored chunks for the completed job
-    if treename in uploaded_chunks:
-        del uploaded_chunks[treename]
+    # Tiles of the annotated tree, until it is explored with layouts
+    start_tile_renderer(treename, tree_store.token(treename), [], [])
+
+    return trees[treename]
 
 # Route to serve static files like CSS and JS
 @app.route('/static/<filepath:path>')
@@ -422,6 +485,9 @@ def upload_chunk():
     total_chunks = int(request.forms.get("totalChunks"))
     treename = request.forms.get("treename")
     file_id = request.forms.get("fileId", None)  # Use provided fileId or generate one
+    chunk_size = int(request.forms.get("chunkSize") or DEFAULT_CHUNK_SIZE)
+    file_size = request.forms.get("fileSize")
+    checksum = request.forms.get("checksum")  # sha256 of the chunk
 
     # Identify the file type
     if 'treeFile' in request.files:
@@ -437,41 +503,61 @@ def upload_chunk():
 
     # Initialize storage
     if treename not in uploaded_chunks:
-        uploaded_chunks[treename] = {"tree": {}, "metadata": {}, "alignment": {}, "pfam": {}}
-
-    # Handle metadata specifically for multiple files
-    if file_type == "metadata":
-        if file_id not in uploaded_chunks[treename][file_type]:
-            uploaded_chunks[treename][file_type][file_id] = []
-        uploaded_chunks[treename][file_type][file_id].append((chunk_index, chunk.file.read()))
-
-        # Assemble the file when all chunks are received
-        if len(uploaded_chunks[treename][file_type][file_id]) == total_chunks:
-            uploaded_chunks[treename][file_type][file_id].sort()
-            with NamedTemporaryFile(delete=False) as assembled_file:
-                for _, part in uploaded_chunks[treename][file_type][file_id]:
-                    assembled_file.write(part)
-                uploaded_chunks[treename][file_type][file_id] = assembled_file.name
-    else:
-        # Handle other file types
-        if "chunks" not in uploaded_chunks[treename][file_type]:
-            uploaded_chunks[treename][file_type]["chunks"] = []
-        uploaded_chunks[treename][file_type]["chunks"].append((chunk_index, chunk.file.read()))
-
-        if len(uploaded_chunks[treename][file_type]["chunks"]) == total_chunks:
-            uploaded_chunks[treename][file_type]["chunks"].sort()
-            with NamedTemporaryFile(delete=False) as assembled_file:
-                for _, part in uploaded_chunks[treename][file_type]["chunks"]:
-                    assembled_file.write(part)
-                uploaded_chunks[treename][file_type] = assembled_file.name
+        uploaded_chunks[treename] = {"tree": None, "metadata": {}, "alignment": None, "pfam": None}
+
+    # Write the chunk at its place in the file, which is complete with the last one
+    try:
+        path = chunked_uploads.write_chunk((treename, file_id), chunk_index, total_chunks,
+            chunk.file, chunk_size, int(file_size) if file_size else None, checksum)
+    except ChecksumError as e:
+        response.status = 400
+        return {"error": str(e), "retry": True}
+    except ValueError as e:
+        response.status = 400
+        return {"error": str(e)}
+
+    if path:
+        if file_type == "metadata":
+            uploaded_chunks[treename][file_type][file_id] = path
+        else:
+            uploaded_chunks[treename][file_type] = path
 
     return "Chunk received"
 
+@app.route('/upload_chunk/received')
+def upload_chunk_received():
+    """Indices of the chunks of a partial upload already received, to resume it."""
+    treename = request.query.get('treename')
+    file_id = request.query.get('fileId')
+    response.content_type = 'application/json'
+    return json.dumps({"received": chunked_uploads.received((treename, file_id))})
+
+def remove_uploaded_files(treename):
+    """Remove the files uploaded for a tree that are still on disk."""
+    files = uploaded_chunks.pop(treename, None) or {}
+    paths = list(files.get("metadata", {}).values())
+    paths += [files.get(file_type) for file_type in ["tree", "alignment", "pfam"]]
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
 @app.route('/job_status/<job_id>')
 def job_status_check(job_id):
-    status = job_status.get(job_id, "not_found")
+    """Status of the job, with its stage, percent done and place in the queue."""
+    job = get_job_queue().get(job_id)
+    response.content_type = 'application/json'
+    if not job:
+        return {"status": "not_found"}
+    return dict(job.info(), position=get_job_queue().position(job_id))
+
+@app.route('/job_cancel/<job_id>', method='POST')
+def job_cancel(job_id):
+    """Cancel a queued or running job."""
     response.content_type = 'application/json'
-    return {"status": status}
+    if not get_job_queue().cancel(job_id):
+        response.status = 400
+        return {"error": f"Job '{job_id}' is not queued or running."}
+    return {"status": "cancelling"}
 
 
 # @app.route('/show_tree/<treename>')
@@ -482,10 +568,31 @@ def job_status_check(job_id):
 #         return f"Tree '{treename}' processed successfully! Displaying results."
 #     return "Processing still in progress or failed."
 
+@app.route('/tiles/<treename>/<panel:int>/<level:int>/<x:int>/<y:int>')
+def get_tile(treename, panel, level, x, y):
+    """
+    Tile (x, y) of the tree at zoom level, panel 0 for the tree and 1 for the
+    aligned faces. The graphic elements of the smartview drawer as json, or
+    an svg image with ?format=svg.
+    """
+    if not TileRenderer.has_tile(panel, level, x, y):
+        response.status = 400
+        return {"error": "Invalid tile."}
+    renderer = tile_renderer(treename)
+    if not renderer:
+        response.status = 404
+        return {"error": f"Tree '{treename}' not found or not ready."}
+
+    if request.query.get('format') == 'svg':
+        response.content_type = 'image/svg+xml'
+        return renderer.tile_svg(panel, level, x, y)
+    response.content_type = 'application/json'
+    return json.dumps({'graphics': renderer.tile(panel, level, x, y)})
+
 @app.route('/tree/<treename>/result')
 def show_tree(treename):
     # Fetch the tree data by its name
-    tree_info = trees.get(treename)
+    tree_info = tree_info_of(treename)
     if tree_info:
         return template('tree_details', treename=treename, tree_info=tree_info)
     else:
@@ -500,12 +607,12 @@ def tree_status(treename):
 def check_job_status():
     """API endpoint to check the status of a given job."""
     job_id = request.query.get('job_id')
-    status = job_status.get(job_id, "not_found")
-    return status
+    job = get_job_queue().get(job_id)
+    return job.status if job else "not_found"
 
 @app.route('/explore_tree/<treename>', method=['GET', 'POST', 'PUT'])
 def explore_tree(treename):
-    tree_info = trees.get(treename)
+    tree_info = tree_info_of(treename)
     if not tree_info:
         return f"Tree '{treename}' not found."
 
@@ -518,12 +625,8 @@ def explore_tree(treename):
         layout_manager = {layout.name: layout for layout in current_layouts}
     current_props = sorted(list(tree_info['prop2type'].keys()))
     
-    if tree_info['updated_tree']:
-        t = Tree(tree_info['updated_tree'])
-    else:
-        t = Tree(tree_info['annotated_tree'])
-    
-    
+    t = stored_tree(treename) # shared, prunes change a copy
+
     # Default configuration settings
     default_configs = {
         "level": 1,
@@ -546,8 +649,9 @@ def explore_tree(treename):
         # Check if the reset action is triggered
         if request.forms.get('reset_tree'):
             print("Resetting tree...")
-            # Reset the tree by assigning `annotated_tree` to `updated_tree`
-            tree_info['updated_tree'] = None
+            # Reset the tree to the annotated tree
+            t = tree_store.reset(treename)
+            drop_tile_renderer(treename)
             tree_info['layouts'] = []  # Clear applied layouts
             current_layouts = []  # Clear layouts
             layouts_metadata.clear()  # Clear metadata
@@ -570,15 +674,19 @@ def explore_tree(treename):
                     query_type = layer.get('queryType', '')
                     if query_type == 'rank_limit':
                         rank_selection = layer.get('rankSelection')
-                        t = utils.taxatree_prune(t, rank_limit=rank_selection)
-                        tree_info['updated_tree'] = t.write(props=current_props, format_root_node=True)
+                        t = tree_store.edit(treename, ['rank_limit', rank_selection],
+                            lambda tree: utils.taxatree_prune(tree, rank_limit=rank_selection))
                     elif query_type == 'prune':
                         # prune tree by condition 
                         query_box = layer.get('query', '')
-                        query_strings = convert_query_string(query_box)
                         prop2type = tree_info['prop2type']
-                        t = utils.conditional_prune(t, query_strings, prop2type)
-                        tree_info['updated_tree'] = t.write(props=current_props, format_root_node=True)
+                        # statements separated by ';' are alternatives, any of them prunes
+                        try:
+                            t = tree_store.edit(treename, ['prune', query_box],
+                                lambda tree: utils.conditional_prune(tree, query_box, prop2type))
+                        except QueryError as e:
+                            response.status = 400
+                            return {"error": f"Invalid query: {e}"}
                     
                     # Process each layer individually without altering its structure
                     current_layouts, current_props, level, color_config = process_layer(
@@ -1642,9 +1750,7 @@ def apply_highlight_queries(query_strings, current_layouts, paired_color, tree_i
     Processes highlight queries and appends them to current layouts.
     """
     for idx, condition in enumerate(query_strings):
-        syntax_sep = ','
-        condition_list = condition.split(syntax_sep)
-        color2conditions = {paired_color[idx]: condition_list}
+        color2conditions = {paired_color[idx]: [condition]}
         
         s_layout = layouts.conditional_layouts.LayoutHighlight(
             name=f'Highlighted-by_{condition}', color2conditions=color2conditions, 
@@ -1660,9 +1766,7 @@ def apply_collapse_queries(query_strings, current_layouts, paired_color, tree_in
     Processes collapse queries and appends them to current layouts.
     """
     for idx, condition in enumerate(query_strings):
-        syntax_sep = ','
-        condition_list = condition.split(syntax_sep)
-        color2conditions = {paired_color[idx]: condition_list}
+        color2conditions = {paired_color[idx]: [condition]}
         
         c_layout = layouts.conditional_layouts.LayoutCollapse(
             name=f'Collapsed-by_{condition}', color2conditions=color2conditions, 
@@ -1672,10 +1776,31 @@ def apply_collapse_queries(query_strings, current_layouts, paired_color, tree_in
     
     return current_layouts
 
+def tree_info_of(treename):
+    """Information of an annotated tree, from its finished job after a restart."""
+    if treename not in trees:
+        job = get_job_queue().get(treename)
+        if job and job.status == COMPLETE and job.result:
+            trees[treename] = job.result
+    return trees.get(treename)
+
+def stored_tree(treename):
+    """Current version of a tree, parsed from its annotated newick the first time."""
+    with tree_store.lock:
+        if treename not in tree_store:
+            newick = trees[treename]['annotated_tree']
+            tree_store.add(treename, Tree(newick), text_token(newick))
+        return tree_store.get(treename)
+
 def start_explore_thread(t, treename, current_layouts, current_props):
     """
     Starts the ete exploration in a separate thread.
     """
+    token = tree_store.token(treename)
+    prepare_layouts(t, current_layouts, token)
+
+    start_tile_renderer(treename, token, current_layouts,
+                        trees[treename].get('layouts_metadata', []))
 
     def explore():
         t.explore(name=treename, layouts=current_layouts, port=5051, open_browser=False, include_props=current_props)
@@ -1684,22 +1809,76 @@ def start_explore_thread(t, treename, current_layouts, current_props):
     explorer_thread.start()
 
 
+def start_tile_renderer(treename, token, current_layouts, layouts_config):
+    """
+    Serve the tiles of version token of the tree with its current layouts,
+    drawing the top zoom levels in the background if TILE_PREWARM. The
+    renderer of the previous layouts is dropped.
+    """
+    key = layouts_key(token, layouts_config)
+    with tile_lock:
+        tile_sources[treename] = (token, key, current_layouts)
+        renderer = tile_renderers.get(treename)
+        if renderer and renderer.key != key:
+            del tile_renderers[treename]
+
+    if TILE_PREWARM:
+        def prewarm():
+            renderer = tile_renderer(treename)
+            if renderer and renderer.key == key: # stops if the layouts change again
+                renderer.prewarm(cancelled=lambda: tile_sources.get(treename, (None, None))[1] != key)
+
+        threading.Thread(target=prewarm, daemon=True).start()
+
+def tile_renderer(treename):
+    """
+    Renderer of the tiles of the current version and layouts of treename,
+    made on first use. None if the tree has no tiles or they changed while
+    it was made.
+    """
+    with tile_lock:
+        source = tile_sources.get(treename)
+        if not source:
+            return None
+        token, key, current_layouts = source
+        renderer = tile_renderers.get(treename)
+        if renderer and renderer.key == key:
+            tile_renderers.move_to_end(treename)
+            return renderer
+
+    with tree_store.lock:
+        if treename not in tree_store or tree_store.token(treename) != token:
+            return None
+        tree = tree_store.copy(treename) # the explore server may be drawing the other one
+    renderer = TileRenderer(tree, current_layouts, tile_cache, key, token) # slow, outside of the lock
+
+    with tile_lock:
+        source = tile_sources.get(treename)
+        if not source or source[1] != key:
+            return None # tree or layouts changed meanwhile, this renderer is outdated
+        current = tile_renderers.get(treename)
+        if current and current.key == key: # made by another request meanwhile
+            return current
+        tile_renderers[treename] = renderer
+        tile_renderers.move_to_end(treename)
+        while len(tile_renderers) > MAX_TILE_RENDERERS:
+            tile_renderers.popitem(last=False)
+    return renderer
+
+def drop_tile_renderer(treename):
+    """Forget the tile source and renderer of treename (its tree was reset or removed)."""
+    with tile_lock:
+        tile_sources.pop(treename, None)
+        tile_renderers.pop(treename, None)
+
 def convert_query_string(query_string):
-    # Split the query by semicolon to get each statement
-    queries = [q.strip() for q in query_string.split(';') if q.strip()]
-    result = []
-    for query in queries:
-        if " OR " in query:
-            # Split the query by 'OR' and convert each condition
-            conditions = [cond.strip() for cond in query.split(" OR ")]
-            result.extend(conditions)  # Add each condition as a separate entry for 'OR'
-        elif " AND " in query:
-            # Split the query by 'AND' and convert each condition
-            conditions = [cond.strip() for cond in query.split(" AND ")]
-            result.append(','.join(conditions))  # Join conditions with a comma for 'AND'
-        else:
-            result.append(query)
-    return result
+    """
+    Split the query box in its statements, one layout is built per statement.
+
+    Each statement is kept as written, AND/OR and parentheses inside of it
+    are handled by the query compiler.
+    """
+    return [q.strip() for q in query_string.split(';') if q.strip()]
 
 if __name__ == "__main__":
     start_server()
\ No newline at end of file
@@ -2,12 +2,10 @@ from ete4.smartview import TreeStyle, NodeStyle, TreeLayout, PieChartFace
 from ete4.smartview  import (RectFace, CircleFace, SeqMotifFace, TextFace, OutlineFace, \
                             SelectedFace, SelectedCircleFace, SelectedRectFace, LegendFace)
 from treeprofiler.layouts.general_layouts import get_heatmapface, get_aggregated_heatmapface
-from treeprofiler.src.utils import to_code, call, counter_call, check_nan
-# for boolean layouts
-try:
-    from distutils.util import strtobool
-except ImportError:
-    from treeprofiler.src.utils import strtobool
+from treeprofiler.src.payloads import NodePayloads, Payload, heatmap_color, aggregated_heatmap_color
+from treeprofiler.src.booleans import to_bool, bool_counts
+from treeprofiler.src.columns import PropertyColumns
+from treeprofiler.src.query import compile_query, select_nodes
 
 # branch thicken, background highlighted to purple
 class LayoutHighlight(TreeLayout):
@@ -33,42 +31,17 @@ class LayoutHighlight(TreeLayout):
                                     colormap=colormap
                                     )
 
+        columns = PropertyColumns(tree.traverse())
         for color, conditions in self.color2conditions.items():
-            conditional_output = to_code(conditions)
-            for node in tree.traverse():
-                final_call = False
-                for condition in conditional_output:
-                    op = condition[1]
-                    if op == 'in':
-                        value = condition[0]
-                        prop = condition[2]
-                        datatype = self.prop2type.get(prop)
-                        final_call = call(node, prop, datatype, op, value)
-
-                    elif ':' in condition[0] :
-                        internal_prop, leaf_prop = condition[0].split(':')
-                        value = condition[2]
-                        datatype = self.prop2type[internal_prop]
-                        final_call = counter_call(node, internal_prop, leaf_prop, datatype, op, value)
-                    else:
-                        prop = condition[0]
-                        value = condition[2]
-                        datatype = self.prop2type.get(prop)
-                        final_call = call(node, prop, datatype, op, value)
-                    if final_call == False:
-                        break
-                    else:
-                        continue
-                
-                if final_call:
-                    #prop_face = SelectedRectFace(name='prop')
-                    node.add_prop(f'hl_{conditions}', color)  # highligh clade
-                    node.add_prop(f'hl_{conditions}_endnode', True)
-                    while (node):
-                        node = node.up
-                        if node:
-                            node.add_prop(f'hl_{conditions}', True)
-                            #node.sm_style["hz_line_width"] = 5
+            for node in select_nodes(tree, conditions, self.prop2type, columns=columns):
+                #prop_face = SelectedRectFace(name='prop')
+                node.add_prop(f'hl_{conditions}', color)  # highligh clade
+                node.add_prop(f'hl_{conditions}_endnode', True)
+                node = node.up
+                # ancestors marked before have all their own ancestors marked
+                while node and node.props.get(f'hl_{conditions}') is not True:
+                    node.add_prop(f'hl_{conditions}', True)
+                    node = node.up
         return
 
     def set_node_style(self, node):
@@ -103,43 +76,17 @@ class LayoutCollapse(TreeLayout):
                                     colormap=colormap
                                     )
 
+        columns = PropertyColumns(tree.traverse())
         for color, conditions in self.color2conditions.items():
-            conditional_output = to_code(conditions)
-            for node in tree.traverse():
-                final_call = False
-                for condition in conditional_output:
-                    op = condition[1]
-                    if op == 'in':
-                        value = condition[0]
-                        prop = condition[2]
-                        datatype = self.prop2type.get(prop)
-                        final_call = call(node, prop, datatype, op, value)
-
-                    elif ':' in condition[0] :
-                        internal_prop, leaf_prop = condition[0].split(':')
-                        value = condition[2]
-                        datatype = self.prop2type[internal_prop]
-                        final_call = counter_call(node, internal_prop, leaf_prop, datatype, op, value)
-                    else:
-                        prop = condition[0]
-                        value = condition[2]
-                        datatype = self.prop2type.get(prop)
-                        final_call = call(node, prop, datatype, op, value)
-                        
-                    if final_call == False:
-                        break
-                    else:
-                        continue
-                
-                if final_call:
-                    #prop_face = SelectedRectFace(name='prop')
-                    node.add_prop(f'cl_{conditions}', color)  # highligh clade
-                    node.add_prop(f'cl_{conditions}_endnode', True)
-                    while (node):
-                        node = node.up
-                        if node:
-                            node.add_prop(f'hl_{conditions}', True)
-                            #node.sm_style["hz_line_width"] = 5
+            for node in select_nodes(tree, conditions, self.prop2type, columns=columns):
+                #prop_face = SelectedRectFace(name='prop')
+                node.add_prop(f'cl_{conditions}', color)  # highligh clade
+                node.add_prop(f'cl_{conditions}_endnode', True)
+                node = node.up
+                # ancestors marked before have all their own ancestors marked
+                while node and node.props.get(f'hl_{conditions}') is not True:
+                    node.add_prop(f'hl_{conditions}', True)
+                    node = node.up
         return
 
     def set_node_style(self, node):
@@ -154,40 +101,13 @@ class LayoutCollapse(TreeLayout):
 
 # conditional collapse layouts
 def collapsed_by_layout(conditions, level, prop2type={}, color='red'):
-    conditional_output = to_code(conditions)
+    predicate = compile_query(conditions, prop2type)
     def layout_fn(node):
-        final_call = False
-        for condition in conditional_output:
-            #normal
-            
-            op = condition[1]
-            if op == 'in':
-                value = condition[0]
-                prop = condition[2]
-                datatype = prop2type.get(prop)
-                final_call = call(node, prop, datatype, op, value)
-
-            elif ':' in condition[0] :
-                internal_prop, leaf_prop = condition[0].split(':')
-                value = condition[2]
-                datatype = prop2type[internal_prop]
-                final_call = counter_call(node, internal_prop, leaf_prop, datatype, op, value)
-            else:
-                prop = condition[0]
-                value = condition[2]
-                datatype = prop2type.get(prop)
-                final_call = call(node, prop, datatype, op, value)
-            
-            if final_call == False:
-                break
-            else:
-                continue
-        if final_call:
+        if predicate(node):
             if not node.is_root:
                 node.sm_style["draw_descendants"] = False
                 node.sm_style["outline_color"] = color
     return layout_fn
-    return
 
 class LayoutBinary(TreeLayout):
     def __init__(self, name=None, level=1, color='#E60A0A', \
@@ -213,7 +133,7 @@ class LayoutBinary(TreeLayout):
         self.height = None
         self.min_fsize = 5
         self.max_fsize = 10
-        
+        self.payloads = NodePayloads(self.get_payload)
         
     # def set_tree_style(self, tree, tree_style):
     #     super().set_tree_style(tree, tree_style)
@@ -252,58 +172,44 @@ class LayoutBinary(TreeLayout):
                                     )
 
                 
-    def set_node_style(self, node):
+    def get_payload(self, node):
         # need to correct
         if node.is_leaf and node.props.get(self.prop):
-            #if node.props.get(self.prop):
             prop_bool = node.props.get(self.prop)
-            
-            if not check_nan(prop_bool):
-                str2bool = strtobool(prop_bool)
-                tooltip = ""
-                if node.name:
-                    tooltip += f'<b>{node.name}</b><br>'
-                if self.prop:
-                    tooltip += f'<br>{self.prop}: {node.props.get(self.prop)}<br>'
-
-                if self.reverse:
-                    if not bool(str2bool):
-                        #prop_face = CircleFace(radius=self.radius, color=self.color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-                        prop_face = RectFace(width=self.width, height=self.height, color=self.color,  padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-                        node.add_face(prop_face, column=self.column, position = "aligned")
-                    else:
-                        #prop_face = CircleFace(radius=self.radius, color=self.negative_color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-                        prop_face = RectFace(width=self.width, height=self.height, color=self.negative_color,  padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-                        node.add_face(prop_face, column=self.column, position = "aligned")
-                else:
-                    if bool(str2bool):
-                        #prop_face = CircleFace(radius=self.radius, color=self.color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-                        prop_face = RectFace(width=self.width, height=self.height, color=self.color,  padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-                        node.add_face(prop_face, column=self.column, position = "aligned")
-                    else:
-                        #prop_face = CircleFace(radius=self.radius, color=self.negative_color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-                        prop_face = RectFace(width=self.width, height=self.height, color=self.negative_color,  padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-                        node.add_face(prop_face, column=self.column, position = "aligned")
-            else: #mising
-                prop_face = RectFace(width=self.width, height=self.height, text="NA", color=self.negative_color,  padding_x=self.padding_x, padding_y=self.padding_y, stroke_color=self.negative_color, tooltip=None)
-                node.add_face(prop_face, column=self.column, position = "aligned")
-            # else:
-            #     prop_face = RectFace(width=self.width, height=self.height, text="NA", color=self.negative_color,  padding_x=self.padding_x, padding_y=self.padding_y, stroke_color=self.negative_color, tooltip=None)
-            #     node.add_face(prop_face, column=self.column, position = "aligned")
-        
-        elif node.is_leaf and node.props.get(self.internal_prop):
-            if self.aggregate:
-                heatmapFace = get_aggregated_heatmapface(node, self.internal_prop, max_color=self.color, width=self.width, height=self.height, padding_x=self.padding_x, max_count=self.max_count)
+            value = to_bool(prop_bool)
+            if value is None: #mising
+                return Payload('missing')
+            tooltip = ((self.prop, prop_bool),) if self.prop else ()
+            if value != self.reverse:
+                return Payload('leaf', color=self.color, tooltip=tooltip)
             else:
-                heatmapFace = get_heatmapface(node, self.internal_prop, max_color=self.color, width=self.width, height=self.height, padding_x=self.padding_x,)
-            node.add_face(heatmapFace, column = self.column, position = "aligned", collapsed_only=False)
+                return Payload('leaf', color=self.negative_color, tooltip=tooltip)
 
         elif node.props.get(self.internal_prop):
+            counter = node.props.get(self.internal_prop)
+            kind = 'leaf' if node.is_leaf else 'internal'
             if self.aggregate:
-                heatmapFace = get_aggregated_heatmapface(node, self.internal_prop, max_color=self.color, width=self.width, height=self.height, padding_x=self.padding_x, max_count=self.max_count)
+                positive, total = bool_counts(counter, accumulate=True)
+                color = aggregated_heatmap_color(positive, self.max_count, max_color=self.color)
+                text = int(positive)
             else:
-                heatmapFace = get_heatmapface(node, self.internal_prop, max_color=self.color, width=self.width, height=self.height, padding_x=self.padding_x,reverse=self.reverse)
-            node.add_face(heatmapFace, column = self.column, position = "aligned", collapsed_only=True)
-        # else:
-        #     prop_face = RectFace(width=self.width, height=self.height, text="NA", color=self.negative_color,  padding_x=self.padding_x, padding_y=self.padding_y, stroke_color=self.negative_color, tooltip=None)
-        #     node.add_face(prop_face, column=self.column, position = "aligned")
+                # reversed ratios are only drawn for the collapsed internal nodes
+                positive, total = bool_counts(counter)
+                color = heatmap_color(positive, total, max_color=self.color,
+                    reverse=(self.reverse and not node.is_leaf))
+                text = None
+            tooltip = ((self.internal_prop, f'{positive} / {total} '),)
+            return Payload(kind, color=color, tooltip=tooltip, text=text)
+
+        return Payload('absent')
+
+    def set_node_style(self, node):
+        payload = self.payloads.get(node)
+        if payload.kind == 'missing':
+            prop_face = RectFace(width=self.width, height=self.height, text="NA", color=self.negative_color,  padding_x=self.padding_x, padding_y=self.padding_y, stroke_color=self.negative_color, tooltip=None)
+            node.add_face(prop_face, column=self.column, position = "aligned")
+
+        elif payload.kind != 'absent':
+            #prop_face = CircleFace(radius=self.radius, color=payload.color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=self.payloads.tooltip(node))
+            prop_face = RectFace(width=self.width, height=self.height, text=payload.text, color=payload.color,  padding_x=self.padding_x, padding_y=self.padding_y, tooltip=self.payloads.tooltip(node))
+            node.add_face(prop_face, column=self.column, position = "aligned", collapsed_only=(payload.kind == 'internal'))
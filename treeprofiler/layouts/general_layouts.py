@@ -4,7 +4,6 @@ from Bio import AlignIO
 from Bio.Align import MultipleSeqAlignment
 from Bio.Align.AlignInfo import SummaryInfo
 import numpy as np
-from distutils.util import strtobool
 import matplotlib as mpl
 import matplotlib.colors as mcolors
 from itertools import chain
@@ -13,114 +12,37 @@ import math
 from ete4.smartview import TreeStyle, NodeStyle, TreeLayout, PieChartFace, LegendFace, RectFace
 from ete4.smartview.renderer.draw_helpers import *
 
-from treeprofiler.src.utils import to_code, call, counter_call, check_nan
+from treeprofiler.src.utils import check_nan
+from treeprofiler.src.counters import parse_counter
+from treeprofiler.src.payloads import (counter_data, heatmap_color,
+    aggregated_heatmap_color, node_tooltip, counter_tooltip)
+from treeprofiler.src.booleans import bool_counts
 from treeprofiler.src import utils
 
 Box = namedtuple('Box', 'x y dx dy')  # corner and size of a 2D shape
 
 def get_piechartface(node, prop, color_dict=None, radius=20, tooltip=None):
-    pair_delimiter = "--"
-    item_seperator = "||"
-    piechart_data = []
-    counter_props = node.props.get(prop).split(item_seperator)
-    for counter_prop in counter_props:
-        k, v = counter_prop.split(pair_delimiter)
-        piechart_data.append([k,float(v),color_dict.get(k,None),None])
-        
+    piechart_data = counter_data(node, prop, color_dict, absence_color=None)
     if piechart_data:
-        piechart_face = PieChartFace(radius=radius, data=piechart_data, padding_x=5, tooltip=tooltip)
-        
-        return piechart_face
+        return PieChartFace(radius=radius, data=piechart_data, padding_x=5, tooltip=tooltip)
     else:
         return None
 
 def get_aggregated_heatmapface(node, prop, min_color="#EBEBEB", max_color="#971919", tooltip=None,
                                width=70, height=None, padding_x=1, padding_y=0, count_missing=True, max_count=0):
-    counter_props = node.props.get(prop).split('||')
-    total = 0
-    positive = 0
-    for counter_prop in counter_props:
-        k, v = counter_prop.split('--')
-        if count_missing:
-            if not check_nan(k):
-                if strtobool(k):
-                    positive += float(v)
-            total += float(v)  # Consider missing data in total
-        else:
-            if not check_nan(k):
-                total += float(v)  # Doesn't consider missing data in total
-                if strtobool(k):
-                    positive += float(v)
-    
-    total = int(total)
-    # ratio = positive / total if total != 0 else 0
-    # if ratio < 0.05 and ratio != 0:  # Show minimum color for too low
-    #     ratio = 0.05
-    
-    # Adjust the maximum color based on 'total' to simulate darkening
-    adjusted_max_color = utils.make_color_darker_scaled(max_color, positive, max_count, base=10, scale_factor=10)
-    #adjusted_max_color = make_color_darker(max_color, darkening_factor=0.01)  # Example factor
-    #gradient_color = color_gradient(min_color, adjusted_max_color, mix=ratio)
-
+    positive, total = bool_counts(node.props.get(prop), count_missing=count_missing, accumulate=True)
+    color = aggregated_heatmap_color(positive, max_count, min_color=min_color, max_color=max_color)
     if not tooltip:
-        tooltip = f'<b>{node.name}</b><br>' if node.name else ''
-        if prop:
-            tooltip += f'<br>{prop}: {positive} / {total} <br>'
-    if positive == 0:
-        aggregateFace = RectFace(width=width, text=int(positive), height=height, color=min_color, padding_x=padding_x, padding_y=padding_y, tooltip=tooltip)
-    else:
-        aggregateFace = RectFace(width=width, text=int(positive), height=height, color=adjusted_max_color, padding_x=padding_x, padding_y=padding_y, tooltip=tooltip)
-    return aggregateFace
+        tooltip = node_tooltip(node, *([(prop, f'{positive} / {total} ')] if prop else []))
+    return RectFace(width=width, text=int(positive), height=height, color=color, padding_x=padding_x, padding_y=padding_y, tooltip=tooltip)
 
 def get_heatmapface(node, prop, min_color="#EBEBEB", max_color="#971919", tooltip=None, width=70, height=None, padding_x=1, padding_y=0, count_missing=True, reverse=False):
-    counter_props = node.props.get(prop).split('||')
-    total = 0
-    positive = 0
-    for counter_prop in counter_props:
-        k, v = counter_prop.split('--')
-        if count_missing:
-            if not check_nan(k):
-                if strtobool(k):
-                    positive = float(v)
-            total += float(v) # here consider missing data in total
-        else:
-            if not check_nan(k):
-                total += float(v) # here doesn't consider missing data in total
-                if strtobool(k):
-                    positive = float(v)
-            
-    total = int(total)
-    if total != 0:
-        ratio = positive / total
-    else:
-        ratio = 0
-    
-    if reverse:
-        ratio = 1 - ratio
-
-    if ratio < 0.05 and ratio != 0: # show minimum color for too low
-        ratio = 0.05
-
-    c1 = min_color
-    c2 = max_color
-    gradient_color = utils.color_gradient(c1, c2, mix=ratio)
-    text = f"{positive} / {total}"
-    # gradientFace = RectFace(width=100,height=50,text="%.1f" % (ratio*100), color=gradient_color, 
-    #         padding_x=1, padding_y=1)
-
+    positive, total = bool_counts(node.props.get(prop), count_missing=count_missing)
+    gradient_color = heatmap_color(positive, total, min_color=min_color, max_color=max_color, reverse=reverse)
     if not tooltip:
-        if node.name:
-            tooltip = f'<b>{node.name}</b><br>'
-        else:
-            tooltip = ''
-        if prop:
-            tooltip += '<br>{}: {} / {} <br>'.format(prop, positive, total)
-
-    gradientFace = RectFace(width=width, height=height, 
-                            #text=text, 
-                            color=gradient_color, 
-                            padding_x=padding_x, padding_y=padding_y, tooltip=tooltip)
-    return gradientFace
+        tooltip = node_tooltip(node, *([(prop, f'{positive} / {total} ')] if prop else []))
+    return RectFace(width=width, height=height, color=gradient_color,
+                    padding_x=padding_x, padding_y=padding_y, tooltip=tooltip)
 
 
 SeqRecord = Bio.SeqRecord.SeqRecord
@@ -134,33 +56,9 @@ def get_consensus_seq(filename: Path | str, threshold=0.7) -> SeqRecord:
     return consensus
 
 def get_stackedbarface(node, prop, color_dict=None, width=70, height=None, padding_x=1, padding_y=0, tooltip=None):
-    pair_delimiter = "--"
-    item_seperator = "||"
-    stackedbar_data = []
-    absence_color = "#EBEBEB"
-    counter_props = node.props.get(prop).split(item_seperator)
-    tooltip = ""
-    total = 0
-    
-    for counter_prop in counter_props:    
-        k, v = counter_prop.split(pair_delimiter)
-        if v:
-            total += float(v)
-        stackedbar_data.append([k,float(v),color_dict.get(k,absence_color),None])
-        
+    stackedbar_data = counter_data(node, prop, color_dict)
     if stackedbar_data:
-        tooltip = ""
-        if node.name:
-            tooltip += f'<b>{node.name}</b><br>'
-        
-        if counter_props:
-            for counter_prop in counter_props:
-                k, v = counter_prop.split(pair_delimiter)
-                tooltip += f'<b>{k}</b>:  {v}/{int(total)}<br>'
-
-        stackedbar_face = StackedBarFace(width=width, height=None, data=stackedbar_data, padding_x=padding_x, padding_y=padding_y, tooltip=tooltip)
-        
-        return stackedbar_face
+        return StackedBarFace(width=width, height=None, data=stackedbar_data, padding_x=padding_x, padding_y=padding_y, tooltip=counter_tooltip(node, prop))
     else:
         return None
 
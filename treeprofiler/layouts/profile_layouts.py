@@ -1,6 +1,7 @@
 from io import StringIO 
 from collections import OrderedDict, namedtuple
 import numpy as np
+from scipy import sparse
 import math
 import re
 
@@ -12,6 +13,7 @@ from ete4.smartview.renderer.draw_helpers import draw_text, draw_line, draw_arra
 from ete4 import SeqGroup
 from treeprofiler.layouts.general_layouts import get_piechartface, get_heatmapface
 from treeprofiler.src.utils import get_consensus_seq
+from treeprofiler.src.mipmap import ProfileMipmap, MipmapCache, representatives
 
 
 Box = namedtuple('Box', 'x y dx dy')  # corner and size of a 2D shape
@@ -143,8 +145,29 @@ class LayoutPropsMatrix(TreeLayout):
             first_leaf = next(node.leaves())
             return self._get_seq(first_leaf)
     
+    @property
+    def alignment(self):
+        return self._alignment
+
+    @alignment.setter
+    def alignment(self, alignment):
+        self._alignment = alignment
+        self._profiles = MipmapCache() # sequence key -> (seq, mipmap), kept between redraws
+
+    def get_profile(self, node):
+        """Sequence of the node and its mipmap, cached by the leaf it is taken from."""
+        if node.is_leaf or not self.summarize_inner_nodes:
+            leaf = node if node.is_leaf else next(node.leaves())
+            key = leaf.name or leaf
+        else:
+            key = node # a consensus of its leaves
+        def make():
+            seq = self.get_seq(node)
+            return seq, ProfileMipmap(seq, categorical=True) if seq else None
+        return self._profiles.get_or_make(key, make)
+
     def set_node_style(self, node):
-        seq = self.get_seq(node)
+        seq, mipmap = self.get_profile(node)
         if len(self.profiles) > 1:
             poswidth = self.width / (len(self.profiles)-1 )
         else:
@@ -157,7 +180,7 @@ class LayoutPropsMatrix(TreeLayout):
             fgcolor='black', bgcolor='#bcc3d0', gapcolor='gray',
             gap_linewidth=0.2,
             max_fsize=12, ftype='sans-serif', 
-            padding_x=0, padding_y=0)
+            padding_x=0, padding_y=0, mipmap=mipmap)
             node.add_face(seqFace, column=self.column, position='aligned', 
                     collapsed_only=(not node.is_leaf))
 
@@ -245,9 +268,29 @@ class LayoutProfile(TreeLayout):
             first_leaf = next(node.leaves())
             return self._get_seq(first_leaf)
     
+    @property
+    def alignment(self):
+        return self._alignment
+
+    @alignment.setter
+    def alignment(self, alignment):
+        self._alignment = alignment
+        self._profiles = MipmapCache() # sequence key -> (seq, mipmap), kept between redraws
+
+    def get_profile(self, node):
+        """Sequence of the node and its mipmap, cached by the leaf it is taken from."""
+        if node.is_leaf or not self.summarize_inner_nodes:
+            leaf = node if node.is_leaf else next(node.leaves())
+            key = leaf.name or leaf
+        else:
+            key = node # a consensus of its leaves
+        def make():
+            seq = self.get_seq(node)
+            return seq, ProfileMipmap(seq, categorical=True) if seq else None
+        return self._profiles.get_or_make(key, make)
+
     def set_node_style(self, node):
-        
-        seq = self.get_seq(node)
+        seq, mipmap = self.get_profile(node)
         if len(self.profiles) > 1:
             poswidth = self.width / (len(self.profiles)-1 )
         else:
@@ -260,7 +303,7 @@ class LayoutProfile(TreeLayout):
             fgcolor='black', bgcolor='#bcc3d0', gapcolor='gray',
             gap_linewidth=0.2,
             max_fsize=12, ftype='sans-serif', 
-            padding_x=0, padding_y=0)
+            padding_x=0, padding_y=0, mipmap=mipmap)
             node.add_face(seqFace, column=self.column, position='aligned', 
                     collapsed_only=(not node.is_leaf)) 
 
@@ -285,7 +328,7 @@ class LayoutPropsMatrixOld(TreeLayout):
         self.column = column
         self.aligned_faces = True
 
-        self.length = len(next((value for value in self.matrix.values() if value != [None]), None)) if any(value != [None] for value in self.matrix.values()) else 0
+        self.length = self.matrix.ncols
         self.scale_range = range or (0, self.length)
         self.value_range = value_range
         self.value_color = value_color
@@ -297,7 +340,7 @@ class LayoutPropsMatrixOld(TreeLayout):
         if self.length:
             if self.is_list:
                 # first not None list to set the column
-                ncols = len(next((value for value in self.matrix.values() if value != [None]), None)) if any(value != [None] for value in self.matrix.values()) else 0
+                ncols = self.matrix.ncols
                 if ncols > 1:
                     total_width = self.width * (ncols-1)
                 else:
@@ -339,34 +382,44 @@ class LayoutPropsMatrixOld(TreeLayout):
                                     )
     def _get_array(self, node):
         if self.matrix:
-            return self.matrix.get(node.name)
+            return self.matrix.row(node.name)
 
-    # def get_array(self, node):
-    #     if node.is_leaf:
-    #         return self._get_array(node)
-    #     else:
-    #         first_leaf = next(node.leaves())
-    #         return self._get_array(first_leaf)
+    def get_row(self, node):
+        """Name and matrix row of the node, or of its first leaf if it has none."""
+        array = self._get_array(node)
+        if array is None and not node.is_leaf:
+            node = next(node.leaves())
+            array = self._get_array(node)
+        return node.name, array
 
     def get_array(self, node):
-        if self.matrix.get(node.name):
-            return self.matrix.get(node.name)
-        else:
-            first_leaf = next(node.leaves())
-            return self._get_array(first_leaf)
+        """Matrix row of the node, or of its first leaf if it has none."""
+        return self.get_row(node)[1]
+
+    @property
+    def matrix(self):
+        return self._matrix
+
+    @matrix.setter
+    def matrix(self, matrix):
+        self._matrix = matrix
+        self._mipmaps = MipmapCache() # matrix row -> mipmap, kept between redraws
+
+    def get_mipmap(self, name, array):
+        return self._mipmaps.get(self.matrix.index[name], array, categorical=(self.matrix_type == 'categorical'))
 
     def set_node_style(self, node):
-        array = self.get_array(node)
-        if array:
+        name, array = self.get_row(node)
+        if array is not None and len(array):
             if not self.is_list:
                 if len(self.matrix_props) > 1:
                     poswidth = self.width / (len(self.matrix_props) - 1)
                 else:
                     poswidth = self.width
-                if array:
+                if len(array):
                     profileFace = ProfileFace(array, self.value_color, gap_format=None, \
                     seq_format=self.matrix_type, width=self.width, height=self.height, \
-                    poswidth=poswidth, tooltip=True)
+                    poswidth=poswidth, tooltip=True, mipmap=self.get_mipmap(name, array))
                     node.add_face(profileFace, column=self.column, position='aligned', \
                         collapsed_only=(not node.is_leaf))
             else:
@@ -374,7 +427,7 @@ class LayoutPropsMatrixOld(TreeLayout):
 
                 profileFace = ProfileFace(array, self.value_color, gap_format=None, \
                     seq_format=self.matrix_type, width=poswidth, height=self.height, \
-                    poswidth=poswidth, tooltip=True)
+                    poswidth=poswidth, tooltip=True, mipmap=self.get_mipmap(name, array))
                 node.add_face(profileFace, column=self.column, position='aligned', \
                     collapsed_only=(not node.is_leaf))
 
@@ -399,7 +452,7 @@ class LayoutPropsMatrixBinary(TreeLayout):
         self.column = column
         self.aligned_faces = True
 
-        self.length = len(next((value for value in self.matrix.values() if value != [None]), None)) if any(value != [None] for value in self.matrix.values()) else 0
+        self.length = self.matrix.ncols
         self.scale_range = range or (0, self.length)
         self.value_range = value_range
         self.value_color = value_color
@@ -411,7 +464,7 @@ class LayoutPropsMatrixBinary(TreeLayout):
         if self.length:
             if self.is_list:
                 # first not None list to set the column
-                ncols = len(next((value for value in self.matrix.values() if value != [None]), None)) if any(value != [None] for value in self.matrix.values()) else 0
+                ncols = self.matrix.ncols
                 face = MatrixScaleFace(width=self.width, scale_range=(0, ncols), padding_y=0)
                 header = self.matrix_props[0]
                 title = TextFace(header, min_fsize=5, max_fsize=12, 
@@ -445,34 +498,44 @@ class LayoutPropsMatrixBinary(TreeLayout):
 
     def _get_array(self, node):
         if self.matrix:
-            return self.matrix.get(node.name)
+            return self.matrix.row(node.name)
 
-    # def get_array(self, node):
-    #     if node.is_leaf:
-    #         return self._get_array(node)
-    #     else:
-    #         first_leaf = next(node.leaves())
-    #         return self._get_array(first_leaf)
+    def get_row(self, node):
+        """Name and matrix row of the node, or of its first leaf if it has none."""
+        array = self._get_array(node)
+        if array is None and not node.is_leaf:
+            node = next(node.leaves())
+            array = self._get_array(node)
+        return node.name, array
 
     def get_array(self, node):
-        if self.matrix.get(node.name):
-            return self.matrix.get(node.name)
-        else:
-            first_leaf = next(node.leaves())
-            return self._get_array(first_leaf)
+        """Matrix row of the node, or of its first leaf if it has none."""
+        return self.get_row(node)[1]
+
+    @property
+    def matrix(self):
+        return self._matrix
+
+    @matrix.setter
+    def matrix(self, matrix):
+        self._matrix = matrix
+        self._mipmaps = MipmapCache() # matrix row -> mipmap, kept between redraws
+
+    def get_mipmap(self, name, array):
+        return self._mipmaps.get(self.matrix.index[name], array, categorical=False)
 
     def set_node_style(self, node):
-        array = self.get_array(node)
+        name, array = self.get_row(node)
 
         if len(self.matrix_props) > 1:
             poswidth = self.width / (len(self.matrix_props)-1 )
         else:
             poswidth = self.width
         
-        if array:
+        if array is not None and array.shape[-1]:
             profileFace = ProfileFace(array, self.value_color, gap_format=None, \
             seq_format='numerical', width=self.width, height=self.height, \
-            poswidth=poswidth, tooltip=True)
+            poswidth=poswidth, tooltip=True, mipmap=self.get_mipmap(name, array))
             node.add_face(profileFace, column=self.column, position='aligned', \
                 collapsed_only=(not node.is_leaf))
 
@@ -573,8 +636,11 @@ class TextScaleFace(Face):
                 self.viewport_margin), 0) / dx)
         else:
             sm_start, sm_end = 0, nticks
+
+        # at most one header per min_fsize pixels when columns are narrow
+        step = max(1, math.ceil(self.min_fsize / (dx * zx)))
             
-        for i in range(sm_start, sm_end + 1):
+        for i in range(sm_start - sm_start % step, sm_end + 1, step):
             x = x0 + i * dx + dx/2 
             
             number = range_factor * i * dx
@@ -615,13 +681,14 @@ class ProfileAlignmentFace(Face):
             fgcolor='black', bgcolor='#bcc3d0', gapcolor='gray',
             gap_linewidth=0.2,
             max_fsize=12, ftype='sans-serif', poswidth=5,
-            padding_x=0, padding_y=0):
+            padding_x=0, padding_y=0, mipmap=None):
 
         Face.__init__(self, padding_x=padding_x, padding_y=padding_y)
 
         self.seq = seq
         self.seqlength = len(self.seq)
         self.seqtype = seqtype
+        self.mipmap = mipmap # ProfileMipmap of seq, built when zoomed out if None
 
         self.autoformat = True  # block if 1px contains > 1 tile
 
@@ -661,6 +728,12 @@ class ProfileAlignmentFace(Face):
         """Retrieves sequence given start, end"""
         return self.seq[start:end]
 
+    def get_mipmap(self):
+        # each character is a color code, blocks take the most frequent one
+        if self.mipmap is None:
+            self.mipmap = ProfileMipmap(self.seq, categorical=True)
+        return self.mipmap
+
     def build_blocks(self):
         pos = 0
         for reg in re.split('([^-]+)', self.seq):
@@ -769,12 +842,19 @@ class ProfileAlignmentFace(Face):
         #     sm_box = Box(sm_x+sm_x0, y, posw * len(seq), h)
 
         #     yield draw_array(sm_box,[gradientscolor[x] for x in seq])
-        if self.seq_format == "numerical":
+        sm_x = sm_x if drawer.TYPE == 'rect' else x0
+        y, h = get_height(sm_x, y)
+        if too_small:
+            # summary of the visible columns, one character per pixel at most
+            npx = max(math.ceil(posw * (sm_end - sm_start) * zx), 1)
+            seq, bstart, bend = self.get_mipmap().get(sm_start, sm_end, npx)
+            seq = ''.join(seq)
+            sm_box = Box(sm_x + sm_x0 - (sm_start - bstart) * posw, y, posw * (bend - bstart), h)
+        else:
             seq = self.get_seq(sm_start, sm_end)
-            sm_x = sm_x if drawer.TYPE == 'rect' else x0
-            y, h = get_height(sm_x, y)
             sm_box = Box(sm_x+sm_x0, y, posw * len(seq), h)
-            
+
+        if self.seq_format == "numerical":
             # fsize = self.get_fsize(dx / len(seq), dy, zx, zy, 20)
             # style = {
             #     'fill': "black",
@@ -787,21 +867,11 @@ class ProfileAlignmentFace(Face):
             #yield draw_text(sm_box, for i in seq, "jjj", style=style)
             
         elif self.seq_format == "categorical": 
-            
-            seq = self.get_seq(sm_start, sm_end)
-            sm_x = sm_x if drawer.TYPE == 'rect' else x0
-            y, h = get_height(sm_x, y)
-            sm_box = Box(sm_x+sm_x0, y, posw * len(seq), h)
             # aa_type = "notext"
             # yield [ f'pixi-aa_{aa_type}', sm_box, seq ]
             yield draw_array(sm_box, [profilecolors[x] for x in seq])
 
         else: # when is "profiles":
-            seq = self.get_seq(sm_start, sm_end)
-            sm_x = sm_x if drawer.TYPE == 'rect' else x0
-            y, h = get_height(sm_x, y)
-            sm_box = Box(sm_x+sm_x0, y, posw * len(seq), h)
-            
             if self.seq_format == 'profiles' or posw * zx < self._min_fsize:
                 aa_type = "notext"
                 tooltip = f'<p>{seq}</p>'
@@ -827,12 +897,13 @@ class ProfileFace(Face):
             width=None, height=None, # max height
             gap_linewidth=0.2,
             max_fsize=12, ftype='sans-serif', poswidth=5,
-            padding_x=0, padding_y=0, tooltip=True):
+            padding_x=0, padding_y=0, tooltip=True, mipmap=None):
 
         Face.__init__(self, padding_x=padding_x, padding_y=padding_y)
 
-        self.seq = seq
-        self.seqlength = len(self.seq)
+        self.seq = seq # list, array or 1-row sparse matrix
+        self.mipmap = mipmap # ProfileMipmap of seq, built when zoomed out if None
+        self.seqlength = self.seq.shape[-1] if sparse.issparse(self.seq) else len(self.seq)
         self.value2color = value2color
         self.absence_color = value2color.get(None, '#EBEBEB') if value2color else '#EBEBEB'
 
@@ -862,17 +933,40 @@ class ProfileFace(Face):
         self.max_fsize = max_fsize
         self._fsize = None
 
-        self.blocks = []
-        self.build_blocks()
+        self._blocks = None # built on first use, they are not needed to draw
     
     def __name__(self):
         return "ProfileFace"
 
+    @property
+    def blocks(self):
+        if self._blocks is None:
+            self._blocks = []
+            self.build_blocks()
+        return self._blocks
+
     def get_seq(self, start, end):
         """Retrieves sequence given start, end"""
+        if sparse.issparse(self.seq):
+            # only the requested columns are made dense
+            return self.seq[:, start:end].toarray()[0]
         return self.seq[start:end]
 
+    def get_mipmap(self):
+        if self.mipmap is None:
+            self.mipmap = ProfileMipmap(self.seq, categorical=(self.seq_format == 'categorical'))
+        return self.mipmap
+
+    def get_colors(self, values):
+        """Colors of the values, the absence color for None and NaN."""
+        return [self.absence_color if x is None or x != x else self.value2color[x] for x in values]
+
     def build_blocks(self):
+        if sparse.issparse(self.seq):
+            # the stored (non-zero) columns
+            self._blocks.extend([col, col] for col in sorted(self.seq.indices.tolist()))
+            return
+
         pos = 0
         for reg in self.seq:
             reg = str(reg)
@@ -923,32 +1017,17 @@ class ProfileFace(Face):
         return self._box
     
     def get_rep_numbers(self, num_array, rep_num):
-        def find_closest(numbers, target):
-            # Find the number in 'numbers' that is closest to calculated target
-            return min(numbers, key=lambda x: abs(x - target))
-
-        # get the representative numbers from given array
+        """
+        Representative number of each of the rep_num segments of num_array:
+        the one closest to the segment average, ignoring NaN and None.
+        """
+        if not len(num_array):
+            return []
+        if isinstance(num_array, list):
+            num_array = [np.nan if x is None else x for x in num_array]
         seg_size = math.ceil(len(num_array) / rep_num)
-        rep_elements = []
-
-        for i in range(rep_num):
-            start_index = int(i * seg_size)
-            end_index = int((i + 1) * seg_size)
-            if i == rep_num - 1:
-                end_index = len(num_array)
-
-            segment = num_array[start_index:end_index]
-            if segment:
-                if len(segment) != 0:
-                    segment_average = sum(segment) / len(segment)
-                else:
-                    segment_average = 0
-                
-                # Find the cloest number to the average
-                closest_number = find_closest(segment, segment_average)
-                rep_elements.append(closest_number)
-        return rep_elements
-            
+        return representatives(num_array, seg_size).tolist()
+
     def draw(self, drawer):
         def get_height(x, y):
             r = (x or 1e-10) if drawer.TYPE == 'circ' else 1
@@ -987,43 +1066,34 @@ class ProfileFace(Face):
         # total number of column: self.seqlength
         # at least 1px per column
 
-        if self.seq_format == "numerical":
+        sm_x = sm_x if drawer.TYPE == 'rect' else x0
+        y, h = get_height(sm_x, y)
+        if too_small:
+            # summary of the visible columns, one value per pixel at most
+            npx = max(math.ceil(posw * (sm_end - sm_start) * zx), 1)
+            seq, bstart, bend = self.get_mipmap().get(sm_start, sm_end, npx)
+            sm_box = Box(sm_x + sm_x0 - (sm_start - bstart) * posw, y, posw * (bend - bstart), h)
+        else:
             seq = self.get_seq(sm_start, sm_end)
-            sm_x = sm_x if drawer.TYPE == 'rect' else x0
-            y, h = get_height(sm_x, y)
             sm_box = Box(sm_x+sm_x0, y, posw * len(seq), h)
 
-            if too_small: # only happens in data-matrix visualization            
-                #ncols_per_px = math.ceil(self.seqlength / (zx * sm_box.dx)) #jordi's idea
-                ncols_per_px = math.ceil(self.width * zx)
-                rep_elements = self.get_rep_numbers(seq, ncols_per_px)
-                if self.tooltip:
-                    tooltip = f'<p>{seq}</p>'
-                else:
-                    tooltip = ''
-                yield draw_array(sm_box, [self.value2color[x] if x is not None else self.absence_color for x in rep_elements], tooltip=tooltip)
+        if self.seq_format == "numerical":
+            # fsize = self.get_fsize(dx / len(seq), dy, zx, zy, 20)
+            # style = {
+            #     'fill': "black",
+            #     'max_fsize': fsize,
+            #     'ftype': 'sans-serif', # default sans-serif
+            #    }
+            if self.tooltip:
+                tooltip = f'<p>{seq}</p>'
             else:
-                # fsize = self.get_fsize(dx / len(seq), dy, zx, zy, 20)
-                # style = {
-                #     'fill': "black",
-                #     'max_fsize': fsize,
-                #     'ftype': 'sans-serif', # default sans-serif
-                #    }
-                if self.tooltip:
-                    tooltip = f'<p>{seq}</p>'
-                else:
-                    tooltip = ''
-                # yield draw_text(sm_box, for i in seq, "jjj", style=style)
-                yield draw_array(sm_box, [self.value2color[x] if x is not None else self.absence_color for x in seq], tooltip=tooltip)
-            
+                tooltip = ''
+            # yield draw_text(sm_box, for i in seq, "jjj", style=style)
+            yield draw_array(sm_box, self.get_colors(seq), tooltip=tooltip)
             
         if self.seq_format == "categorical":
-            seq = self.get_seq(sm_start, sm_end)
-            sm_x = sm_x if drawer.TYPE == 'rect' else x0
-            y, h = get_height(sm_x, y)
-            sm_box = Box(sm_x+sm_x0, y, posw * len(seq), h)
             #tooltip = f'<p>{seq}</p>'
-            yield draw_array(sm_box, [self.value2color[x] if x is not None else self.absence_color for x in seq])
+            yield draw_array(sm_box, self.get_colors(seq))
 
 class MatrixScaleFace(Face):
     def __init__(self, name='', width=None, color='black',
@@ -1134,8 +1204,11 @@ class MatrixScaleFace(Face):
         else:
             sm_start, sm_end = 0, nticks
 
+        # at most one tick per min_fsize pixels when columns are narrow
+        step = max(1, math.ceil(self.min_fsize / (dx * zx)))
+
         if self.columns > 1:
-            for i in range(sm_start, sm_end + 1):
+            for i in range(sm_start - sm_start % step, sm_end + 1, step):
 
                 x = x0 + i * dx
                 
@@ -5,6 +5,8 @@ from ete4.smartview import TreeStyle, NodeStyle, TreeLayout
 from ete4.smartview  import TextFace, Face, ScaleFace, LegendFace, RectFace
 from ete4.smartview.renderer.draw_helpers import *
 from treeprofiler.src.utils import random_color, add_suffix
+from treeprofiler.src.color_scale import ColorScale
+from treeprofiler.src.payloads import NodePayloads, Payload
 
 import colorsys
 
@@ -176,6 +178,7 @@ class LayoutBarplot(LayoutPlot):
                 padding_x=padding_x, padding_y=padding_y,  scale=scale, size_range=size_range, 
                 legend=legend, active=active,
                 internal_rep=internal_rep)
+        self.payloads = NodePayloads(self.get_payload)
 
     def set_tree_style(self, tree, tree_style):
         super().set_tree_style(tree, tree_style)
@@ -212,53 +215,40 @@ class LayoutBarplot(LayoutPlot):
         else:
             return self.color
 
-    def set_node_style(self, node):
-        internal_prop = self.prop + '_' + self.internal_rep  
+    def get_payload(self, node):
+        # the size is kept as a value, the size range can be set by set_tree_style
+        internal_prop = self.prop + '_' + self.internal_rep
         if node.props.get(self.prop) is not None:
-            if node.is_leaf:
-                width = self.get_size(node, self.prop)
-                color = self.get_color(node, self.color_prop, self.colors)
-                tooltip = ""
-                if node.name:
-                    tooltip += f'<b>{node.name}</b><br>'
-                if self.size_prop:
-                    tooltip += f'<br>{self.prop}: {node.props.get(self.prop)}<br>'
-                if self.color_prop:
-                    tooltip += f'<br>{self.color_prop}: {color}<br>'
-                face = RectFace(width, None, color=color, 
-                    tooltip=tooltip, padding_x=self.padding_x, padding_y=self.padding_y)
-                node.add_face(face, position=self.position, column=self.column,
-                        collapsed_only=False)
-        
+            if not node.is_leaf:
+                return Payload('absent')
+            kind, prop, size_name = 'leaf', self.prop, self.prop
         elif node.is_leaf and node.props.get(internal_prop):
-            width = self.get_size(node, internal_prop)
-            color = self.get_color(node, self.color_prop, self.colors)
-            tooltip = ""
-            if node.name:
-                tooltip += f'<b>{node.name}</b><br>'
-            if self.size_prop:
-                tooltip += f'<br>{self.prop}: {node.props.get(internal_prop)}<br>'
-            if self.color_prop:
-                tooltip += f'<br>{self.color_prop}: {color}<br>'
-            face = RectFace(width, None, color=color, 
-                    tooltip=tooltip, padding_x=self.padding_x, padding_y=self.padding_y)
-            node.add_face(face, position=self.position, column=self.column,
-                    collapsed_only=False)
-
+            kind, prop, size_name = 'leaf', internal_prop, self.prop
         elif node.props.get(internal_prop):
-            width = self.get_size(node, internal_prop)
-            color = self.get_color(node, self.color_prop, self.colors)
-            tooltip = ""
-            if node.name:
-                tooltip += f'<b>{node.name}</b><br>'
+            kind, prop, size_name = 'internal', internal_prop, self.size_prop
+        else:
+            return Payload('absent')
+
+        color = self.get_color(node, self.color_prop, self.colors)
+        lines = []
+        if self.size_prop:
+            lines.append((size_name, node.props.get(prop)))
+        if self.color_prop:
+            lines.append((self.color_prop, color))
+        size = float(node.props.get(prop, 0)) if self.size_prop else None
+        return Payload(kind, color=color, tooltip=tuple(lines), data=size)
+
+    def set_node_style(self, node):
+        payload = self.payloads.get(node)
+        if payload.kind != 'absent':
             if self.size_prop:
-                tooltip += f'<br>{self.size_prop}: {node.props.get(internal_prop)}<br>'
-            if self.color_prop:
-                tooltip += f'<br>{self.color_prop}: {color}<br>'
-            face = RectFace(width, None, color=color, 
-                    tooltip=tooltip, padding_x=self.padding_x, padding_y=self.padding_y)
+                width = payload.data / self.size_range[1] * self.width
+            else:
+                width = self.width
+            face = RectFace(width, None, color=payload.color,
+                tooltip=self.payloads.tooltip(node), padding_x=self.padding_x, padding_y=self.padding_y)
             node.add_face(face, position=self.position, column=self.column,
-                    collapsed_only=True)
+                    collapsed_only=(payload.kind == 'internal'))
 
 class LayoutHeatmap(TreeLayout):
     def __init__(self, name=None, column=0, width=70, height=None, 
@@ -284,6 +274,7 @@ class LayoutHeatmap(TreeLayout):
         self.height = height
         self.padding_x = padding_x
         self.padding_y = padding_y
+        self.payloads = NodePayloads(self.get_payload)
 
     def set_tree_style(self, tree, tree_style):
         super().set_tree_style(tree, tree_style)
@@ -300,70 +291,33 @@ class LayoutHeatmap(TreeLayout):
                                         self.color_range.get(1),
                                     ]
                                     )
-    def set_node_style(self, node):
+    def get_payload(self, node):
         heatmap_num = node.props.get(self.prop)
-
         if heatmap_num is not None and heatmap_num != 'NaN':
-            heatmap_num = float(heatmap_num)
-            if node.is_leaf:
-                # heatmap
-                tooltip = ""
-                if node.name:
-                    tooltip += f'<b>{node.name}</b><br>'
-                if self.prop:
-                    tooltip += f'<br>{self.prop}: {heatmap_num}<br>'
-                
-                gradient_color = self.value_color.get(heatmap_num)
-                if gradient_color:
-                    identF = RectFace(width=self.width, height=self.height, 
-                    color=gradient_color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-                    node.add_face(identF, column = self.column,  position = 'aligned')
-            
-        elif node.is_leaf and node.props.get(self.internal_prop) is not None:
-            heatmap_num = node.props.get(self.internal_prop)
-            heatmap_num = float(heatmap_num)
-            # heatmap
-            tooltip = ""
-            if node.name:
-                tooltip += f'<b>{node.name}</b><br>'
-            if self.prop:
-                tooltip += f'<br>{self.prop}: {heatmap_num}<br>'
-
-            gradient_color = self.value_color.get(heatmap_num)
-
-            if gradient_color:
-                identF = RectFace(width=self.width, height=self.height, 
-                color=gradient_color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-                node.add_face(identF, column = self.column,  position = 'aligned', collapsed_only=True)
-        
+            if not node.is_leaf:
+                return Payload('absent')
+            kind = 'leaf'
         elif node.props.get(self.internal_prop) is not None:
             heatmap_num = node.props.get(self.internal_prop)
-            heatmap_num = float(heatmap_num)
-            # heatmap
-            tooltip = ""
-            if node.name:
-                tooltip += f'<b>{node.name}</b><br>'
-            if self.prop:
-                tooltip += f'<br>{self.prop}: {heatmap_num}<br>'
-            
-            gradient_color = self.value_color.get(heatmap_num)
+            kind = 'internal'
+        else:
+            return Payload('missing', text=heatmap_num)
 
-            if gradient_color:
-                identF = RectFace(width=self.width, height=self.height,
-                color=gradient_color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-                node.add_face(identF, column = self.column,  position = 'aligned', collapsed_only=True)
+        heatmap_num = float(heatmap_num)
+        tooltip = ((self.prop, heatmap_num),) if self.prop else ()
+        return Payload(kind, color=self.value_color.get(heatmap_num), tooltip=tooltip)
 
-        else:
-            # heatmap
-            tooltip = ""
-            if node.name:
-                tooltip += f'<b>{node.name}</b><br>'
-            if self.prop:
-                tooltip += f'<br>{self.prop}: {heatmap_num}<br>'
-
-            identF = RectFace(width=self.width, height=self.height, text=heatmap_num, color=self.absence_color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=None)
+    def set_node_style(self, node):
+        payload = self.payloads.get(node)
+        if payload.kind == 'missing':
+            identF = RectFace(width=self.width, height=self.height, text=payload.text, color=self.absence_color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=None)
             node.add_face(identF, column = self.column,  position = 'aligned', collapsed_only=not node.is_leaf)
 
+        elif payload.color:
+            identF = RectFace(width=self.width, height=self.height,
+            color=payload.color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=self.payloads.tooltip(node))
+            node.add_face(identF, column = self.column,  position = 'aligned', collapsed_only=(payload.kind == 'internal'))
+
 class LayoutHeatmapOld(TreeLayout):
     def __init__(self, name=None, column=0, width=70, height=None, padding_x=1, padding_y=0, \
             internal_rep=None, prop=None, maxval=100, minval=0, mean_val=0, std_val=0, \
@@ -378,6 +332,7 @@ class LayoutHeatmapOld(TreeLayout):
         self.mean_val = mean_val
         self.std_val = std_val
         self.norm_method = norm_method
+        self.color_scale = None
 
         self.internal_prop = add_suffix(prop, internal_rep)
         self.width = width
@@ -386,6 +341,7 @@ class LayoutHeatmapOld(TreeLayout):
         self.padding_y = padding_y
         self.min_fsize = 5
         self.max_fsize = 15
+        self.payloads = NodePayloads(self.get_payload)
         
     def set_tree_style(self, tree, tree_style):
         super().set_tree_style(tree, tree_style)
@@ -403,89 +359,36 @@ class LayoutHeatmapOld(TreeLayout):
                                     ]
                                     )
 
-    def min_max_normalize(self, value):
-        return (value - self.minval) / (self.maxval - self.minval)
-
-    def mean_normalize(self, value):
-        return (value - self.mean_val) / (self.maxval - self.minval)
-
-    def z_score_normalize(self, value):
-        return (value - self.mean_val) / self.std_val
-
     def _get_color(self, search_value, norm_method='min-max'):
-        num = len(self.color_dict)
-        search_value = float(search_value)
-        if norm_method == "min-max":
-            normalized_value = self.min_max_normalize(search_value)
-            index_values = np.linspace(0, 1, num)
-        elif norm_method == "mean":
-            normalized_value = self.mean_normalize(search_value)
-            index_values = np.linspace(-1, 1, num)
-        elif norm_method == "zscore":
-            normalized_value = self.z_score_normalize(search_value)
-            index_values = np.linspace(-3, 3, num)
-        else:
-            raise ValueError("Unsupported normalization method.")
-        index = np.abs(index_values - normalized_value).argmin() + 1
-        #index = np.abs(index_values - search_value).argmin() + 1
-        return self.color_dict.get(index, "")
+        if self.color_scale is None or self.color_scale.norm_method != norm_method:
+            self.color_scale = ColorScale(self.color_dict, self.minval, self.maxval,
+                norm_method=norm_method, mean_val=self.mean_val, std_val=self.std_val)
+        return self.color_scale.get(search_value, "")
 
-    def set_node_style(self, node):
+    def get_payload(self, node):
         if node.props.get(self.prop) is not None:
-            if node.is_leaf:
-                # heatmap
-                tooltip = ""
-                if node.name:
-                    tooltip += f'<b>{node.name}</b><br>'
-                if self.prop:
-                    tooltip += f'<br>{self.prop}: {node.props.get(self.prop)}<br>'
-
-                gradient_color = self._get_color(node.props.get(self.prop), norm_method=self.norm_method)
-                if gradient_color:
-                    identF = RectFace(width=self.width, height=self.height, text="%.2f" % (float(node.props.get(self.prop))), \
-                    color=gradient_color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-                else:   # for miss data
-                    identF = RectFace(width=self.width, height=self.height, text="NA", 
-                    color="", 
-                    padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-
-                node.add_face(identF, column = self.column,  position = 'aligned')
-        
-        elif node.is_leaf and node.props.get(self.internal_prop):
-            # heatmap
-            tooltip = ""
-            if node.name:
-                tooltip += f'<b>{node.name}</b><br>'
-            if self.prop:
-                tooltip += f'<br>{self.internal_prop}: {node.props.get(self.internal_prop)}<br>'
-            
-            gradient_color = self._get_color(node.props.get(self.internal_prop), norm_method=self.norm_method)
-            if gradient_color:
-                identF = RectFace(width=self.width, height=self.height, text="%.2f" % (float(node.props.get(self.internal_prop))), \
-                color=gradient_color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-            else:   # for miss data
-                identF = RectFace(width=self.width, height=self.height, text="NA", 
-                color="", 
-                padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-            node.add_face(identF, column = self.column,  position = 'aligned', collapsed_only=True)
-
+            if not node.is_leaf:
+                return Payload('absent')
+            kind, prop = 'leaf', self.prop
         elif node.props.get(self.internal_prop):
-            # heatmap
-            tooltip = ""
-            if node.name:
-                tooltip += f'<b>{node.name}</b><br>'
-            if self.prop:
-                tooltip += f'<br>{self.internal_prop}: {node.props.get(self.internal_prop)}<br>'
-            
-            gradient_color = self._get_color(node.props.get(self.internal_prop), norm_method=self.norm_method)
-            if gradient_color:
-                identF = RectFace(width=self.width, height=self.height, text="%.2f" % (float(node.props.get(self.internal_prop))), \
-                color=gradient_color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-            else:   # for miss data
-                identF = RectFace(width=self.width, height=self.height, text="NA", 
-                color="", 
-                padding_x=self.padding_x, padding_y=self.padding_y, tooltip=tooltip)
-            node.add_face(identF, column = self.column,  position = 'aligned', collapsed_only=True)
+            kind, prop = 'internal', self.internal_prop
+        else:
+            return Payload('absent')
+
+        value = node.props.get(prop)
+        tooltip = ((prop, value),) if self.prop else ()
+        gradient_color = self._get_color(value, norm_method=self.norm_method)
+        if gradient_color:
+            return Payload(kind, color=gradient_color, tooltip=tooltip, text="%.2f" % (float(value)))
+        else:   # for miss data
+            return Payload(kind, color="", tooltip=tooltip, text="NA")
+
+    def set_node_style(self, node):
+        payload = self.payloads.get(node)
+        if payload.kind != 'absent':
+            identF = RectFace(width=self.width, height=self.height, text=payload.text,
+            color=payload.color, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=self.payloads.tooltip(node))
+            node.add_face(identF, column = self.column,  position = 'aligned', collapsed_only=(payload.kind == 'internal'))
 
 class LayoutBranchScore(TreeLayout):
     def __init__(self, name, color_dict, prop, internal_rep=None, \
@@ -505,6 +408,7 @@ class LayoutBranchScore(TreeLayout):
         self.show_score = show_score
         self.line_width = 3
         self.active = active
+        self.payloads = NodePayloads(self.get_payload)
 
     def set_tree_style(self, tree, tree_style):
         if self.legend:
@@ -521,47 +425,27 @@ class LayoutBranchScore(TreeLayout):
     #     index = np.abs(index_values - search_value).argmin() + 1
     #     return self.color_dict.get(index, self.absence_color)
 
-    def set_node_style(self, node):
+    def get_payload(self, node):
         prop_score = node.props.get(self.prop)
-        if prop_score is not None:
-            prop_score = float(prop_score)
-            node.sm_style["hz_line_color"] = self.color_dict.get(prop_score)
-            node.sm_style["hz_line_width"] = self.line_width
-            node.sm_style["vt_line_color"] = self.color_dict.get(prop_score)
-            node.sm_style["vt_line_width"] = self.line_width
-            node.sm_style["outline_color"] = self.color_dict.get(prop_score)
-            
-            if self.show_score:                
-                node.add_face(
-                    TextFace("%.2f" % (float(prop_score)), color=self.color_dict.get(prop_score)),
-                    position="branch_bottom")
-
-        elif node.is_leaf and node.props.get(self.internal_prop):
+        if prop_score is None and node.props.get(self.internal_prop):
             prop_score = node.props.get(self.internal_prop)
-            prop_score = float(prop_score)
-            node.sm_style["hz_line_color"] = self.color_dict.get(prop_score)
-            node.sm_style["hz_line_width"] = self.line_width
-            node.sm_style["vt_line_color"] = self.color_dict.get(prop_score)
-            node.sm_style["vt_line_width"] = self.line_width
-            node.sm_style["outline_color"] = self.color_dict.get(prop_score)
-            
-            if self.show_score:                
-                node.add_face(
-                    TextFace("%.2f" % (float(prop_score)), color=self.color_dict.get(prop_score)),
-                    position="branch_bottom")
+        if prop_score is None:
+            return Payload('absent')
+        prop_score = float(prop_score)
+        return Payload('score', color=self.color_dict.get(prop_score), text="%.2f" % prop_score)
 
-        elif node.props.get(self.internal_prop):
-            prop_score = node.props.get(self.internal_prop)
-            prop_score = float(prop_score)
-            node.sm_style["hz_line_color"] = self.color_dict.get(prop_score)
+    def set_node_style(self, node):
+        payload = self.payloads.get(node)
+        if payload.kind == 'score':
+            node.sm_style["hz_line_color"] = payload.color
             node.sm_style["hz_line_width"] = self.line_width
-            node.sm_style["vt_line_color"] = self.color_dict.get(prop_score)
+            node.sm_style["vt_line_color"] = payload.color
             node.sm_style["vt_line_width"] = self.line_width
-            node.sm_style["outline_color"] = self.color_dict.get(prop_score)
+            node.sm_style["outline_color"] = payload.color
 
-            if self.show_score:                
+            if self.show_score:
                 node.add_face(
-                    TextFace("%.2f" % (float(prop_score)), color=self.color_dict.get(prop_score)),
+                    TextFace(payload.text, color=payload.color),
                     position="branch_bottom")
 
 class LayoutBubbleNumerical(TreeLayout):
@@ -592,6 +476,7 @@ class LayoutBubbleNumerical(TreeLayout):
         
         self.legend = legend
         self.active = active
+        self.payloads = NodePayloads(self.get_payload)
 
     def set_tree_style(self, tree, tree_style):
         super().set_tree_style(tree, tree_style)
@@ -611,43 +496,18 @@ class LayoutBubbleNumerical(TreeLayout):
         return bubble_size
 
 
-    def set_node_style(self, node):
+    def get_payload(self, node):
         number = node.props.get(self.prop)
-        if number is not None:
-            # Ensure number is converted to float
-            number = float(number)
-            
-            # Set bubble size and color based on the number's value
-            bubble_size = self._get_bubble_size(number)
-            bubble_color = self.value2color.get(number)
-            
-            # Apply styles to the node
-            node.sm_style["size"] = bubble_size
-            node.sm_style["fgcolor"] = bubble_color
-            node.sm_style["fgopacity"] = self.fgopacity
+        if number is None and node.props.get(self.internal_prop):
+            number = node.props.get(self.internal_prop)
+        if number is None:
+            return Payload('absent')
+        number = float(number)
+        return Payload('number', color=self.value2color.get(number), data=self._get_bubble_size(number))
 
-        elif node.is_leaf and node.props.get(self.internal_prop):
-            # Since it's a leaf node with internal properties, use internal_prop as number
-            number = float(node.props.get(self.internal_prop))
-            
-            # Set bubble size and color based on the number's value
-            bubble_size = self._get_bubble_size(number)
-            bubble_color = self.value2color.get(number)
-
-            # Apply styles to the node
-            node.sm_style["size"] = bubble_size
-            node.sm_style["fgcolor"] = bubble_color
-            node.sm_style["fgopacity"] = self.fgopacity
-
-        elif node.props.get(self.internal_prop):
-            # Handle non-leaf nodes with internal properties
-            number = float(node.props.get(self.internal_prop))
-
-            # Set bubble size and color based on the number's value
-            bubble_size = self._get_bubble_size(number)
-            bubble_color = self.value2color.get(number)
-
-            # Apply styles to the node
-            node.sm_style["size"] = bubble_size
-            node.sm_style["fgcolor"] = bubble_color
+    def set_node_style(self, node):
+        payload = self.payloads.get(node)
+        if payload.kind == 'number':
+            node.sm_style["size"] = payload.data
+            node.sm_style["fgcolor"] = payload.color
             node.sm_style["fgopacity"] = self.fgopacity
@@ -5,7 +5,8 @@ import random, string
 from ete4.smartview import TreeStyle, NodeStyle, TreeLayout, PieChartFace
 from ete4.smartview  import Face, RectFace, CircleFace, SeqMotifFace, TextFace, OutlineFace
 from ete4.smartview.renderer.draw_helpers import draw_text, draw_line, draw_array, draw_rect
-from treeprofiler.layouts.general_layouts import get_piechartface, get_stackedbarface
+from treeprofiler.layouts.general_layouts import get_piechartface, get_stackedbarface, StackedBarFace
+from treeprofiler.src.payloads import NodePayloads, Payload, counter_data, joined_text
 from treeprofiler.src.utils import random_color, add_suffix
 """
 label_layout, colorbranch_layout, rectangular_layout   
@@ -208,6 +209,7 @@ class LayoutText(TreeLayout):
         self.absence_color = "#EBEBEB"
         self.padding_x = padding_x
         self.padding_y = padding_y
+        self.payloads = NodePayloads(self.get_payload)
 
     def set_tree_style(self, tree, tree_style):
         super().set_tree_style(tree, tree_style)
@@ -221,27 +223,27 @@ class LayoutText(TreeLayout):
                                     colormap=self.color_dict
                                     )
 
-    def set_node_style(self, node):
+    def get_payload(self, node):
         if node.is_leaf and node.props.get(self.prop):
-            prop_text = node.props.get(self.prop)
-            if prop_text:
-                if type(prop_text) == list:
-                    prop_text = ",".join(prop_text)
-                else:
-                    pass
-                if self.color_dict:
-                    prop_face = TextFace(prop_text, color=self.color_dict.get(prop_text, 'black'),min_fsize=self.min_fsize, max_fsize=self.max_fsize, padding_x=self.padding_x, width=self.width )
-                else:
-                    prop_face = TextFace(prop_text, color='black', min_fsize=self.min_fsize, max_fsize=self.max_fsize, padding_x=self.padding_x, width=self.width )
+            prop_text = joined_text(node.props.get(self.prop))
+            color = self.color_dict.get(prop_text, 'black') if self.color_dict else 'black'
+            return Payload('text', color=color, text=prop_text)
+        elif node.props.get(self.internal_prop):
+            data = counter_data(node, self.internal_prop, self.color_dict)
+            return Payload('counter', tooltip=self.internal_prop, data=data)
+        else:
+            return Payload('absent')
+
+    def set_node_style(self, node):
+        payload = self.payloads.get(node)
+        if payload.kind == 'text':
+            prop_face = TextFace(payload.text, color=payload.color, min_fsize=self.min_fsize, max_fsize=self.max_fsize, padding_x=self.padding_x, width=self.width)
             node.add_face(prop_face, column=self.column, position="aligned")
-            
-        elif node.is_leaf and node.props.get(self.internal_prop):
-            stackedbar_face = get_stackedbarface(node, self.internal_prop, self.color_dict, width=self.width, padding_x=self.padding_x, padding_y=self.padding_y)
-            node.add_face(stackedbar_face, column = self.column, position = "aligned", collapsed_only=False)
 
-        elif node.props.get(self.internal_prop):
-            stackedbar_face = get_stackedbarface(node, self.internal_prop, self.color_dict, width=self.width, padding_x=self.padding_x, padding_y=self.padding_y)
-            node.add_face(stackedbar_face, column = self.column, position = "aligned", collapsed_only=True)
+        elif payload.kind == 'counter':
+            if payload.data:
+                stackedbar_face = StackedBarFace(width=self.width, height=None, data=payload.data, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=self.payloads.tooltip(node))
+                node.add_face(stackedbar_face, column = self.column, position = "aligned", collapsed_only=not node.is_leaf)
             # piechart_face = get_piechartface(node, self.internal_prop, self.color_dict, radius=25)
             # node.add_face(piechart_face, column = self.column, position = "branch_right", collapsed_only=False)
             # node.add_face(piechart_face, column = self.column, position = "branch_right", collapsed_only=True)
@@ -265,6 +267,7 @@ class LayoutColorbranch(TreeLayout):
         self.width = width
         self.padding_x = padding_x
         self.padding_y = padding_y
+        self.payloads = NodePayloads(self.get_payload)
 
     def set_tree_style(self, tree, tree_style):
         super().set_tree_style(tree, tree_style)
@@ -277,38 +280,41 @@ class LayoutColorbranch(TreeLayout):
                                     colormap=self.color_dict
                                     )
 
-    def set_node_style(self, node):
+    def get_payload(self, node):
+        data = counter_data(node, self.internal_prop, self.color_dict)
         prop_text = node.props.get(self.prop)
         if prop_text is not None:
-            if type(prop_text) == list:
-                prop_text = ",".join(prop_text)
-            else:
-                pass
+            color = self.color_dict.get(joined_text(prop_text), "") if self.color_dict else None
+            return Payload('prop', color=color, tooltip=self.internal_prop, data=data)
+        return Payload('absent', tooltip=self.internal_prop, data=data)
 
-            if self.color_dict:
+    def set_node_style(self, node):
+        payload = self.payloads.get(node)
+        if payload.kind == 'prop':
+            color = payload.color
+            if color is not None:
                 if node.is_leaf:
-                    node.add_face(TextFace(node.name, color = self.color_dict.get(prop_text,""), 
+                    node.add_face(TextFace(node.name, color=color,
                     padding_x=self.padding_x),column=0, position="branch_right")
-                node.add_face(TextFace(node.name, color = self.color_dict.get(prop_text,""), 
+                node.add_face(TextFace(node.name, color=color,
                 padding_x=self.padding_x),column=self.column, position="branch_right", collapsed_only=True)
 
-                node.sm_style["hz_line_color"] = self.color_dict.get(prop_text,"")
+                node.sm_style["hz_line_color"] = color
                 node.sm_style["hz_line_width"] = 3
-                node.sm_style["vt_line_color"] = self.color_dict.get(prop_text,"")
+                node.sm_style["vt_line_color"] = color
                 node.sm_style["vt_line_width"] = 3
-                node.sm_style['outline_color'] = self.color_dict.get(prop_text,"")
+                node.sm_style['outline_color'] = color
                 node.add_face(RectFace(width=self.width, height=None, color=self.absence_color, \
                     padding_x=self.padding_x , padding_y=self.padding_y, tooltip=None),column=self.column, position="aligned")
-        
-        elif node.is_leaf and node.props.get(self.internal_prop):
-            stackedbar_face = get_stackedbarface(node, self.internal_prop, self.color_dict, width=self.width, padding_x=self.padding_x, padding_y=self.padding_y)
-            node.add_face(stackedbar_face, column = self.column, position = "aligned", collapsed_only=False)
 
+        elif node.is_leaf and payload.data:
+            stackedbar_face = StackedBarFace(width=self.width, height=None, data=payload.data, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=self.payloads.tooltip(node))
+            node.add_face(stackedbar_face, column = self.column, position = "aligned", collapsed_only=False)
 
-        if node.props.get(self.internal_prop):
-            stackedbar_face = get_stackedbarface(node, self.internal_prop, self.color_dict, width=self.width, padding_x=self.padding_x, padding_y=self.padding_y)
+        if payload.data:
+            stackedbar_face = StackedBarFace(width=self.width, height=None, data=payload.data, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=self.payloads.tooltip(node))
             node.add_face(stackedbar_face, column = self.column, position = "aligned", collapsed_only=True)
-        
+
         else:
             prop_face = RectFace(width=self.width, height=self.height, color=self.absence_color, \
                     padding_x=self.padding_x , padding_y=self.padding_y, tooltip=None)
@@ -330,6 +336,7 @@ class LayoutRect(TreeLayout):
         self.max_fsize = 15
         self.padding_x = padding_x
         self.padding_y = padding_y
+        self.payloads = NodePayloads(self.get_payload)
     
     def set_tree_style(self, tree, tree_style):
         super().set_tree_style(tree, tree_style)
@@ -348,41 +355,39 @@ class LayoutRect(TreeLayout):
                                     variable='discrete',
                                     colormap={'NA':self.absence_color}
                                     )
-    def set_node_style(self, node):
+    def get_payload(self, node):
         if node.is_leaf:
-            prop_text = node.props.get(self.prop)
+            prop_text = joined_text(node.props.get(self.prop))
             if prop_text:
-                if type(prop_text) == list:
-                    prop_text = ",".join(prop_text)
-                else:
-                    pass
-                tooltip = ""
-                if node.name:
-                    tooltip += f'<b>{node.name}</b><br>'
-                if self.prop:
-                    tooltip += f'<br>{self.prop}: {prop_text}<br>'
-                
-                if self.color_dict:
-                    color = self.color_dict.get(prop_text,"")
-                    prop_face = RectFace(width=self.width, height=self.height, color=color, \
-                        padding_x=self.padding_x , padding_y=self.padding_y, tooltip=tooltip)
-                    node.add_face(prop_face, column=self.column, position="aligned")
-            else:
-                #prop_face = CircleFace(radius=self.radius, color='grey', padding_x=self.padding_x, padding_y=self.padding_y)
-                prop_face = RectFace(width=self.width, height=self.height, text="NA", color=self.absence_color, \
-                        padding_x=self.padding_x , padding_y=self.padding_y, tooltip=None)
+                color = self.color_dict.get(prop_text, "") if self.color_dict else None
+                return Payload('prop', color=color, tooltip=((self.prop, prop_text),))
+            return Payload('missing')
+        elif node.props.get(self.internal_prop):
+            data = counter_data(node, self.internal_prop, self.color_dict)
+            return Payload('counter', tooltip=self.internal_prop, data=data)
+        else:
+            return Payload('absent')
+
+    def set_node_style(self, node):
+        payload = self.payloads.get(node)
+        if payload.kind == 'prop':
+            if payload.color is not None:
+                prop_face = RectFace(width=self.width, height=self.height, color=payload.color, \
+                    padding_x=self.padding_x , padding_y=self.padding_y, tooltip=self.payloads.tooltip(node))
                 node.add_face(prop_face, column=self.column, position="aligned")
-        
-        elif node.is_leaf and node.props.get(self.internal_prop):
-            stackedbar_face = get_stackedbarface(node, self.internal_prop, self.color_dict, width=self.width, padding_x=self.padding_x, padding_y=self.padding_y)
-            node.add_face(stackedbar_face, column = self.column, position = "aligned", collapsed_only=False)
 
-        elif node.props.get(self.internal_prop):
-            stackedbar_face = get_stackedbarface(node, self.internal_prop, self.color_dict, width=self.width, padding_x=self.padding_x, padding_y=self.padding_y)
-            node.add_face(stackedbar_face, column = self.column, position = "aligned", collapsed_only=True)
+        elif payload.kind == 'missing':
+            #prop_face = CircleFace(radius=self.radius, color='grey', padding_x=self.padding_x, padding_y=self.padding_y)
+            prop_face = RectFace(width=self.width, height=self.height, text="NA", color=self.absence_color, \
+                    padding_x=self.padding_x , padding_y=self.padding_y, tooltip=None)
+            node.add_face(prop_face, column=self.column, position="aligned")
+
+        elif payload.kind == 'counter':
+            if payload.data:
+                stackedbar_face = StackedBarFace(width=self.width, height=None, data=payload.data, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=self.payloads.tooltip(node))
+                node.add_face(stackedbar_face, column = self.column, position = "aligned", collapsed_only=True)
 
         else:
-            
             prop_face = RectFace(width=self.width, height=self.height, color=self.absence_color, \
                     padding_x=self.padding_x , padding_y=self.padding_y, tooltip=None)
             node.add_face(prop_face, column=self.column, position="aligned", collapsed_only=True)
@@ -399,6 +404,7 @@ class LayoutPiechart(TreeLayout):
         self.padding_x = padding_x
         self.padding_y = padding_y
         self.legend = legend
+        self.payloads = NodePayloads(self.get_payload)
     
     def set_tree_style(self, tree, tree_style):
         super().set_tree_style(tree, tree_style)
@@ -409,12 +415,18 @@ class LayoutPiechart(TreeLayout):
                                     colormap=self.color_dict
                                     )
 
+    def get_payload(self, node):
+        if not node.is_leaf and node.props.get(self.internal_prop):
+            data = counter_data(node, self.internal_prop, self.color_dict, absence_color=None)
+            return Payload('counter', data=data)
+        return Payload('absent')
+
     def set_node_style(self, node):
-        if not node.is_leaf:
-            if node.props.get(self.internal_prop):
-                piechart_face = get_piechartface(node, self.internal_prop, self.color_dict, radius=self.radius)
-                node.add_face(piechart_face, column = 1, position = "branch_right", collapsed_only=False)
-                node.add_face(piechart_face, column = 1, position = "branch_right", collapsed_only=True)
+        payload = self.payloads.get(node)
+        if payload.data:
+            piechart_face = PieChartFace(radius=self.radius, data=payload.data, padding_x=5)
+            node.add_face(piechart_face, column = 1, position = "branch_right", collapsed_only=False)
+            node.add_face(piechart_face, column = 1, position = "branch_right", collapsed_only=True)
 
 class LayoutBackground(TreeLayout):
     def __init__(self, name, color_dict, prop, width=70, column=0, 
@@ -432,6 +444,7 @@ class LayoutBackground(TreeLayout):
         self.padding_y = padding_y
         self.absence_color = "#EBEBEB"
         self.legend = legend
+        self.payloads = NodePayloads(self.get_payload)
     
     def set_tree_style(self, tree, tree_style):
         super().set_tree_style(tree, tree_style)
@@ -443,22 +456,19 @@ class LayoutBackground(TreeLayout):
                                     colormap=self.color_dict
                                     )
 
-    def set_node_style(self, node):
-        prop_text = node.props.get(self.prop)
+    def get_payload(self, node):
+        data = counter_data(node, self.internal_prop, self.color_dict)
+        prop_text = joined_text(node.props.get(self.prop))
         if prop_text:
-            
-            if type(prop_text) == list:
-                prop_text = ",".join(prop_text)
-            else:
-                pass
-            tooltip = ""
-            if node.name:
-                tooltip += f'<b>{node.name}</b><br>'
-            if self.prop:
-                tooltip += f'<br>{self.prop}: {prop_text}<br>'
-            
-            if self.color_dict:
-                color = self.color_dict.get(prop_text, self.absence_color)
+            color = self.color_dict.get(prop_text, self.absence_color) if self.color_dict else None
+            return Payload('prop', color=color, tooltip=self.internal_prop, data=data)
+        return Payload('absent', tooltip=self.internal_prop, data=data)
+
+    def set_node_style(self, node):
+        payload = self.payloads.get(node)
+        if payload.kind == 'prop':
+            color = payload.color
+            if color is not None:
                 align_link_face = AlignLinkFace(width=self.width*2, height=None,
                     stroke_color=color, stroke_width=2, line_type=0, opacity=0.7)
                 node.sm_style["bgcolor"] = color
@@ -469,12 +479,12 @@ class LayoutBackground(TreeLayout):
                         position='branch_right',
                         column=0,
                         )
-        elif node.is_leaf and node.props.get(self.internal_prop):
-            stackedbar_face = get_stackedbarface(node, self.internal_prop, self.color_dict, width=self.width, padding_x=self.padding_x, padding_y=self.padding_y)
+        elif node.is_leaf and payload.data:
+            stackedbar_face = StackedBarFace(width=self.width, height=None, data=payload.data, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=self.payloads.tooltip(node))
             node.add_face(stackedbar_face, column = self.column, position = "aligned", collapsed_only=False)
 
-        if node.props.get(self.internal_prop):
-            stackedbar_face = get_stackedbarface(node, self.internal_prop, self.color_dict, width=self.width, padding_x=self.padding_x, padding_y=self.padding_y)
+        if payload.data:
+            stackedbar_face = StackedBarFace(width=self.width, height=None, data=payload.data, padding_x=self.padding_x, padding_y=self.padding_y, tooltip=self.payloads.tooltip(node))
             node.add_face(stackedbar_face, column = self.column, position = "aligned", collapsed_only=True)
         # else:
         #     prop_face = RectFace(width=self.width, height=None, color=self.absence_color, \
@@ -506,6 +516,7 @@ class LayoutBubbleCategorical(TreeLayout):
    
         self.legend = legend
         self.active = active
+        self.payloads = NodePayloads(self.get_payload)
 
     def set_tree_style(self, tree, tree_style):
         super().set_tree_style(tree, tree_style)
@@ -522,22 +533,19 @@ class LayoutBubbleCategorical(TreeLayout):
                                     colormap={'NA':self.absence_color}
                                     )
 
-    def set_node_style(self, node):
+    def get_payload(self, node):
         prop_text = node.props.get(self.prop)
-        if prop_text is not None:
-            if type(prop_text) == list:
-                prop_text = ",".join(prop_text)
-            else:
-                pass
-            if self.color_dict:
-                bubble_color = self.color_dict.get(prop_text, self.absence_color)
-                bubble_size = self.max_radius
-                # node.sm_style["fgcolor"] = bubble_color
-                # node.sm_style["size"] = bubble_size
-                # node.sm_style["fgopacity"] = self.fgopacity
-                prop_face = CircleFace(radius=bubble_size, color=bubble_color, 
-                padding_x=self.padding_x, padding_y=self.padding_y)
-                node.add_face(prop_face, column=self.column, 
-                position="branch_right", collapsed_only=False)
+        if prop_text is not None and self.color_dict:
+            return Payload('prop', color=self.color_dict.get(joined_text(prop_text), self.absence_color))
+        return Payload('absent')
 
-        
+    def set_node_style(self, node):
+        payload = self.payloads.get(node)
+        if payload.kind == 'prop':
+            # node.sm_style["fgcolor"] = payload.color
+            # node.sm_style["size"] = self.max_radius
+            # node.sm_style["fgopacity"] = self.fgopacity
+            prop_face = CircleFace(radius=self.max_radius, color=payload.color,
+            padding_x=self.padding_x, padding_y=self.padding_y)
+            node.add_face(prop_face, column=self.column,
+            position="branch_right", collapsed_only=False)
@@ -78,7 +78,8 @@ def main():
     # Delayed import to avoid circular import issue
     from treeprofiler import tree_annotate
     from treeprofiler import tree_plot
-    
+    from treeprofiler import tree_batch
+
     ## - ANNOTATE -
     annotate_args_p = subparser.add_parser('annotate', parents=[main_args_p],
                                             description='annotate tree')
@@ -91,6 +92,12 @@ def main():
     tree_plot.poplulate_plot_args(plot_args_p)
     plot_args_p.set_defaults(func=tree_plot.run)
 
+    ## - BATCH -
+    batch_args_p = subparser.add_parser('batch',
+                                        description='render the figures of a manifest')
+    tree_batch.populate_batch_args(batch_args_p)
+    batch_args_p.set_defaults(func=tree_batch.run)
+
     ## - RUN -
     if len(sys.argv[1:]) < 1:
         print(parser.print_usage())
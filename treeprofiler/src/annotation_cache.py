@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+
+# Content-addressed cache of annotation results.
+# A run is identified by the content of its input files and the options that
+# change the annotation. The annotated tree and its prop2type are pickled in
+# the cache directory under that key. Entries are evicted least recently used
+# first (by modification time, refreshed on every hit) once the directory
+# grows over its size limit.
+
+logger = logging.getLogger(__name__)
+
+CACHE_SUFFIX = '.annotation.pkl'
+DEFAULT_MAX_SIZE = 1024 # MiB
+HASH_BLOCK_SIZE = 1 << 20
+
+def file_digest(path):
+    """sha256 hexdigest of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_key(input_files, options):
+    """
+    Return the key of an annotation run.
+
+    :param input_files: Dictionary of option name and its input path or list
+        of paths, hashed by content. None values are allowed.
+    :param options: Dictionary of the other options, they must be
+        representable as JSON (non JSON values are hashed with str()).
+    """
+    files = {}
+    for name, paths in input_files.items():
+        if paths is None:
+            files[name] = None
+        elif isinstance(paths, str):
+            files[name] = file_digest(paths)
+        else:
+            files[name] = [file_digest(path) for path in paths]
+    payload = json.dumps({'files': files, 'options': options}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key + CACHE_SUFFIX)
+
+def load(cache_dir, key):
+    """Return the cached (tree, prop2type) of key, None if not cached."""
+    path = _entry_path(cache_dir, key)
+    try:
+        with open(path, 'rb') as f:
+            tree, prop2type = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (pickle.UnpicklingError, EOFError, ValueError) as e:
+        logger.warning(f"Discarding unreadable annotation cache entry {path}: {e}")
+        os.remove(path)
+        return None
+    os.utime(path) # mark as recently used
+    return tree, prop2type
+
+def store(cache_dir, key, tree, prop2type, max_size=DEFAULT_MAX_SIZE):
+    """
+    Cache the annotated tree and its prop2type under key, then evict the
+    least recently used entries until the cache fits in max_size MiB.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        data = pickle.dumps((tree, prop2type), protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, RecursionError, TypeError) as e:
+        logger.warning(f"Annotated tree could not be cached: {e}")
+        return
+
+    # write to a temporary file first so a concurrent run never reads a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, _entry_path(cache_dir, key))
+    evict(cache_dir, max_size)
+
+def evict(cache_dir, max_size=DEFAULT_MAX_SIZE, suffix=CACHE_SUFFIX):
+    """
+    Remove the least recently used entries (files ending in suffix) until the
+    cache fits in max_size MiB. Return the size in bytes of the ones left.
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(suffix):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    limit = max_size * 2**20
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        os.remove(path)
+        total -= size
+    return total
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+from functools import lru_cache
+
+import numpy as np
+
+from treeprofiler.src.counters import parse_counter
+
+# Boolean property values.
+# Boolean properties keep the representation of the metadata ('True', 'yes',
+# '1', ...) so that the annotated outputs don't change. Each distinct
+# representation is decoded once into a native bool by a memoized lookup, the
+# same for the keys of the `_counter` properties, whose positive and total
+# counts are also decoded once per counter. For whole columns of values,
+# bool_column gives a uint8 array.
+# These replace distutils' strtobool (removed in Python 3.12) and accept the
+# same representations.
+
+TRUE_VALUES = {'y', 'yes', 't', 'true', 'on', '1'}
+FALSE_VALUES = {'n', 'no', 'f', 'false', 'off', '0'}
+
+# values of bool_column
+FALSE, TRUE, MISSING = 0, 1, 255
+
+@lru_cache(maxsize=4096)
+def _str_to_bool(value):
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    return None
+
+def to_bool(value):
+    """
+    Return the bool of a property value, None if it is missing (None, NaN,
+    'none', '') or not a boolean representation.
+    """
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value != value:
+        return None
+    return _str_to_bool(str(value))
+
+def bool_column(values):
+    """Array of uint8 with TRUE, FALSE or MISSING for each value."""
+    codes = {True: TRUE, False: FALSE, None: MISSING}
+    return np.fromiter((codes[to_bool(value)] for value in values), dtype=np.uint8)
+
+@lru_cache(maxsize=65536)
+def _bool_counts(counter, count_missing, accumulate):
+    return _count_bools(parse_counter(counter), count_missing, accumulate)
+
+def _count_bools(counts, count_missing, accumulate):
+    total = 0
+    positive = 0
+    for k, v in counts.items():
+        value = to_bool(k)
+        if value:
+            positive = positive + v if accumulate else v
+        if value is not None or count_missing:
+            total += v
+    return positive, int(total)
+
+def bool_counts(counter, count_missing=True, accumulate=False):
+    """
+    Return the positive and total counts of a counter of boolean values.
+
+    :param count_missing: Count the missing values in the total.
+    :param accumulate: Add up the counts of all the true representations
+        instead of taking the last one.
+    """
+    if isinstance(counter, dict):
+        return _count_bools(counter, count_missing, accumulate)
+    return _bool_counts(counter, count_missing, accumulate)
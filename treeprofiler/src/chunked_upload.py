@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+# Files uploaded in chunks to the web app.
+# The first chunk of a file creates a temporary file with the size of the
+# whole file, and every chunk is written at its offset (its index times the
+# chunk size) as it arrives, so chunks can come in any order and the file is
+# never kept in memory. A chunk is first read into a spooled temporary file
+# (in memory up to SPOOL_SIZE) while it is hashed, and only written at its
+# offset and counted as received if it has the size of its part of the file
+# (the chunk size, but for the last chunk) and its checksum (sha256 hex
+# digest, when the client sends one) matches, so a corrupted chunk never
+# overwrites a good one and is just sent again. The received chunks of a
+# file can be asked for, so an interrupted upload resumes with the missing
+# ones. Uploads with no new chunk for a while are abandoned and their
+# partial files removed.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024 # bytes, the one of the upload page
+DEFAULT_TIMEOUT = 3600 # seconds without chunks before an upload is abandoned
+COPY_BLOCK_SIZE = 64 * 1024
+SPOOL_SIZE = DEFAULT_CHUNK_SIZE # bytes of a chunk kept in memory before it is written
+
+class ChecksumError(ValueError):
+    pass
+
+class Upload:
+    """A file being uploaded in total_chunks chunks of chunk_size bytes."""
+
+    def __init__(self, path, total_chunks, chunk_size, file_size=None):
+        self.path = path
+        self.total_chunks = total_chunks
+        self.chunk_size = chunk_size
+        self.file_size = file_size
+        self.received = set()
+        self.updated = time.time()
+
+    @property
+    def complete(self):
+        return len(self.received) == self.total_chunks
+
+class ChunkedUploads:
+    """Partial uploads by (treename, file id), assembled in upload_dir."""
+
+    def __init__(self, upload_dir=None, timeout=DEFAULT_TIMEOUT):
+        self.upload_dir = upload_dir
+        self.timeout = timeout
+        self.uploads = {} # (treename, file id) -> upload
+        self.lock = threading.Lock()
+        if upload_dir:
+            os.makedirs(upload_dir, exist_ok=True)
+
+    def received(self, key):
+        """Indices of the chunks of key received so far (empty if unknown)."""
+        with self.lock:
+            upload = self.uploads.get(key)
+            return sorted(upload.received) if upload else []
+
+    def write_chunk(self, key, index, total_chunks, stream, chunk_size=DEFAULT_CHUNK_SIZE,
+                    file_size=None, checksum=None):
+        """
+        Write chunk index of the file key, read from stream, at its offset.
+        Return the path of the assembled file if it was the last missing chunk,
+        None otherwise. Raise ChecksumError if the chunk does not match its
+        checksum, and ValueError if it does not fit in the file.
+        """
+        self.cleanup()
+        if not 0 <= index < total_chunks or chunk_size <= 0:
+            raise ValueError(f"chunk {index} of {total_chunks} of {chunk_size} bytes")
+
+        upload = self._upload(key, total_chunks, chunk_size, file_size)
+        offset = index * upload.chunk_size
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.SpooledTemporaryFile(SPOOL_SIZE, dir=self.upload_dir) as spool:
+            for block in iter(lambda: stream.read(COPY_BLOCK_SIZE), b''):
+                size += len(block)
+                if size > upload.chunk_size:
+                    raise ValueError(f"chunk {index} is larger than {upload.chunk_size} bytes")
+                digest.update(block)
+                spool.write(block)
+            if index < upload.total_chunks - 1:
+                expected = upload.chunk_size # all but the last chunk are full
+            elif upload.file_size is not None:
+                expected = upload.file_size - offset
+            else:
+                expected = None # the last chunk of a file of unknown size
+            if size == 0 or expected is not None and size != expected:
+                raise ValueError(f"chunk {index} has {size} bytes, not the size of its part of the file")
+            if checksum and digest.hexdigest() != checksum.lower():
+                raise ChecksumError(f"checksum of chunk {index} does not match")
+
+            spool.seek(0)
+            try:
+                with open(upload.path, 'r+b') as f:
+                    f.seek(offset)
+                    for block in iter(lambda: spool.read(COPY_BLOCK_SIZE), b''):
+                        f.write(block)
+            except OSError:
+                with self.lock: # its part may be half written now
+                    upload.received.discard(index)
+                raise
+
+        with self.lock:
+            upload.received.add(index)
+            upload.updated = time.time()
+            if not upload.complete or self.uploads.get(key) is not upload:
+                return None
+            del self.uploads[key]
+        return upload.path
+
+    def discard(self, key):
+        """Forget the partial upload of key and remove its file."""
+        with self.lock:
+            upload = self.uploads.pop(key, None)
+        if upload:
+            _remove(upload.path)
+
+    def cleanup(self):
+        """Remove the uploads with no chunks in the last timeout seconds."""
+        now = time.time()
+        with self.lock:
+            expired = [key for key, upload in self.uploads.items()
+                       if now - upload.updated > self.timeout]
+            uploads = [self.uploads.pop(key) for key in expired]
+        for key, upload in zip(expired, uploads):
+            logger.info(f"Removing abandoned upload {key[1]} of {key[0]}")
+            _remove(upload.path)
+
+    def _upload(self, key, total_chunks, chunk_size, file_size):
+        with self.lock:
+            upload = self.uploads.get(key)
+            if upload and (upload.total_chunks, upload.chunk_size) == (total_chunks, chunk_size):
+                return upload
+
+            if file_size is not None and -(-file_size // chunk_size) != total_chunks:
+                raise ValueError(f"{file_size} bytes are not {total_chunks} chunks "
+                                 f"of {chunk_size} bytes")
+            if upload: # the same file id with another file, start again
+                _remove(upload.path)
+            fd, path = tempfile.mkstemp(dir=self.upload_dir, prefix='treeprofiler-upload-')
+            with os.fdopen(fd, 'wb') as f:
+                if file_size is not None:
+                    f.truncate(file_size) # preallocated (sparse where supported)
+            upload = self.uploads[key] = Upload(path, total_chunks, chunk_size, file_size)
+            return upload
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
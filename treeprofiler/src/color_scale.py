@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import math
+
+import numpy as np
+
+# Numerical value to gradient color mapping.
+# A gradient is the {1: color, ..., n: color} dictionary built by
+# utils.build_color_gradient or utils.build_custom_gradient. Values are
+# normalized and assigned to the gradient bin whose evenly spaced position is
+# the nearest one, for whole arrays with a single np.searchsorted call and a
+# comparison with the two neighbouring positions (the same bin as the
+# nearest-position argmin, ties going to the lower bin).
+
+NORM_METHODS = ['min-max', 'mean', 'zscore']
+NORM_RANGES = {
+    'min-max': (0, 1),
+    'mean': (-1, 1),
+    'zscore': (-3, 3),
+}
+NAN_COLOR = '#EBEBEB'
+
+def normalize(values, minval, maxval, norm_method='min-max', mean_val=None, std_val=None):
+    """
+    Normalize an array of values.
+
+    :param norm_method: 'min-max' to [0, 1], 'mean' to [-1, 1] around
+        mean_val or 'zscore' in standard deviations from mean_val. Values are
+        all 0 when the range (or std_val) is 0.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if norm_method == 'min-max':
+        span = maxval - minval
+        return np.zeros_like(values) if span == 0 else (values - minval) / span
+    elif norm_method == 'mean':
+        span = maxval - minval
+        return np.zeros_like(values) if span == 0 else (values - mean_val) / span
+    elif norm_method == 'zscore':
+        return np.zeros_like(values) if not std_val else (values - mean_val) / std_val
+    else:
+        raise ValueError(f"Unsupported normalization method '{norm_method}', expected one of {NORM_METHODS}")
+
+class ColorScale:
+    """
+    Colors of numerical values in a gradient.
+
+    It can be given to layouts instead of a value->color dictionary: get()
+    looks the color up by gradient bin, so any value in or out of the range
+    gets a color.
+    """
+
+    def __init__(self, gradient, minval, maxval, norm_method='min-max', mean_val=None, std_val=None,
+            value2color=None, nan_color=NAN_COLOR):
+        """
+        :param gradient: Dictionary of bin index (from 1) and color.
+        :param value2color: Colors of specific values, taking precedence over the gradient.
+        :param nan_color: Color of NaN values.
+        """
+        if norm_method not in NORM_RANGES:
+            raise ValueError(f"Unsupported normalization method '{norm_method}', expected one of {NORM_METHODS}")
+        self.gradient = gradient
+        self.minval = minval
+        self.maxval = maxval
+        self.norm_method = norm_method
+        self.mean_val = mean_val
+        self.std_val = std_val
+        self.value2color = value2color or {}
+        self.nan_color = nan_color
+
+        num = len(gradient)
+        self.positions = np.linspace(*NORM_RANGES[norm_method], num)
+        # palette[0] is the color of NaN, palette[i] the color of bin i
+        self.palette = np.array([nan_color] + [gradient.get(i, '') for i in range(1, num + 1)], dtype=object)
+
+    def normalize(self, values):
+        return normalize(values, self.minval, self.maxval, self.norm_method,
+            mean_val=self.mean_val, std_val=self.std_val)
+
+    def bins(self, values):
+        """Gradient bin of each value, 0 for NaN."""
+        normalized = self.normalize(values)
+        positions = self.positions
+        if len(positions) < 2:
+            bins = np.ones(normalized.shape, dtype=np.int64)
+        else:
+            upper = np.clip(np.searchsorted(positions, normalized), 1, len(positions) - 1)
+            lower_is_nearer = np.abs(positions[upper - 1] - normalized) <= np.abs(positions[upper] - normalized)
+            bins = upper + 1 - lower_is_nearer
+        bins[np.isnan(normalized)] = 0
+        return bins
+
+    def colors(self, values):
+        """Array with the color of each value."""
+        values = np.asarray(values, dtype=np.float64)
+        colors = self.palette[self.bins(values)]
+        for value, color in self.value2color.items():
+            colors[values == value] = color
+        return colors
+
+    def color_map(self, values):
+        """Dictionary of each distinct value and its color."""
+        values = np.unique(np.asarray(values, dtype=np.float64))
+        return dict(zip(values.tolist(), self.colors(values).tolist()))
+
+    def get(self, value, default=None):
+        """Color of a single value, default if it is not numerical."""
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return default
+        if value in self.value2color:
+            return self.value2color[value]
+        if math.isnan(value):
+            return self.nan_color
+        return self.palette[self.bins([value])[0]]
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+from itertools import repeat
+
+import numpy as np
+
+from treeprofiler.src.counters import parse_counter
+
+# Columnar view of node properties.
+# Nodes are kept in a fixed order and each requested property is extracted
+# once into a NumPy array, so queries and exports work on whole columns
+# instead of looking properties up node by node.
+
+def is_missing(value):
+    return value is None or value == '' or (isinstance(value, float) and value != value)
+
+def to_float(value):
+    """Convert a property value to float, NaN if missing or not numerical."""
+    if value is None:
+        return np.nan
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+def counter_value(counter, key):
+    """Return the count of key in a counter property, NaN if absent."""
+    return parse_counter(counter).get(key, np.nan)
+
+class PropertyColumns:
+    def __init__(self, nodes):
+        """
+        :param nodes: Iterable of tree nodes, their order defines the row order.
+        """
+        self.nodes = list(nodes)
+        self._node_props = None
+        self._values = {}
+        self._columns = {}
+        self._float_columns = {}
+        self._counter_columns = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def values(self, prop):
+        """Raw property values as a list, None where missing."""
+        if prop not in self._values:
+            if self._node_props is None:
+                self._node_props = [n.props for n in self.nodes]
+            self._values[prop] = list(map(dict.get, self._node_props, repeat(prop)))
+        return self._values[prop]
+
+    def column(self, prop):
+        """Raw property values as an object array, None where missing."""
+        if prop not in self._columns:
+            self._columns[prop] = np.fromiter(self.values(prop),
+                dtype=object, count=len(self.nodes))
+        return self._columns[prop]
+
+    def present(self, prop):
+        """Boolean mask of the rows where prop has a value."""
+        return np.fromiter((not is_missing(v) for v in self.column(prop)),
+                           dtype=bool, count=len(self.nodes))
+
+    def float_column(self, prop):
+        """Property values as float64, NaN where missing or not numerical."""
+        if prop not in self._float_columns:
+            self._float_columns[prop] = np.fromiter(
+                (to_float(v) for v in self.column(prop)),
+                dtype=np.float64, count=len(self.nodes))
+        return self._float_columns[prop]
+
+    def counter_column(self, prop, key):
+        """Counts of key in the counter property prop, NaN where absent."""
+        if (prop, key) not in self._counter_columns:
+            self._counter_columns[(prop, key)] = np.fromiter(
+                (counter_value(v, key) for v in self.column(prop)),
+                dtype=np.float64, count=len(self.nodes))
+        return self._counter_columns[(prop, key)]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+from functools import lru_cache
+from multiprocessing.reduction import ForkingPickler
+
+# Counter properties of internal nodes (the `_counter` suffixed ones) have the
+# text form 'key--count||key--count'. Counters built during annotation are
+# CounterString objects: they write to newick/TSV as that text and keep the
+# counts it was made from, so plotting code never parses them. Pickled (like
+# in .ete files) they are plain text that ete4 reads without treeprofiler,
+# but through the multiprocessing pools of the annotation they keep their
+# counts. Counters read back from text are plain strings, parsed by a
+# memoized parser.
+
+PAIR_DELIMITER = "--"
+ITEM_SEPERATOR = "||"
+
+class CounterString(str):
+    """Text form of a counter property with its counts."""
+
+    def __new__(cls, counts, value_format=None):
+        """
+        :param counts: Dictionary of key and count, in output order.
+        :param value_format: Format of the counts in the text form, str() if None.
+        """
+        keys = [str(key) for key in counts]
+        if value_format is None:
+            values = [str(value) for value in counts.values()]
+        else:
+            values = [value_format.format(value) for value in counts.values()]
+        counter = super().__new__(cls, ITEM_SEPERATOR.join(
+            f"{key}{PAIR_DELIMITER}{value}" for key, value in zip(keys, values)))
+        # as read back from the text form, so both ways agree
+        counter.counts = {key: _count(value) for key, value in zip(keys, values)}
+        return counter
+
+    def __reduce__(self):
+        return (str, (str(self),))
+
+def _restore_counter(text, counts):
+    counter = str.__new__(CounterString, text)
+    counter.counts = counts
+    return counter
+
+def _reduce_counter(counter):
+    return (_restore_counter, (str(counter), counter.counts))
+
+ForkingPickler.register(CounterString, _reduce_counter)
+
+def _count(value):
+    try:
+        return float(value)
+    except ValueError:
+        return float('nan')
+
+@lru_cache(maxsize=65536)
+def _parse_counter_string(counter):
+    counts = {}
+    if counter:
+        for item in counter.split(ITEM_SEPERATOR):
+            key, _, value = item.rpartition(PAIR_DELIMITER)
+            counts[key] = _count(value)
+    return counts
+
+def parse_counter(counter):
+    """
+    Return the counts of a counter property as a {key: float} dictionary.
+
+    The dictionary may be shared with other callers and must not be modified.
+
+    :param counter: CounterString, counter text or dictionary.
+    """
+    if isinstance(counter, CounterString):
+        return counter.counts
+    if isinstance(counter, dict):
+        return counter
+    if not counter or not isinstance(counter, str):
+        return {}
+    return _parse_counter_string(counter)
+
+def counter_string(counter, relative=False):
+    """
+    Build the counter property of a {key: count} dictionary, keys sorted.
+
+    :param relative: Store the proportion of each key instead of raw counts.
+    """
+    items = [(str(key), value) for key, value in sorted(counter.items())]
+    if relative:
+        total = sum(counter.values())
+        return CounterString({key: float(value) / total for key, value in items}, '{0:.2f}')
+    return CounterString(dict(items))
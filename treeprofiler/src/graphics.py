@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+import math
+from collections import namedtuple
+from functools import lru_cache
+from xml.sax.saxutils import escape, quoteattr
+
+import matplotlib.colors as mcolors
+
+# SVG and PNG output of the graphic elements of the smartview drawers.
+# A drawer yields its elements ('line', 'rect', 'text', 'array', ...) in tree
+# coordinates, and the smartview client scales them by the zoom and draws
+# them in the browser. Here the same elements are converted into shapes in
+# pixels, which are written as an SVG document or rasterized with Pillow, in
+# process and with no browser. The same elements always give the same
+# output, byte for byte.
+#
+# Elements only used for interaction (node boxes, html) are not drawn.
+
+Shape = namedtuple('Shape', 'kind geometry style')
+
+MAX_FSIZE = 15  # font size of the texts that don't set max_fsize
+MIN_FSIZE = 1   # texts that would be smaller than this are not drawn
+CHAR_WIDTH = 0.6  # approximate width of a character, relative to the font size
+
+LINE_DASHES = {'dotted': '1,3', 'dashed': '5,5', 1: '1,3', 2: '5,5'}  # also the type numbers
+
+# style keys of the drawers that are not svg presentation attributes
+DRAWER_KEYS = {'type', 'max_fsize', 'min_fsize', 'text_anchor', 'ftype'}
+
+TEXT_ANCHORS = {'left': -1, 'start': -1, 'middle': 0, 'center': 0, 'right': 1, 'end': 1}
+
+
+def svg_style(style, **defaults):
+    """Svg presentation attributes of the style of a drawer element."""
+    style = style or {}
+    attrs = dict(defaults)
+    attrs.update((k, v) for k, v in style.items() if k not in DRAWER_KEYS and v is not None)
+    if style.get('type') in LINE_DASHES:
+        attrs['stroke-dasharray'] = LINE_DASHES[style['type']]
+    if style.get('ftype'):
+        attrs['font-family'] = style['ftype']
+    return attrs
+
+def text_shape(box, text, rotation, anchor, style, zoom, transform):
+    """Shape of a text fitted in box, None if it would be too small."""
+    text = str(text)
+    x, y, dx, dy = box
+    zx, zy = zoom
+    px, py = transform(x, y)
+    wpx, hpx = dx * zx, dy * zy
+
+    style = style or {}
+    fs = min(hpx, style.get('max_fsize') or MAX_FSIZE)
+    if wpx > 0 and text:
+        fs = min(fs, wpx / (CHAR_WIDTH * len(text)))
+    if fs < max(MIN_FSIZE, style.get('min_fsize') or 0):
+        return None
+
+    if anchor and len(anchor) == 2:
+        ax, ay = anchor
+    else:
+        ax, ay = TEXT_ANCHORS.get(style.get('text_anchor'), -1), 0
+
+    tx = px + (1 + ax) / 2 * max(wpx, 0)
+    ty = py + (1 + ay) / 2 * (hpx - fs) + 0.8 * fs  # baseline
+    text_anchor = 'start' if ax < 0 else 'end' if ax > 0 else 'middle'
+    return Shape('text', (tx, ty, text, fs, text_anchor, rotation or 0),
+                 svg_style(style))
+
+def array_shapes(box, colors, transform, zoom):
+    """Shapes of an array of colors spread along box, one per run of equal colors."""
+    x, y, dx, dy = box
+    if not len(colors):
+        return
+    px, py = transform(x, y)
+    width = dx * zoom[0] / len(colors)
+    start = 0
+    for i in range(1, len(colors) + 1):
+        if i == len(colors) or colors[i] != colors[start]:
+            if colors[start] is not None:
+                yield Shape('rect', (px + start * width, py, (i - start) * width, dy * zoom[1]),
+                            {'fill': colors[start]})
+            start = i
+
+def triangle_points(box, tip):
+    x, y, dx, dy = box
+    if tip == 'left':
+        return [(x + dx, y), (x, y + dy/2), (x + dx, y + dy)]
+    if tip == 'top':
+        return [(x, y + dy), (x + dx/2, y), (x + dx, y + dy)]
+    if tip == 'bottom':
+        return [(x, y), (x + dx/2, y + dy), (x + dx, y)]
+    return [(x, y), (x + dx, y + dy/2), (x, y + dy)]  # right
+
+def slice_points(center, r, a, da):
+    """Polygon of a pie slice, with a point every 2 degrees of its arc."""
+    cx, cy = center
+    steps = max(2, math.ceil(abs(da) / math.radians(2)))
+    arc = [(cx + r * math.cos(a + da * i / steps), cy + r * math.sin(a + da * i / steps))
+           for i in range(steps + 1)]
+    return [(cx, cy)] + arc if abs(da) < 2 * math.pi else arc
+
+def panel_shapes(graphics, zoom, origin=(0, 0), offset=(0, 0)):
+    """
+    Yield the shapes, in pixels, of the graphic elements of a panel drawn at
+    zoom. The point origin in tree coordinates goes to the pixel offset.
+    """
+    zx, zy = zoom
+    x0, y0 = origin
+    ox, oy = offset
+
+    def transform(x, y):
+        return ox + (x - x0) * zx, oy + (y - y0) * zy
+
+    def scaled_box(box):
+        x, y, dx, dy = box[:4]
+        return (*transform(x, y), dx * zx, dy * zy)
+
+    for element in graphics:
+        kind = element[0]
+        if kind == 'line':
+            _, p1, p2, _, _, style = element
+            yield Shape('line', (*transform(*p1), *transform(*p2)),
+                        svg_style(style, stroke='#000'))
+        elif kind == 'rect':
+            _, box, _, _, _, style = element
+            yield Shape('rect', scaled_box(box), svg_style(style))
+        elif kind == 'circle':
+            _, center, radius, _, style, _ = element
+            yield Shape('circle', (*transform(*center), radius), svg_style(style))
+        elif kind == 'ellipse':
+            _, center, rx, ry, _, style, _ = element
+            yield Shape('ellipse', (*transform(*center), rx, ry), svg_style(style))
+        elif kind == 'triangle':
+            _, box, tip, _, style, _ = element
+            yield Shape('polygon', triangle_points(scaled_box(box), tip), svg_style(style))
+        elif kind == 'slice':
+            _, (center, r, a, da), _, style, _ = element
+            yield Shape('polygon', slice_points(transform(*center), r, a, da), svg_style(style))
+        elif kind == 'outline':
+            _, sbox, style = element
+            x, y, dx_min, dx_max, dy = sbox
+            points = [(x, y + dy/2), (x + dx_min, y), (x + dx_max, y),
+                      (x + dx_max, y + dy), (x + dx_min, y + dy)]
+            yield Shape('polygon', [transform(*p) for p in points],
+                        svg_style(style, fill='#e5e5e5', stroke='#a0a0a0'))
+        elif kind == 'text':
+            _, box, text, _, rotation, anchor, style = element
+            shape = text_shape(box, text, rotation, anchor, style, zoom, transform)
+            if shape:
+                yield shape
+        elif kind == 'array':
+            yield from array_shapes(element[1], element[2], transform, zoom)
+        elif kind == 'img':
+            _, box, img, _, style = element
+            yield Shape('image', (*scaled_box(box), img), svg_style(style))
+        # nodebox, html and the elements of other drawers are not drawn
+
+def bounds(shapes):
+    """Smallest (xmin, ymin, xmax, ymax) rectangle, in pixels, that contains the shapes."""
+    xs, ys = [], []
+    for kind, g, _ in shapes:
+        if kind == 'line':
+            xs += [g[0], g[2]]
+            ys += [g[1], g[3]]
+        elif kind in ('rect', 'image'):
+            xs += [g[0], g[0] + g[2]]
+            ys += [g[1], g[1] + g[3]]
+        elif kind == 'circle':
+            xs += [g[0] - g[2], g[0] + g[2]]
+            ys += [g[1] - g[2], g[1] + g[2]]
+        elif kind == 'ellipse':
+            xs += [g[0] - g[2], g[0] + g[2]]
+            ys += [g[1] - g[3], g[1] + g[3]]
+        elif kind == 'polygon':
+            xs += [x for x, _ in g]
+            ys += [y for _, y in g]
+        elif kind == 'text':
+            x, y, text, fs, anchor, rotation = g
+            width = CHAR_WIDTH * fs * len(text)
+            if rotation:  # anywhere around its anchor
+                xs += [x - width - fs, x + width + fs]
+                ys += [y - width - fs, y + width + fs]
+                continue
+            start = x - {'start': 0, 'middle': width / 2, 'end': width}[anchor]
+            xs += [start, start + width]
+            ys += [y - 0.8 * fs, y + 0.2 * fs]
+    if not xs:
+        return 0, 0, 0, 0
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def num(value):
+    """Number as written in the svg, with at most 2 decimals."""
+    text = f'{value:.2f}'.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+def svg_attrs(attrs):
+    return ' '.join(f'{k}={quoteattr(str(v))}' for k, v in attrs.items())
+
+def svg_element(shape):
+    kind, g, style = shape
+    if kind == 'line':
+        attrs = {'x1': num(g[0]), 'y1': num(g[1]), 'x2': num(g[2]), 'y2': num(g[3])}
+        tag, content = 'line', None
+    elif kind == 'rect':
+        attrs = {'x': num(g[0]), 'y': num(g[1]), 'width': num(max(g[2], 0)), 'height': num(max(g[3], 0))}
+        tag, content = 'rect', None
+    elif kind == 'circle':
+        attrs = {'cx': num(g[0]), 'cy': num(g[1]), 'r': num(g[2])}
+        tag, content = 'circle', None
+    elif kind == 'ellipse':
+        attrs = {'cx': num(g[0]), 'cy': num(g[1]), 'rx': num(g[2]), 'ry': num(g[3])}
+        tag, content = 'ellipse', None
+    elif kind == 'polygon':
+        attrs = {'points': ' '.join(f'{num(x)},{num(y)}' for x, y in g)}
+        tag, content = 'polygon', None
+    elif kind == 'text':
+        x, y, text, fs, anchor, rotation = g
+        attrs = {'x': num(x), 'y': num(y), 'font-size': num(fs), 'text-anchor': anchor}
+        if rotation:
+            attrs['transform'] = f'rotate({num(rotation)},{num(x)},{num(y)})'
+        tag, content = 'text', escape(text)
+    else:  # image
+        attrs = {'x': num(g[0]), 'y': num(g[1]), 'width': num(g[2]), 'height': num(g[3]), 'href': g[4]}
+        tag, content = 'image', None
+    attrs.update(sorted(style.items()))
+    if content is None:
+        return f'<{tag} {svg_attrs(attrs)}/>'
+    return f'<{tag} {svg_attrs(attrs)}>{content}</{tag}>'
+
+def to_svg(shapes, margin=10, background='white', box=None):
+    """
+    Svg document with the shapes, cropped to their bounds plus margin, or to
+    box (xmin, ymin, xmax, ymax) if given.
+    """
+    shapes = list(shapes)
+    if box:
+        xmin, ymin, xmax, ymax = box
+        margin = 0
+    else:
+        xmin, ymin, xmax, ymax = bounds(shapes)
+    x, y = xmin - margin, ymin - margin
+    width, height = xmax - xmin + 2 * margin, ymax - ymin + 2 * margin
+    lines = ['<svg xmlns="http://www.w3.org/2000/svg" '
+             f'width="{num(width)}" height="{num(height)}" '
+             f'viewBox="{num(x)} {num(y)} {num(width)} {num(height)}" '
+             'font-family="sans-serif">']
+    if background:
+        lines.append(svg_element(Shape('rect', (x, y, width, height), {'fill': background})))
+    lines.extend(svg_element(shape) for shape in shapes)
+    lines.append('</svg>')
+    return '\n'.join(lines) + '\n'
+
+
+@lru_cache(maxsize=1024)
+def rgba255(color, opacity=1):
+    """Color as an (r, g, b, a) tuple of ints, None for 'none' or unknown colors."""
+    if color in (None, 'none', 'transparent'):
+        return None
+    try:
+        r, g, b, a = mcolors.to_rgba(color)
+    except ValueError:
+        return None
+    return tuple(round(255 * c) for c in (r, g, b)) + (round(255 * a * opacity),)
+
+def paint(style, key, default=None):
+    """Pillow color of the fill or the stroke of a style."""
+    opacity = float(style.get('opacity', 1)) * float(style.get(key + '-opacity', 1))
+    return rgba255(style.get(key, default), opacity)
+
+@lru_cache(maxsize=256)
+def pil_font(size):
+    from PIL import ImageFont
+    return ImageFont.load_default(size=size)
+
+def draw_png_text(image, draw, x, y, shape, scale):
+    """Draw the text shape with its baseline at pixel (x, y) of the image."""
+    _, _, text, fs, anchor, rotation = shape.geometry
+    fill = paint(shape.style, 'fill', 'black')
+    if not fill:
+        return
+    font = pil_font(max(1, round(fs * scale)))
+    pil_anchor = {'start': 'ls', 'middle': 'ms', 'end': 'rs'}[anchor]
+    if not rotation:
+        draw.text((x, y), text, fill=fill, font=font, anchor=pil_anchor)
+        return
+
+    from PIL import Image, ImageDraw
+    r = math.ceil(font.getlength(text) + fs * scale) + 1
+    layer = Image.new('RGBA', (2 * r, 2 * r), (0, 0, 0, 0))
+    ImageDraw.Draw(layer).text((r, r), text, fill=fill, font=font, anchor=pil_anchor)
+    layer = layer.rotate(-rotation, resample=Image.BICUBIC, center=(r, r))
+    image.alpha_composite(layer, (round(x) - r, round(y) - r))
+
+def to_png(shapes, margin=10, background='white', scale=1):
+    """Pillow image with the shapes, cropped to their bounds plus margin."""
+    from PIL import Image, ImageDraw
+
+    shapes = list(shapes)
+    xmin, ymin, xmax, ymax = bounds(shapes)
+    x0, y0 = xmin - margin, ymin - margin
+    size = (max(1, math.ceil((xmax - xmin + 2 * margin) * scale)),
+            max(1, math.ceil((ymax - ymin + 2 * margin) * scale)))
+    image = Image.new('RGBA', size, rgba255(background) or (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image, 'RGBA')
+
+    def pt(x, y):
+        return (x - x0) * scale, (y - y0) * scale
+
+    for shape in shapes:
+        kind, g, style = shape
+        fill = paint(style, 'fill', 'black')
+        stroke = paint(style, 'stroke')
+        width = max(1, round(float(style.get('stroke-width', 1)) * scale))
+        if kind == 'line':
+            if stroke:
+                draw.line([pt(g[0], g[1]), pt(g[2], g[3])], fill=stroke, width=width)
+        elif kind == 'rect':
+            if g[2] > 0 and g[3] > 0:
+                (x1, y1), (x2, y2) = pt(g[0], g[1]), pt(g[0] + g[2], g[1] + g[3])
+                draw.rectangle([x1, y1, max(x1, x2 - 1), max(y1, y2 - 1)],
+                               fill=fill, outline=stroke, width=width)
+        elif kind in ('circle', 'ellipse'):
+            cx, cy = pt(g[0], g[1])
+            rx = g[2] * scale
+            ry = (g[3] if kind == 'ellipse' else g[2]) * scale
+            draw.ellipse([cx - rx, cy - ry, cx + rx, cy + ry], fill=fill, outline=stroke, width=width)
+        elif kind == 'polygon':
+            draw.polygon([pt(x, y) for x, y in g], fill=fill, outline=stroke, width=width)
+        elif kind == 'text':
+            draw_png_text(image, draw, *pt(g[0], g[1]), shape, scale)
+        # images are only written in svg
+    return image
+
+def write_image(shapes, fname, margin=10, background='white', scale=1):
+    """Write the shapes as svg, or as png if fname ends in .png."""
+    if fname.lower().endswith('.png'):
+        to_png(shapes, margin, background, scale).save(fname)
+    else:
+        with open(fname, 'w') as f:
+            f.write(to_svg(shapes, margin, background))
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import pickle
+import stat
+import tempfile
+import threading
+import time
+
+# Queue of the background jobs of the web app, like the annotation of an
+# uploaded tree.
+# Jobs run on a fixed number of worker threads, highest priority first and in
+# submission order for equal priorities. Each job takes a number of cpus (the
+# processes of its pools) from a global budget, and the job at the head of the
+# queue waits until they are free, so the jobs running together never use
+# more cpus than the budget and a large job is not overtaken forever.
+# A job reports its stage and percent done through the progress function it
+# is given, which is also where a cancelled job stops. Jobs are pickled in the
+# state directory, if any, when submitted and when finished, and loaded back
+# when the queue is created again: finished jobs keep their status and
+# result, the ones interrupted by the restart are marked as failed. A job is
+# pickled and written outside of the lock of the queue (a large result takes
+# a while), from a snapshot of its state taken under the lock with a sequence
+# number, so a slower older snapshot never overwrites a newer one.
+# The state directory is read with pickle, so it must be private: owned by
+# the user of the server and only accessible by them (mode 0700), otherwise
+# the queue refuses it.
+# Finished jobs are kept for max_age seconds, and only the max_finished most
+# recently finished ones; the others are forgotten and their files removed,
+# checked whenever a job finishes and when the queue is created.
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = {COMPLETE, FAILED, CANCELLED}
+
+JOB_SUFFIX = '.job.pkl'
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_FINISHED = 1000
+DEFAULT_MAX_AGE = 7 * 24 * 3600 # seconds, of a finished job
+
+class JobCancelled(Exception):
+    pass
+
+def check_private_dir(path):
+    """Raise PermissionError unless path is a directory only the current user can access."""
+    st = os.stat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise PermissionError(f"{path} is not a directory")
+    if hasattr(os, 'getuid') and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+        raise PermissionError(f"{path} must be owned by the current user with mode 0700")
+
+class Job:
+    """A job of the queue, run(progress, cpus) returns its result."""
+
+    def __init__(self, job_id, run, cpus=1, priority=0):
+        self.id = job_id
+        self.run = run
+        self.cpus = cpus
+        self.priority = priority
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.percent = 0
+        self.error = None
+        self.result = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = threading.Event()
+        self.saved = -1 # sequence number of the last snapshot written
+
+    def progress(self, stage, percent=None):
+        """Report the current stage of the job, stop it if it was cancelled."""
+        if self.cancel_requested.is_set():
+            raise JobCancelled(self.id)
+        self.stage = stage
+        if percent is not None:
+            self.percent = percent
+
+    def info(self):
+        """Status of the job, representable as JSON."""
+        return {'status': self.status, 'stage': self.stage, 'percent': self.percent,
+                'error': self.error, 'cpus': self.cpus, 'priority': self.priority,
+                'submitted': self.submitted, 'started': self.started,
+                'finished': self.finished}
+
+class JobQueue:
+    """Jobs by id, run by workers threads within a budget of cpus."""
+
+    def __init__(self, workers=DEFAULT_WORKERS, cpu_budget=None, state_dir=None,
+                 max_finished=DEFAULT_MAX_FINISHED, max_age=DEFAULT_MAX_AGE):
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.free_cpus = self.cpu_budget
+        self.state_dir = state_dir
+        self.max_finished = max_finished
+        self.max_age = max_age
+        self.jobs = {} # job id -> job
+        self.queue = [] # heap of (-priority, order, job)
+        self.order = itertools.count()
+        self.snapshots = itertools.count()
+        self.condition = threading.Condition()
+        self.save_lock = threading.Lock() # of the files in state_dir
+        if state_dir:
+            os.makedirs(state_dir, mode=0o700, exist_ok=True)
+            check_private_dir(state_dir)
+            self._load()
+        with self.condition:
+            expired = self._expire()
+        self._remove(expired)
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def __contains__(self, job_id):
+        return job_id in self.jobs
+
+    def get(self, job_id):
+        """Job with job_id, None if there is none."""
+        return self.jobs.get(job_id)
+
+    def submit(self, job_id, run, cpus=1, priority=0):
+        """
+        Queue the job job_id, that calls run(progress, cpus) with the cpus it
+        was given (at most the budget). A finished job with the same id is
+        replaced, an unfinished one is a ValueError.
+        """
+        with self.condition:
+            if job_id in self.jobs and self.jobs[job_id].status not in FINISHED:
+                raise ValueError(f"job {job_id} is already {self.jobs[job_id].status}")
+            job = Job(job_id, run, min(max(cpus, 1), self.cpu_budget), priority)
+            self.jobs[job_id] = job
+            heapq.heappush(self.queue, (-priority, next(self.order), job))
+            snapshot = self._snapshot(job)
+            self.condition.notify_all()
+        self._save(job, snapshot)
+        return job
+
+    def position(self, job_id):
+        """Number of queued jobs that run before job_id (None if it is not queued)."""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if not job or job.status != QUEUED:
+                return None
+            key = next((priority, order) for priority, order, other in self.queue
+                       if other is job)
+            return sum(1 for priority, order, other in self.queue
+                       if other.status == QUEUED and (priority, order) < key)
+
+    def cancel(self, job_id):
+        """
+        Cancel job job_id. A queued job never runs, a running one stops at its
+        next progress report. Return False if the job is unknown or finished.
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if not job or job.status in FINISHED:
+                return False
+            job.cancel_requested.set()
+            if job.status != QUEUED:
+                return True
+            snapshot = self._finish(job, CANCELLED) # left in the heap, workers skip it
+            expired = self._expire()
+            self.condition.notify_all()
+        self._save(job, snapshot)
+        self._remove(expired)
+        return True
+
+    def _work(self):
+        while True:
+            with self.condition:
+                job = self._next()
+            self._run(job)
+
+    def _next(self):
+        """Wait for the job at the head of the queue and the cpus it needs."""
+        while True:
+            while self.queue and self.queue[0][2].status != QUEUED:
+                heapq.heappop(self.queue) # cancelled or replaced
+            if self.queue and self.queue[0][2].cpus <= self.free_cpus:
+                job = heapq.heappop(self.queue)[2]
+                self.free_cpus -= job.cpus
+                job.status = job.stage = RUNNING
+                job.started = time.time()
+                return job
+            self.condition.wait()
+
+    def _run(self, job):
+        try:
+            job.result = job.run(job.progress, job.cpus)
+            status = COMPLETE
+        except JobCancelled:
+            status = CANCELLED
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            job.error = f"{type(e).__name__}: {e}"
+            status = FAILED
+        with self.condition:
+            self.free_cpus += job.cpus
+            snapshot = self._finish(job, status)
+            expired = self._expire()
+            self.condition.notify_all()
+        self._save(job, snapshot)
+        self._remove(expired)
+
+    def _finish(self, job, status):
+        """Mark job as finished, return the snapshot of it to save."""
+        job.status = job.stage = status
+        job.finished = time.time()
+        if status == COMPLETE:
+            job.percent = 100
+        return self._snapshot(job)
+
+    def _expire(self):
+        """
+        Forget the finished jobs older than max_age and the ones beyond the
+        max_finished most recent, return them (called with the condition held).
+        """
+        finished = sorted((job for job in self.jobs.values() if job.status in FINISHED),
+                          key=lambda job: job.finished, reverse=True)
+        oldest = time.time() - self.max_age
+        expired = [job for i, job in enumerate(finished)
+                   if i >= self.max_finished or job.finished < oldest]
+        for job in expired:
+            del self.jobs[job.id]
+        return expired
+
+    def _remove(self, jobs):
+        """Remove the files of forgotten jobs."""
+        if not self.state_dir:
+            return
+        with self.save_lock: # their ids may have been reused since
+            for job in jobs:
+                if job.id not in self.jobs:
+                    try:
+                        os.remove(self._path(job.id))
+                    except FileNotFoundError:
+                        pass
+
+    def _path(self, job_id):
+        digest = hashlib.sha256(job_id.encode()).hexdigest() # ids are tree names
+        return os.path.join(self.state_dir, digest + JOB_SUFFIX)
+
+    def _snapshot(self, job):
+        """Sequence number and state of job to save (called with the condition held)."""
+        if not self.state_dir:
+            return None
+        state = job.info()
+        state.update(id=job.id, result=job.result)
+        return next(self.snapshots), state
+
+    def _save(self, job, snapshot):
+        """Pickle the snapshot of job and write it, unless a newer one was written."""
+        if snapshot is None:
+            return
+        sequence, state = snapshot
+        try:
+            data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError, TypeError, AttributeError) as e:
+            logger.warning(f"Result of job {job.id} could not be saved: {e}")
+            state['result'] = None
+            data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with self.save_lock:
+            if self.jobs.get(job.id) is not job or sequence < job.saved:
+                return # replaced by another job, or a newer snapshot was written
+            # write to a temporary file first so a restart never reads a partial job
+            fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(job.id))
+            job.saved = sequence
+
+    def _load(self):
+        for fname in os.listdir(self.state_dir):
+            if not fname.endswith(JOB_SUFFIX):
+                continue
+            path = os.path.join(self.state_dir, fname)
+            try:
+                with open(path, 'rb') as f:
+                    state = pickle.load(f)
+            except (pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError) as e:
+                logger.warning(f"Discarding unreadable job {path}: {e}")
+                os.remove(path)
+                continue
+
+            job = Job(state['id'], None, state['cpus'], state['priority'])
+            for name in ['status', 'stage', 'percent', 'error', 'submitted',
+                         'started', 'finished', 'result']:
+                setattr(job, name, state[name])
+            self.jobs[job.id] = job
+            if job.status not in FINISHED:
+                job.error = "interrupted by a restart of the server"
+                self._save(job, self._finish(job, FAILED))
@@ -1,27 +1,51 @@
 #!/usr/bin/env python3
-try:
-    from distutils.util import strtobool
-except ImportError:
-    from treeprofiler.src.utils import strtobool
-    
+from treeprofiler.src.booleans import to_bool, bool_column, TRUE
 from treeprofiler.src.utils import add_suffix
 
 # Lineage specificity analysis
 # Function to calculate precision, sensitivity, and F1 score
-def calculate_metrics(node, total_with_trait, prop):
+def calculate_metrics(node, total_with_trait, prop, clade_counts=None):
+    """
+    :param clade_counts: Optional {node: (leaves with trait, leaves)} of
+        clade_trait_counts, counted from the leaves of node if not given.
+    """
     if not node.is_leaf:
-        clade_with_trait = sum(1 for child in node.leaves() if bool_checker(child, prop))
-        clade_total = len([leave for leave in node.leaves()])
-        precision = clade_with_trait / clade_total if clade_total else 0
-        sensitivity = clade_with_trait / total_with_trait if total_with_trait else 0
-        f1 = 2 * (precision * sensitivity) / (precision + sensitivity) if (precision + sensitivity) else 0
-        return precision, sensitivity, f1
+        if clade_counts is not None:
+            clade_with_trait, clade_total = clade_counts[node]
+        else:
+            clade_with_trait = sum(1 for child in node.leaves() if bool_checker(child, prop))
+            clade_total = len([leave for leave in node.leaves()])
+        return _metrics(clade_with_trait, clade_total, total_with_trait)
     return 0, 0, 0
 
+def _metrics(clade_with_trait, clade_total, total_with_trait):
+    precision = clade_with_trait / clade_total if clade_total else 0
+    sensitivity = clade_with_trait / total_with_trait if total_with_trait else 0
+    f1 = 2 * (precision * sensitivity) / (precision + sensitivity) if (precision + sensitivity) else 0
+    return precision, sensitivity, f1
+
 # Total number of nodes with the trait
 def get_total_trait(tree, prop):
     return sum(1 for node in tree.leaves() if bool_checker(node, prop))
 
+def clade_trait_counts(tree, prop):
+    """
+    Return {node: (leaves with trait, leaves)} for all the nodes of tree,
+    decoding the trait of each leaf once.
+    """
+    leaves = list(tree.leaves())
+    traits = bool_column(leaf.props.get(prop) for leaf in leaves) == TRUE
+    counts = {leaf: (int(trait), 1) for leaf, trait in zip(leaves, traits.tolist())}
+    for node in tree.traverse("postorder"):
+        if not node.is_leaf:
+            with_trait = total = 0
+            for child in node.children:
+                child_with_trait, child_total = counts[child]
+                with_trait += child_with_trait
+                total += child_total
+            counts[node] = (with_trait, total)
+    return counts
+
 def bool_checker(node, prop):
     """
     Check if the property of a node can be interpreted as a boolean 'True'.
@@ -30,13 +54,7 @@ def bool_checker(node, prop):
     :param prop: The property name to check.
     :return: True if the property exists and is a boolean 'True', False otherwise.
     """
-    prop_value = node.props.get(prop)
-    if prop_value is not None:
-        try:
-            return bool(strtobool(str(prop_value)))
-        except ValueError:
-            return False
-    return False
+    return to_bool(node.props.get(prop)) is True
 
 ###### start lineage specificity analysis ######
 def run_ls(tree, props, precision_cutoff=0.95, sensitivity_cutoff=0.95):
@@ -44,12 +62,13 @@ def run_ls(tree, props, precision_cutoff=0.95, sensitivity_cutoff=0.95):
     qualified_nodes = []
     best_f1 = -1
     for prop in props:
-        total_with_trait = get_total_trait(tree, prop)
+        clade_counts = clade_trait_counts(tree, prop)
+        total_with_trait = clade_counts[tree][0]
         # Calculating metrics for each clade
         for node in tree.traverse("postorder"):
             if not node.is_leaf:
                 #node.add_prop(trait=int(node.name[-1]) if node.is_leaf else 0)
-                precision, sensitivity, f1 = calculate_metrics(node, total_with_trait, prop)
+                precision, sensitivity, f1 = calculate_metrics(node, total_with_trait, prop, clade_counts)
                 node.add_prop(add_suffix(prop, "prec"), precision)
                 node.add_prop(add_suffix(prop, "sens"), sensitivity)
                 node.add_prop(add_suffix(prop, "f1"), f1)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+import hashlib
+import logging
+import os
+
+import numpy as np
+from scipy import sparse
+
+# Node matrices and the loader of --data-matrix files.
+# Presence/absence profiles, with one column per distinct value, are kept as
+# sparse CSR matrices since most nodes only have a few of the values.
+# Each --data-matrix file is read in one go into a contiguous float64 matrix with one row
+# per leaf name. Optionally the parsed matrix is cached as .npy files which
+# later runs open memory-mapped instead of parsing the text again.
+
+logger = logging.getLogger(__name__)
+
+class NodeMatrix:
+    """
+    Matrix with one row per node name, the rows in tree traversal order.
+
+    It replaces the node name -> list of values dictionaries of the matrix
+    layouts: the values of all nodes live in a single 2-D array.
+    """
+
+    def __init__(self, names, values):
+        """
+        :param names: Node names, one per row.
+        :param values: 2-D array, float64 (NaN for missing values) for
+            numerical matrices or object for categorical ones.
+        """
+        self.names = list(names)
+        self.values = values
+        self.index = {name: row for row, name in enumerate(self.names)}
+
+    @classmethod
+    def from_rows(cls, rows, dtype=np.float64, fill=np.nan):
+        """
+        Build the matrix from a name -> list of values dictionary, padding
+        the shorter rows with fill. None values are replaced by fill too.
+        """
+        width = max((len(row) for row in rows.values()), default=0)
+        values = np.full((len(rows), width), fill, dtype=dtype)
+        for i, row in enumerate(rows.values()):
+            values[i, :len(row)] = [fill if value is None else value for value in row]
+        return cls(rows.keys(), values)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    @property
+    def ncols(self):
+        return self.values.shape[1] if self.values.ndim == 2 else 0
+
+    def row(self, name):
+        """Row of values of a node, None if absent."""
+        row = self.index.get(name)
+        if row is None:
+            return None
+        return self.values[row]
+
+    def get(self, name, default=None):
+        """Values of a node as a list, like the dictionary of lists it replaces."""
+        values = self.row(name)
+        return default if values is None else values.tolist()
+
+class LeafMatrix(NodeMatrix):
+    """Numerical matrix with one row per leaf name."""
+
+    def __init__(self, names, values, numeric):
+        """
+        :param names: Leaf names, one per row.
+        :param values: 2-D float64 array, NaN for missing values.
+        :param numeric: Boolean array, False for the rows with non-numerical data.
+        """
+        super().__init__(names, values)
+        self.numeric = numeric
+
+    def row(self, name):
+        """Row of values of a leaf, None if absent or not numerical."""
+        row = self.index.get(name)
+        if row is None or not self.numeric[row]:
+            return None
+        return self.values[row]
+
+class SparseNodeMatrix(NodeMatrix):
+    """Node matrix whose values are a scipy CSR matrix, 0 where absent."""
+
+    def row(self, name):
+        """1-row CSR matrix of a node, None if absent."""
+        row = self.index.get(name)
+        if row is None:
+            return None
+        return self.values[row]
+
+    def get(self, name, default=None):
+        values = self.row(name)
+        return default if values is None else values.toarray()[0].tolist()
+
+def presence_matrix(tree, leaf_columns, ncols, has_row=None, minimum=0.05):
+    """
+    Return the SparseNodeMatrix of presence (1) of the leaves in each column
+    and of the ratio of each column in the internal nodes.
+
+    The ratios are computed bottom-up: the column counts of a node are the
+    sum of those of its children, and its ratios the counts over their total.
+    Non-zero ratios under minimum are raised to minimum to remain visible.
+
+    :param leaf_columns: Function returning the columns where a leaf has
+        presence, or None if the leaf has no row.
+    :param ncols: Number of columns.
+    :param has_row: Function telling if an internal node has a row, all of
+        them have one if None.
+    """
+    counts = {} # node -> (columns, counts) of the nodes still to be summed
+    rows = {} # node -> (columns, values)
+    for node in tree.traverse('postorder'):
+        if node.is_leaf:
+            columns = leaf_columns(node)
+            if columns is not None:
+                columns = np.unique(np.asarray(columns, dtype=np.int64))
+                counts[node] = (columns, np.ones(len(columns)))
+                rows[node] = counts[node]
+            continue
+
+        parts = [counts.pop(child) for child in node.children if child in counts]
+        if not parts:
+            continue
+        if len(parts) == 1:
+            columns, node_counts = parts[0]
+        else:
+            columns, inverse = np.unique(np.concatenate([part[0] for part in parts]), return_inverse=True)
+            node_counts = np.bincount(inverse, weights=np.concatenate([part[1] for part in parts]))
+        counts[node] = (columns, node_counts)
+
+        if has_row is None or has_row(node):
+            total = node_counts.sum()
+            ratios = node_counts / total if total else node_counts
+            ratios[(ratios < minimum) & (ratios != 0)] = minimum
+            rows[node] = (columns, ratios)
+
+    # rows in traversal order, like the other node matrices
+    nodes = [node for node in tree.traverse() if node in rows]
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(rows[node][0]) for node in nodes])
+    indices = np.concatenate([rows[node][0] for node in nodes] + [np.empty(0, dtype=np.int64)])
+    data = np.concatenate([rows[node][1] for node in nodes] + [np.empty(0)])
+    values = sparse.csr_matrix((data, indices, indptr), shape=(len(nodes), ncols))
+    return SparseNodeMatrix([node.name for node in nodes], values)
+
+def _parse_matrix(text, delimiter):
+    names = []
+    rows = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        name, _, rest = line.partition(delimiter)
+        names.append(name)
+        rows.append(rest)
+
+    widths = np.fromiter((row.count(delimiter) + 1 for row in rows), dtype=np.int64, count=len(rows))
+    n_cols = int(widths.max()) if len(rows) else 0
+    if len(rows) and (widths != n_cols).any():
+        logger.warning(f"Rows of different length found, missing values are filled with NaN.")
+        rows = [row + delimiter * (n_cols - width) for row, width in zip(rows, widths)]
+
+    cells = delimiter.join(rows).split(delimiter) if rows else []
+    if '' in cells:
+        cells = ['nan' if cell == '' else cell for cell in cells]
+    try:
+        values = np.fromiter(map(float, cells), dtype=np.float64, count=len(cells))
+        values = values.reshape(len(rows), n_cols)
+        numeric = np.ones(len(rows), dtype=bool)
+    except ValueError:
+        # only look for the offending rows when the bulk conversion fails
+        values = np.full((len(rows), n_cols), np.nan)
+        numeric = np.ones(len(rows), dtype=bool)
+        for row in range(len(rows)):
+            try:
+                values[row] = list(map(float, cells[row * n_cols:(row + 1) * n_cols]))
+            except ValueError:
+                numeric[row] = False
+    return names, values, numeric
+
+def _cache_paths(input_file, delimiter, cache_dir):
+    stat = os.stat(input_file)
+    key = f"{os.path.abspath(input_file)}|{stat.st_size}|{stat.st_mtime_ns}|{delimiter}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    base = os.path.join(cache_dir, f"{os.path.basename(input_file)}.{digest}")
+    return base + '.values.npy', base + '.rows.npz'
+
+def load_matrix(input_file, delimiter='\t', cache_dir=None):
+    """
+    Load a matrix file whose first column is the leaf name.
+
+    :param cache_dir: Directory of the binary cache, no cache if None. The
+        cache is keyed by the path, size, modification time and delimiter.
+    :return: LeafMatrix
+    """
+    if cache_dir:
+        values_path, rows_path = _cache_paths(input_file, delimiter, cache_dir)
+        if os.path.exists(values_path) and os.path.exists(rows_path):
+            with np.load(rows_path, allow_pickle=False) as rows:
+                names, numeric = rows['names'].tolist(), rows['numeric']
+            return LeafMatrix(names, np.load(values_path, mmap_mode='r'), numeric)
+
+    with open(input_file, 'r') as f:
+        names, values, numeric = _parse_matrix(f.read(), delimiter)
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(values_path, values)
+        np.savez(rows_path, names=np.array(names, dtype=str), numeric=numeric)
+    return LeafMatrix(names, values, numeric)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+import math
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+
+# Multi-resolution summaries (mipmaps) of profiles.
+# Level k of a profile summarizes each block of 2**k consecutive columns with
+# a single value of the block: the one closest to the block mean for
+# numerical profiles, the most frequent one for categorical profiles. The
+# summary is always a value of the profile, so it keeps its color in the
+# value->color maps of the layouts. A window of columns drawn over npx pixels
+# uses the finest level with at most npx blocks in the window. Levels are
+# computed on first use and kept in the mipmap.
+# Sparse profiles (1-row CSR matrices, absent columns are 0) are summarized
+# from their nonzero values, without building their dense row: each level
+# takes memory for its blocks only, and level 0 is only built for the
+# window drawn.
+#
+# Layouts keep the mipmaps of the rows they draw in a MipmapCache, keyed by
+# matrix row (or by the leaf of an alignment sequence) and bounded, least
+# recently used dropped first.
+
+def representatives(values, size):
+    """
+    Value closest to the mean of each block of size consecutive values,
+    ignoring NaN. The first closest value is taken on ties, NaN for the
+    blocks with no values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    starts = np.arange(0, len(values), size)
+    if not len(starts):
+        return values
+    block = np.arange(len(values)) // size
+
+    present = ~np.isnan(values)
+    counts = np.add.reduceat(present, starts)
+    sums = np.add.reduceat(np.where(present, values, 0), starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+
+    distances = np.where(present, np.abs(values - means[block]), np.inf)
+    order = np.lexsort((distances, block))
+    first = np.searchsorted(block[order], np.arange(len(starts)))
+    return values[order[first]]
+
+def sparse_representatives(indices, data, length, size):
+    """
+    Like representatives() for the profile of the given length which is 0
+    except for data at the columns indices.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    data = np.asarray(data, dtype=np.float64)
+    nblocks = -(-length // size)
+    if not nblocks:
+        return np.empty(0)
+    order = np.argsort(indices, kind='stable')
+    indices, data = indices[order], data[order]
+    block = indices // size
+    lengths = np.full(nblocks, size, dtype=np.int64)
+    lengths[-1] = length - (nblocks - 1) * size
+
+    present = ~np.isnan(data)
+    nnz = np.bincount(block, minlength=nblocks)
+    counts = lengths - np.bincount(block, weights=~present, minlength=nblocks)
+    sums = np.bincount(block, weights=np.where(present, data, 0), minlength=nblocks)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+
+    # first zero of each block: the first nonzero not at its rank in the block
+    starts = np.concatenate([[0], np.cumsum(nnz)[:-1]])
+    rank = np.arange(len(indices)) - starts[block]
+    first_zero = nnz.copy()
+    shifted = indices - block * size != rank
+    np.minimum.at(first_zero, block[shifted], rank[shifted])
+    has_zero = first_zero < lengths
+    zero_distance = np.abs(means)
+    zero_column = np.arange(nblocks) * size + first_zero
+    if not len(indices):
+        return np.zeros(nblocks)
+
+    # closest nonzero of each block, the first one on ties
+    distances = np.where(present, np.abs(data - means[block]), np.inf)
+    best = np.lexsort((indices, distances, block))
+    pick = best[np.minimum(np.searchsorted(block[best], np.arange(nblocks)), len(best) - 1)]
+    value_distance = np.where(nnz > 0, distances[pick], np.inf)
+    value_column = np.where(nnz > 0, indices[pick], length)
+
+    zero_wins = has_zero & ((zero_distance < value_distance) |
+                            ((zero_distance == value_distance) & (zero_column < value_column)))
+    return np.where(zero_wins, 0.0, np.where(value_distance < np.inf, data[pick], np.nan))
+
+def majorities(codes, size):
+    """Most frequent code of each block of size consecutive codes, the lowest one on ties."""
+    codes = np.asarray(codes, dtype=np.int64)
+    if not len(codes):
+        return codes
+    ncodes = int(codes.max()) + 1
+    keys, counts = np.unique(np.arange(len(codes)) // size * ncodes + codes, return_counts=True)
+    block = keys // ncodes
+    order = np.lexsort((-counts, block))
+    first = np.searchsorted(block[order], np.arange(block[-1] + 1))
+    return keys[order[first]] % ncodes
+
+class ProfileMipmap:
+    """Summaries of a profile at increasing block sizes."""
+
+    def __init__(self, profile, categorical=False):
+        """
+        :param profile: List or array of values, string of characters or
+            1-row sparse matrix. None and NaN are missing numerical values.
+        :param categorical: Summarize blocks by their most frequent value
+            instead of the one closest to their mean.
+        """
+        self.categorical = categorical
+        self.levels = {}
+        self._categories = None
+        self.sparse = sparse.issparse(profile) and not categorical
+        if self.sparse: # only its nonzero values
+            profile = profile.tocsr()
+            self.profile = None
+            self.indices = profile.indices.astype(np.int64)
+            self.data = profile.data.astype(np.float64)
+            self.length = profile.shape[-1]
+        else:
+            self.profile = profile.toarray()[0] if sparse.issparse(profile) else profile
+            self.length = len(self.profile)
+
+    def _window(self, start, end):
+        """Dense values of the columns start to end of a sparse profile."""
+        values = np.zeros(end - start)
+        inside = (self.indices >= start) & (self.indices < end)
+        values[self.indices[inside] - start] = self.data[inside]
+        return values
+
+    def _level0(self):
+        profile = self.profile
+        if self.categorical:
+            if isinstance(profile, str):
+                profile = list(profile)
+            # codes of the values, the values kept as they are (not as strings)
+            _, first, codes = np.unique(np.asarray(profile, dtype=str), return_index=True, return_inverse=True)
+            self._categories = np.empty(len(first), dtype=object)
+            self._categories[:] = [profile[i] for i in first]
+            return codes
+        if isinstance(profile, list):
+            profile = [np.nan if value is None else value for value in profile]
+        return np.asarray(profile, dtype=np.float64)
+
+    def level(self, k):
+        """Values of the level k, one per block of 2**k columns."""
+        if self.sparse:
+            if k == 0: # not kept, it is as long as the dense row
+                return self._window(0, self.length)
+            if k not in self.levels:
+                self.levels[k] = sparse_representatives(self.indices, self.data, self.length, 1 << k)
+            return self.levels[k]
+        if k not in self.levels:
+            if 0 not in self.levels:
+                self.levels[0] = self._level0()
+            if k:
+                size = 1 << k
+                if self.categorical:
+                    self.levels[k] = majorities(self.levels[0], size)
+                else:
+                    self.levels[k] = representatives(self.levels[0], size)
+        return self.levels[k]
+
+    def get(self, start, end, npx):
+        """
+        Return the values of the columns start to end summarized into npx
+        blocks at most, and the first and last (excluded) columns that the
+        blocks span.
+        """
+        ncols = end - start
+        k = max(math.ceil(math.log2(ncols / npx)), 0) if ncols > 0 and npx > 0 else 0
+        while True:
+            size = 1 << k
+            bstart, bend = start // size, -(-end // size)
+            if bend - bstart <= max(npx, 1) or size >= self.length:
+                break
+            k += 1
+
+        if self.sparse and k == 0: # the window only, not the whole row
+            values = self._window(bstart, bend)
+        else:
+            values = self.level(k)[bstart:bend]
+        if self.categorical:
+            values = self._categories[values].tolist()
+        else:
+            values = values.tolist()
+        return values, bstart * size, min(bend * size, self.length)
+
+DEFAULT_MAX_MIPMAPS = 4096
+
+class MipmapCache:
+    """Mipmaps by key (like the matrix row of a profile), at most maxsize of them."""
+
+    def __init__(self, maxsize=DEFAULT_MAX_MIPMAPS):
+        self.maxsize = maxsize
+        self.mipmaps = OrderedDict()
+
+    def __len__(self):
+        return len(self.mipmaps)
+
+    def get(self, key, profile, categorical=False):
+        """Mipmap of key, made from profile if it is not cached."""
+        return self.get_or_make(key, lambda: ProfileMipmap(profile, categorical))
+
+    def get_or_make(self, key, make):
+        """Value cached for key, make() if it is not cached (like a mipmap with its profile)."""
+        value = self.mipmaps.get(key)
+        if value is None:
+            value = self.mipmaps[key] = make()
+            while len(self.mipmaps) > self.maxsize:
+                self.mipmaps.popitem(last=False)
+        else:
+            self.mipmaps.move_to_end(key)
+        return value
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import gzip
+
+from ete4.parser import newick
+
+# Streaming newick/NHX writer for annotated trees.
+# The tree is walked once and written in chunks to a file handle, using
+# ete4's own node representation so the output matches Tree.write. List
+# properties are joined with '||' on the fly, node props are not modified.
+
+LIST_SEPARATOR = '||'
+CHUNK_SIZE = 1 << 20 # characters buffered before each write
+COMPRESS_LEVEL = 6
+
+class _FormattedNode:
+    """Stand-in with the props of a node as they are written."""
+    __slots__ = ('props', 'is_leaf')
+
+    def __init__(self, props, is_leaf):
+        self.props = props
+        self.is_leaf = is_leaf
+
+def node_repr(node, props, parser, list_sep=LIST_SEPARATOR):
+    """Return the newick content of a node, with list props joined by list_sep."""
+    node_props = node.props
+    for value in node_props.values():
+        if type(value) == list:
+            node_props = {k: list_sep.join(str(x) for x in v) if type(v) == list else v
+                for k, v in node_props.items()}
+            return newick.content_repr(_FormattedNode(node_props, node.is_leaf), props, parser)
+    return newick.content_repr(node, props, parser)
+
+def iter_newick(tree, props=None, parser=None, format_root_node=True, list_sep=LIST_SEPARATOR):
+    """
+    Yield the newick representation of the tree piece by piece.
+
+    :param props: Properties written in the NHX comments, all of them if None.
+    :param parser: ete4 parser number or dictionary.
+    """
+    if not isinstance(parser, dict):
+        parser = newick.make_parser(parser)
+
+    for postorder, node in tree.iter_prepostorder():
+        if postorder:
+            yield ')'
+            if node is not tree or format_root_node:
+                yield node_repr(node, props, parser, list_sep)
+            continue
+
+        if node is not tree and node.up.children[0] is not node:
+            yield ','
+        if not node.is_leaf:
+            yield '('
+        elif node is not tree or format_root_node:
+            yield node_repr(node, props, parser, list_sep)
+    yield ';'
+
+def write_newick(tree, outfile, props=None, parser=None, format_root_node=True,
+        list_sep=LIST_SEPARATOR, compress=None, chunk_size=CHUNK_SIZE):
+    """
+    Write the tree in newick/NHX format without building the whole string.
+
+    :param outfile: Path of the output file, or an open text file handle.
+    :param compress: gzip the output, by default if outfile ends with '.gz'.
+    :param chunk_size: Number of characters buffered before each write.
+    """
+    if isinstance(outfile, str):
+        if compress is None:
+            compress = outfile.endswith('.gz')
+        if compress:
+            handle = gzip.open(outfile, 'wt', compresslevel=COMPRESS_LEVEL)
+        else:
+            handle = open(outfile, 'w')
+        with handle:
+            write_newick(tree, handle, props=props, parser=parser,
+                format_root_node=format_root_node, list_sep=list_sep,
+                chunk_size=chunk_size)
+        return
+
+    buffer = []
+    size = 0
+    for piece in iter_newick(tree, props=props, parser=parser,
+            format_root_node=format_root_node, list_sep=list_sep):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            outfile.write(''.join(buffer))
+            buffer = []
+            size = 0
+    buffer.append('\n')
+    outfile.write(''.join(buffer))
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+import threading
+from itertools import count
+from collections import OrderedDict, namedtuple
+
+from treeprofiler.src.counters import parse_counter
+from treeprofiler.src import utils
+
+# Render payloads of the layouts.
+# set_node_style runs for every visible node on every redraw of the smartview
+# server, but the parameters of the faces it adds (colors, ratios, texts,
+# parsed counters) only depend on the properties of the node. A layout
+# computes them with its payload function once per node into a NodePayloads,
+# all of them in prepare_layouts() before the tree is served or lazily on the
+# first draw of a node, and set_node_style only looks them up and builds the
+# faces.
+#
+# Tooltips are only seen on hover, so payloads carry a small key instead of
+# their HTML: the name of a counter property, or a tuple of (name, value)
+# lines. The HTML is generated from the key the first time a face of the node
+# is built and kept in the NodePayloads.
+#
+# Payloads are kept in lists by the preorder index of the node, sized to the
+# tree. They belong to a version of the tree, given by the caller (the app
+# uses the token of the version in its TreeStore). A tree prepared with the
+# same version (like the copy drawn by the tile renderer) shares them: it only
+# adds its nodes to the index of nodes, which keeps the ones of the last
+# MAX_TREES trees only. A tree prepared with another version, or with none,
+# replaces the payloads, so they never keep the nodes of older versions. The
+# payloads of other trees are computed but not kept (unless no tree was
+# prepared yet, then the first tree drawn gets them until it is prepared).
+
+# kind says which faces set_node_style adds, the other fields are the
+# parameters of those faces that the layout needs
+Payload = namedtuple('Payload', 'kind color tooltip text data', defaults=(None, None, None, None))
+
+ABSENCE_COLOR = "#EBEBEB"
+
+MAX_TREES = 2 # trees sharing the payloads: the one served and a copy being drawn
+
+_MISSING = object() # payload not computed yet
+
+_unversioned = count() # versions of the trees prepared without one
+
+_UNKNOWN = object() # version of the first tree drawn when none was prepared
+
+class PayloadTable:
+    """Payloads by preorder index, shared by the trees of the same version."""
+
+    def __init__(self, version=None, size=0):
+        self.version = version
+        self.index = {} # node -> preorder index, of all the trees sharing it
+        self.roots = OrderedDict() # root -> its nodes in preorder
+        self.payloads = [_MISSING] * size
+        self.tooltips = [None] * size # tooltip html, None until the node is drawn
+
+    def add(self, root, nodes):
+        if root in self.roots:
+            self.roots.move_to_end(root)
+            return
+        self.index.update(zip(nodes, range(len(nodes))))
+        self.roots[root] = nodes
+        while len(self.roots) > MAX_TREES:
+            for node in self.roots.popitem(last=False)[1]:
+                del self.index[node]
+
+class NodePayloads:
+    """Payloads of the nodes of a tree for one layout."""
+
+    def __init__(self, compute):
+        """
+        :param compute: Function of a node returning its payload (or None
+            when the layout draws nothing for it).
+        """
+        self.compute = compute
+        self.lock = threading.Lock() # the explore server and the tile renderer draw together
+        self.clear()
+
+    def __len__(self):
+        """Number of payloads computed."""
+        return sum(1 for payload in self.table.payloads if payload is not _MISSING)
+
+    def __contains__(self, node):
+        table = self.table
+        i = table.index.get(node)
+        return i is not None and table.payloads[i] is not _MISSING
+
+    def prepare(self, tree, nodes=None, version=None):
+        """
+        Compute the payloads of all the nodes of tree. nodes (in preorder) can
+        be given if already known. Trees prepared with the same version (of
+        any hashable type) share the payloads, so they must be equal.
+        """
+        if nodes is None:
+            nodes = list(tree.traverse('preorder'))
+        if version is None:
+            version = ('unversioned', next(_unversioned))
+        table = self._add(tree, nodes, version)
+        payloads = table.payloads
+        compute = self.compute
+        for i, node in enumerate(nodes):
+            if payloads[i] is _MISSING:
+                payloads[i] = compute(node)
+        return self
+
+    def get(self, node):
+        """Payload of node, computed on its first use."""
+        table = self.table
+        i = table.index.get(node)
+        if i is None:
+            table, i = self._lookup(node)
+            if i is None: # of a tree not prepared with the current version
+                return self.compute(node)
+        payload = table.payloads[i]
+        if payload is _MISSING:
+            payload = table.payloads[i] = self.compute(node)
+        return payload
+
+    def tooltip(self, node):
+        """Tooltip HTML of node, generated from the key in its payload on first use."""
+        table = self.table
+        i = table.index.get(node)
+        if i is None:
+            table, i = self._lookup(node)
+            if i is None:
+                return tooltip_html(node, self.get(node).tooltip)
+        tooltip = table.tooltips[i]
+        if tooltip is None:
+            tooltip = table.tooltips[i] = tooltip_html(node, self.get(node).tooltip)
+        return tooltip
+
+    def clear(self):
+        self.table = PayloadTable()
+
+    def _lookup(self, node):
+        """
+        Table and preorder index of a node not indexed yet (index None if its
+        payloads are not kept). The tree of the node gets the payloads only if
+        no tree was prepared yet, as its version is unknown.
+        """
+        if self.table.version is not None:
+            return self.table, None
+        root = node.root
+        nodes = list(root.traverse('preorder'))
+        with self.lock:
+            if self.table.version is None:
+                self.table = PayloadTable(_UNKNOWN, len(nodes))
+                self.table.add(root, nodes)
+            table = self.table
+        return table, table.index.get(node)
+
+    def _add(self, root, nodes, version):
+        """
+        Index the nodes of the tree at root in the table if it is of version,
+        or else start a new table for them. Return the table.
+        """
+        with self.lock:
+            table = self.table
+            if table.version is _UNKNOWN and list(table.roots) == [root]:
+                table.version = version # the tree drawn before it was prepared
+            if version != table.version:
+                table = PayloadTable(version, len(nodes))
+            table.add(root, nodes)
+            self.table = table
+            return table
+
+def prepare_layouts(tree, layouts, version=None):
+    """
+    Compute the payloads of all the nodes of tree for the layouts that have
+    them. Trees prepared with the same version share them (see
+    NodePayloads.prepare).
+    """
+    nodes = None
+    if version is None:
+        version = ('unversioned', next(_unversioned))
+    for layout in layouts:
+        payloads = getattr(layout, 'payloads', None)
+        if isinstance(payloads, NodePayloads):
+            if nodes is None:
+                nodes = list(tree.traverse('preorder'))
+            payloads.prepare(tree, nodes, version)
+
+def joined_text(value):
+    """Text of a categorical property value, lists joined by commas."""
+    if type(value) == list:
+        return ",".join(value)
+    return value
+
+def node_tooltip(node, *lines):
+    """Tooltip with the node name and a line for each (name, value) pair."""
+    tooltip = f'<b>{node.name}</b><br>' if node.name else ''
+    for name, value in lines:
+        tooltip += f'<br>{name}: {value}<br>'
+    return tooltip
+
+def tooltip_html(node, key):
+    """
+    Tooltip HTML of node for a tooltip key: the name of a counter property
+    or a tuple of (name, value) lines. None gives ''.
+    """
+    if key is None:
+        return ''
+    if isinstance(key, str):
+        return counter_tooltip(node, key)
+    return node_tooltip(node, *key)
+
+def counter_data(node, prop, color_dict=None, absence_color=ABSENCE_COLOR):
+    """
+    Return the [[value, count, color, None], ...] data of the counter prop of
+    node, as drawn by stacked bars and piecharts, or None if it has no counts.
+    """
+    counts = parse_counter(node.props.get(prop))
+    if not counts:
+        return None
+    color_dict = color_dict or {}
+    return [[k, v, color_dict.get(k, absence_color), None] for k, v in counts.items()]
+
+def counter_tooltip(node, prop):
+    """Tooltip with the counts of the counter prop of node, '' if it has none."""
+    counts = parse_counter(node.props.get(prop))
+    if not counts:
+        return ''
+    total = int(sum(counts.values()))
+    tooltip = f'<b>{node.name}</b><br>' if node.name else ''
+    for k, v in counts.items():
+        tooltip += f'<b>{k}</b>:  {v:g}/{total}<br>'
+    return tooltip
+
+def heatmap_color(positive, total, min_color=ABSENCE_COLOR, max_color="#971919", reverse=False):
+    """Gradient color of the ratio of positive counts."""
+    ratio = positive / total if total != 0 else 0
+    if reverse:
+        ratio = 1 - ratio
+    if ratio < 0.05 and ratio != 0: # show minimum color for too low
+        ratio = 0.05
+    return utils.color_gradient(min_color, max_color, mix=ratio)
+
+def aggregated_heatmap_color(positive, max_count, min_color=ABSENCE_COLOR, max_color="#971919"):
+    """Color of the positive counts, darker the closer they are to max_count."""
+    if positive == 0:
+        return min_color
+    return utils.make_color_darker_scaled(max_color, positive, max_count, base=10, scale_factor=10)
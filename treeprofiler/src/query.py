@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+import operator
+import re
+from collections import namedtuple
+
+import numpy as np
+
+from treeprofiler.src.columns import PropertyColumns, to_float, counter_value, is_missing
+
+# Query language shared by --pruned-by, --collapsed-by, --highlighted-by and
+# the explore web app.
+#
+#   prop op value              op is one of < <= > >= = != contains
+#   value in prop
+#   counter_prop:key op value  numerical comparison of the count of key
+#
+# Terms are combined with AND (or ',') and OR (or ';'), AND binds tighter
+# than OR and parentheses can be used for grouping. A list of query strings
+# is the AND of all of them, as the repeated CLI arguments are.
+#
+# A query is parsed once into a small AST which is then either compiled into
+# a closure evaluated node by node, or evaluated for all nodes at once as a
+# NumPy boolean mask over a PropertyColumns store.
+
+Comparison = namedtuple('Comparison', ['prop', 'op', 'value', 'key'])
+And = namedtuple('And', ['terms'])
+Or = namedtuple('Or', ['terms'])
+
+operator_dict = {
+                '<':operator.lt,
+                '<=':operator.le,
+                '=':operator.eq,
+                '!=':operator.ne,
+                '>':operator.gt,
+                '>=':operator.ge,
+                }
+
+num_operators = ['<', '<=', '>', '>=']
+
+_op_re = re.compile(r'<=|>=|!=|<|>|=|\s+contains\s+|\s+in\s+')
+_and_re = re.compile(r'\s*,\s*|\s+AND\s+')
+_or_re = re.compile(r'\s*;\s*|\s+OR\s+')
+_group_end_re = re.compile(r'\s*(?:$|\)|,|;|\s(?:AND|OR)\s)')
+
+class QueryError(ValueError):
+    pass
+
+def _contains(prop_value, value):
+    if is_missing(prop_value):
+        return False
+    if isinstance(prop_value, (str, list, set, tuple, dict)):
+        return value in prop_value
+    return value in str(prop_value)
+
+def _tokenize(query):
+    """
+    Split a query string in terms, operators and parentheses.
+
+    A parenthesis only groups when it opens a term or closes one right
+    before an operator or the end of the query, so values like
+    'Description contains (putative)' are kept as they are.
+    """
+    tokens = []
+    pos = 0
+    depth = 0
+    expect_term = True
+    while pos < len(query):
+        if expect_term:
+            while pos < len(query) and query[pos].isspace():
+                pos += 1
+            if pos == len(query):
+                break
+            if query[pos] == '(':
+                tokens.append('(')
+                depth += 1
+                pos += 1
+                continue
+            end = pos
+            inner = 0 # parentheses opened inside the value itself
+            while end < len(query):
+                if _and_re.match(query, end) or _or_re.match(query, end):
+                    break
+                if query[end] == '(':
+                    inner += 1
+                elif query[end] == ')':
+                    if inner:
+                        inner -= 1
+                    elif depth and _group_end_re.match(query, end + 1):
+                        break
+                end += 1
+            term = query[pos:end].strip()
+            if term:
+                tokens.append(('TERM', term))
+            pos = end
+            expect_term = False
+        else:
+            match = _and_re.match(query, pos)
+            if match:
+                tokens.append('AND')
+                pos = match.end()
+                expect_term = True
+                continue
+            match = _or_re.match(query, pos)
+            if match:
+                tokens.append('OR')
+                pos = match.end()
+                expect_term = True
+                continue
+            if query[pos] == ')':
+                tokens.append(')')
+                depth -= 1
+                pos += 1
+                continue
+            if query[pos].isspace():
+                pos += 1
+                continue
+            raise QueryError(f"Unexpected '{query[pos:]}' in query '{query}'")
+    return tokens
+
+def parse_comparison(term):
+    """Parse one 'prop op value' term into a Comparison."""
+    match = _op_re.search(term)
+    if not match:
+        raise QueryError(f"No operator found in '{term}'")
+    op = match.group().strip()
+    left = term[:match.start()].strip()
+    right = term[match.end():].strip()
+    if not left or not right:
+        raise QueryError(f"Incomplete condition '{term}'")
+    if op == 'in':
+        # 'value in prop', the property is on the right side
+        return Comparison(right, op, left, None)
+    if ':' in left:
+        prop, key = left.split(':', 1)
+        return Comparison(prop, op, right, key)
+    return Comparison(left, op, right, None)
+
+def _parse_tokens(tokens, query):
+    pos = 0
+
+    def parse_or():
+        nonlocal pos
+        terms = [parse_and()]
+        while pos < len(tokens) and tokens[pos] == 'OR':
+            pos += 1
+            terms.append(parse_and())
+        return terms[0] if len(terms) == 1 else Or(terms)
+
+    def parse_and():
+        nonlocal pos
+        terms = [parse_atom()]
+        while pos < len(tokens) and tokens[pos] == 'AND':
+            pos += 1
+            terms.append(parse_atom())
+        return terms[0] if len(terms) == 1 else And(terms)
+
+    def parse_atom():
+        nonlocal pos
+        if pos == len(tokens):
+            raise QueryError(f"Unexpected end of query '{query}'")
+        token = tokens[pos]
+        pos += 1
+        if token == '(':
+            node = parse_or()
+            if pos == len(tokens) or tokens[pos] != ')':
+                raise QueryError(f"Missing ')' in query '{query}'")
+            pos += 1
+            return node
+        if isinstance(token, tuple):
+            return parse_comparison(token[1])
+        raise QueryError(f"Unexpected '{token}' in query '{query}'")
+
+    node = parse_or()
+    if pos != len(tokens):
+        raise QueryError(f"Unexpected '{tokens[pos]}' in query '{query}'")
+    return node
+
+def parse_query(query):
+    """
+    Parse a query into its AST.
+
+    :param query: Query string, or list of query strings that all need to be fulfilled.
+    :return: Comparison, And or Or node.
+    """
+    if isinstance(query, (Comparison, And, Or)):
+        return query
+    if isinstance(query, (list, tuple)):
+        terms = [parse_query(q) for q in query]
+        if not terms:
+            raise QueryError("Empty query")
+        return terms[0] if len(terms) == 1 else And(terms)
+    tokens = _tokenize(query)
+    if not tokens:
+        raise QueryError("Empty query")
+    return _parse_tokens(tokens, query)
+
+def _float_value(comparison):
+    try:
+        return float(comparison.value)
+    except ValueError:
+        raise QueryError(f"'{comparison.value}' is not a number in condition "
+                         f"'{comparison.prop} {comparison.op} {comparison.value}'")
+
+def _compile_comparison(comparison, prop2type):
+    prop, op, value, key = comparison
+    datatype = prop2type.get(prop)
+    never = lambda node: False
+
+    if key is not None:
+        # counter syntax, 'prop_counter:key op value'
+        if datatype not in (str, None) or op not in operator_dict:
+            return never
+        func = operator_dict[op]
+        right_value = _float_value(comparison)
+        def predicate(node):
+            left_value = counter_value(node.props.get(prop), key)
+            return left_value == left_value and func(left_value, right_value)
+        return predicate
+
+    if op in ('contains', 'in'):
+        if datatype == float:
+            return never
+        return lambda node: _contains(node.props.get(prop), value)
+
+    if datatype == float:
+        func = operator_dict[op]
+        right_value = _float_value(comparison)
+        def predicate(node):
+            left_value = to_float(node.props.get(prop))
+            return left_value == left_value and func(left_value, right_value)
+        return predicate
+
+    if op in num_operators or datatype == list:
+        # no order comparison for text or boolean data, lists only support contains
+        return never
+
+    # str, bool (stored as text) and unknown datatypes
+    func = operator_dict[op]
+    def predicate(node):
+        prop_value = node.props.get(prop)
+        return not is_missing(prop_value) and func(prop_value, value)
+    return predicate
+
+def compile_query(query, prop2type):
+    """
+    Compile a query into a predicate on a single node.
+
+    Datatypes are looked up and values converted once at compile time.
+
+    :param query: Query string, list of query strings or parsed query.
+    :param prop2type: Dictionary of property name and its datatype.
+    :return: A function that takes a node and returns True or False.
+    """
+    ast = parse_query(query)
+    if isinstance(ast, Comparison):
+        return _compile_comparison(ast, prop2type)
+    predicates = [compile_query(term, prop2type) for term in ast.terms]
+    if isinstance(ast, And):
+        return lambda node: all(pred(node) for pred in predicates)
+    return lambda node: any(pred(node) for pred in predicates)
+
+def _comparison_mask(comparison, columns, prop2type):
+    prop, op, value, key = comparison
+    datatype = prop2type.get(prop)
+    n_rows = len(columns)
+
+    if key is not None:
+        if datatype not in (str, None) or op not in operator_dict:
+            return np.zeros(n_rows, dtype=bool)
+        left = columns.counter_column(prop, key)
+        # comparisons with NaN are False except for !=
+        return operator_dict[op](left, _float_value(comparison)) & ~np.isnan(left)
+
+    if op in ('contains', 'in'):
+        if datatype == float:
+            return np.zeros(n_rows, dtype=bool)
+        return np.fromiter((_contains(v, value) for v in columns.column(prop)),
+                           dtype=bool, count=n_rows)
+
+    if datatype == float:
+        left = columns.float_column(prop)
+        return operator_dict[op](left, _float_value(comparison)) & ~np.isnan(left)
+
+    if op in num_operators or datatype == list:
+        return np.zeros(n_rows, dtype=bool)
+
+    left = columns.column(prop)
+    return np.asarray(operator_dict[op](left, value), dtype=bool) & columns.present(prop)
+
+def query_mask(query, columns, prop2type):
+    """
+    Evaluate a query for all the nodes of a PropertyColumns store at once.
+
+    :param query: Query string, list of query strings or parsed query.
+    :param columns: PropertyColumns of the nodes to evaluate.
+    :param prop2type: Dictionary of property name and its datatype.
+    :return: Boolean array, True for the nodes matching the query.
+    """
+    ast = parse_query(query)
+    if isinstance(ast, Comparison):
+        return _comparison_mask(ast, columns, prop2type)
+    masks = [query_mask(term, columns, prop2type) for term in ast.terms]
+    if isinstance(ast, And):
+        return np.logical_and.reduce(masks)
+    return np.logical_or.reduce(masks)
+
+def select_nodes(tree, query, prop2type, strategy='levelorder', columns=None):
+    """
+    Return the nodes of the tree matching the query, in traversal order.
+
+    :param columns: PropertyColumns of the tree nodes to reuse between queries.
+    """
+    if columns is None:
+        columns = PropertyColumns(tree.traverse(strategy))
+    mask = query_mask(query, columns, prop2type)
+    return [columns.nodes[i] for i in np.flatnonzero(mask)]
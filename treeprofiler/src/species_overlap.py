@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Species-overlap engine for duplication/speciation annotation of gene trees.
+# Species are mapped to integer ids and every node's species set is kept as a
+# Python int used as a bitset, merged bottom-up and released as soon as the
+# parent has consumed it, so memory no longer grows as O(N*depth).
+
+def build_species_index(tree, species_fn):
+    """
+    Assign an integer id to every species found in the leaves of the tree.
+
+    :param tree: Tree to index.
+    :param species_fn: Function that returns the species code of a leaf.
+    :return: (sp2id, id2sp, leaf2species) where leaf2species maps each leaf to its species code.
+    """
+    sp2id = {}
+    id2sp = []
+    leaf2species = {}
+    for leaf in tree.leaves():
+        species = species_fn(leaf)
+        if species not in sp2id:
+            sp2id[species] = len(id2sp)
+            id2sp.append(species)
+        leaf2species[leaf] = species
+    return sp2id, id2sp, leaf2species
+
+def bits_to_ids(bits):
+    """Yield the ids (bit positions) set in a bitset, lowest first."""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+def species_overlap(children_bits):
+    """
+    Merge the species bitsets of the children of one node.
+
+    Works for any number of children: a species is duplicated when it is
+    present in at least two of them, which for a bifurcation is the
+    intersection of both children.
+
+    :param children_bits: Iterable of species bitsets, one per child.
+    :return: (merged, duplicated) bitsets.
+    """
+    merged = 0
+    duplicated = 0
+    for bits in children_bits:
+        duplicated |= merged & bits
+        merged |= bits
+    return merged, duplicated
+
+def annotate_species_overlap(tree, species_fn, dup_sep=','):
+    """
+    Annotate evoltype, dup_sp and dup_percent of every internal node.
+
+    Leaves keep their species in the 'species' property (as a one element set,
+    as ete4's get_cached_content would produce). Internal nodes only receive
+    the evolutionary event properties.
+
+    :param tree: Gene tree to annotate in place.
+    :param species_fn: Function that returns the species code of a leaf.
+    :param dup_sep: Separator of the duplicated species names in dup_sp.
+    :return: The annotated tree.
+    """
+    sp2id, id2sp, leaf2species = build_species_index(tree, species_fn)
+
+    node2bits = {}
+    for n in tree.traverse("postorder"):
+        if n.is_leaf:
+            species = leaf2species[n]
+            n.props['species'] = {species}
+            node2bits[n] = 1 << sp2id[species]
+        else:
+            # children are consumed here, keep only the frontier in memory
+            merged, duplicated = species_overlap(node2bits.pop(ch) for ch in n.children)
+            node2bits[n] = merged
+            if len(n.children) > 1:
+                if duplicated:
+                    n.props['evoltype'] = 'D'
+                    n.props['dup_sp'] = dup_sep.join(id2sp[i] for i in bits_to_ids(duplicated))
+                    n.props['dup_percent'] = round(duplicated.bit_count() / merged.bit_count(), 3) * 100
+                else:
+                    n.props['evoltype'] = 'S'
+
+    return tree
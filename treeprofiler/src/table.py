@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+import csv
+import numbers
+
+import numpy as np
+
+from treeprofiler.src.columns import PropertyColumns
+
+# Table export of annotated trees.
+# Nodes are collected in one traversal, their properties are read column by
+# column from a PropertyColumns store and written either as TSV or as a
+# compressed columnar .npz archive (one array per column, no pickled
+# objects), which read_table can load back restricted to some columns or
+# to leaf/internal rows.
+
+TABLE_FORMATS = ['tsv', 'npz']
+BASE_FIELDS = ['name', 'dist', 'support']
+LIST_SEPARATOR = '|'
+COLUMNS_KEY = '__columns__'
+IS_LEAF_KEY = '__is_leaf__'
+
+def collect_rows(tree, props=None, internal_node=True, leaf_node=True):
+    """
+    Select the named nodes to export and the columns of the table.
+
+    :param props: Properties to export, every non-private property of the tree if None.
+    :return: (nodes, fieldnames)
+    """
+    nodes = []
+    all_props = set() if not props else None
+    for node in tree.traverse():
+        if all_props is not None:
+            all_props |= node.props.keys()
+        if node.name and (internal_node if not node.is_leaf else leaf_node):
+            nodes.append(node)
+
+    if all_props is not None:
+        props = [p for p in all_props if not p.startswith("_")]
+    fieldnames = list(BASE_FIELDS)
+    fieldnames.extend(x for x in sorted(props) if x not in fieldnames and x != '_speciesFunction')
+    return nodes, fieldnames
+
+def format_value(value):
+    if value is None:
+        return ''
+    if type(value) == list:
+        return LIST_SEPARATOR.join(str(v) for v in value)
+    return str(value)
+
+def text_column(columns, prop):
+    return [format_value(v) for v in columns.values(prop)]
+
+def write_tsv(nodes, fieldnames, outfile, delimiter='\t'):
+    columns = PropertyColumns(nodes)
+    rows = []
+    for prop in fieldnames:
+        values = columns.values(prop)
+        # csv writes None as empty and other values with str(), only lists need formatting
+        if list in set(map(type, values)):
+            values = text_column(columns, prop)
+        rows.append(values)
+    with open(outfile, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile, delimiter=delimiter)
+        writer.writerow(fieldnames)
+        writer.writerows(zip(*rows))
+
+def is_numeric_column(values):
+    found = False
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, numbers.Number):
+            return False
+        found = True
+    return found
+
+def write_npz(nodes, fieldnames, outfile):
+    """
+    Write the table as a compressed .npz archive.
+
+    Numerical columns are stored as float64 with NaN for missing values, the
+    other columns as unicode text formatted as in the TSV output.
+    """
+    columns = PropertyColumns(nodes)
+    arrays = {
+        COLUMNS_KEY: np.array(fieldnames, dtype=str),
+        IS_LEAF_KEY: np.fromiter((n.is_leaf for n in nodes), dtype=bool, count=len(nodes)),
+    }
+    for idx, prop in enumerate(fieldnames):
+        if is_numeric_column(columns.values(prop)):
+            arrays[f'col{idx}'] = columns.float_column(prop)
+        else:
+            arrays[f'col{idx}'] = np.array(text_column(columns, prop), dtype=str)
+    with open(outfile, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+def write_table(tree, outfile, props=None, internal_node=True, leaf_node=True, table_format='tsv'):
+    """
+    Export the properties of the named nodes of the tree in one pass.
+
+    :param props: Properties to export, every non-private property of the tree if None.
+    :param internal_node: Include internal nodes.
+    :param leaf_node: Include leaves.
+    :param table_format: 'tsv' or 'npz'.
+    """
+    nodes, fieldnames = collect_rows(tree, props=props,
+        internal_node=internal_node, leaf_node=leaf_node)
+    if table_format == 'tsv':
+        write_tsv(nodes, fieldnames, outfile)
+    elif table_format == 'npz':
+        write_npz(nodes, fieldnames, outfile)
+    else:
+        raise ValueError(f"Unsupported table format '{table_format}', expected one of {TABLE_FORMATS}")
+
+def read_table(infile, columns=None, rows='all'):
+    """
+    Load columns of a table written in npz format.
+
+    :param columns: Names of the columns to load, all of them if None.
+    :param rows: 'all', 'leaf' or 'internal'.
+    :return: Dictionary of column name and its array, in table order.
+    """
+    with np.load(infile, allow_pickle=False) as data:
+        fieldnames = data[COLUMNS_KEY].tolist()
+        if rows == 'all':
+            selection = slice(None)
+        elif rows == 'leaf':
+            selection = data[IS_LEAF_KEY]
+        elif rows == 'internal':
+            selection = ~data[IS_LEAF_KEY]
+        else:
+            raise ValueError(f"Unsupported rows '{rows}', expected 'all', 'leaf' or 'internal'")
+
+        if columns is None:
+            columns = fieldnames
+        table = {}
+        for prop in columns:
+            if prop not in fieldnames:
+                raise KeyError(f"Column '{prop}' not found in {infile}")
+            table[prop] = data[f'col{fieldnames.index(prop)}'][selection]
+    return table
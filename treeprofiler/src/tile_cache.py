@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from treeprofiler.src import annotation_cache
+
+# Cache of rendered tiles of the explore view.
+# A tile holds the graphic elements that the smartview drawer yields for a
+# square of TILE_SIZE pixels of one panel of the tree, at a zoom level. It is
+# identified by the tree and its layouts (their key), the panel, the level
+# and the tile coordinates, so panning and zooming back over a tree, or
+# another user browsing the same tree with the same layouts, reuses the
+# drawn tiles instead of running the layouts again. Tiles are kept in memory,
+# least recently used evicted first, and optionally as json files in a
+# directory evicted the same way as the annotation cache. The size of the
+# directory is counted as tiles are written, and only once it goes over its
+# limit is the directory scanned and evicted, down to EVICT_FRACTION of the
+# limit so that the next scan is many tiles away.
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256 # pixels
+TILE_SUFFIX = '.tile.json'
+DEFAULT_MAX_TILES = 4096
+DEFAULT_MAX_SIZE = 256 # MiB, of the cache directory
+EVICT_FRACTION = 0.9 # of max_size left in the directory after an eviction
+
+def layouts_key(tree_text, layouts_config):
+    """
+    Return the key of a tree drawn with a set of layouts.
+
+    :param tree_text: Serialized tree (like its newick), or a token that
+        identifies its content.
+    :param layouts_config: Description of the layouts, representable as JSON
+        (non JSON values are hashed with str()), like the layouts metadata
+        of the explore view.
+    """
+    payload = json.dumps({'tree': hashlib.sha256(tree_text.encode()).hexdigest(),
+                          'layouts': layouts_config}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def tile_key(key, panel, level, x, y):
+    """Key of the tile (x, y) of panel at zoom level of the layouts with key."""
+    return f'{key}-{panel}-{level}-{x}-{y}'
+
+class TileCache:
+    """Tiles in memory and, if cache_dir is given, on disk."""
+
+    def __init__(self, max_tiles=DEFAULT_MAX_TILES, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        self.tiles = OrderedDict()
+        self.max_tiles = max_tiles
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.disk_size = 0 # bytes of the tiles in cache_dir, as of the last eviction plus the ones written
+        self.evicting = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._evict()
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __contains__(self, key):
+        return key in self.tiles or bool(self.cache_dir and os.path.exists(self._path(key)))
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + TILE_SUFFIX)
+
+    def _remember(self, key, tile):
+        with self.lock:
+            self.tiles[key] = tile
+            self.tiles.move_to_end(key)
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached tile of key, None if not cached."""
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+        if tile is None and self.cache_dir:
+            tile = self._load(key)
+            if tile is not None:
+                self._remember(key, tile)
+        if tile is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return tile
+
+    def put(self, key, tile):
+        """Cache the graphic elements of a tile under key."""
+        self._remember(key, tile)
+        if self.cache_dir:
+            self._store(key, tile)
+
+    def get_or_draw(self, key, draw):
+        """Return the cached tile of key, drawing it with draw() if not cached."""
+        tile = self.get(key)
+        if tile is None:
+            tile = list(draw())
+            self.put(key, tile)
+        return tile
+
+    def clear(self):
+        """Forget the tiles in memory (the ones on disk are kept)."""
+        with self.lock:
+            self.tiles.clear()
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                tile = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning(f"Discarding unreadable tile {path}: {e}")
+            os.remove(path)
+            return None
+        os.utime(path) # mark as recently used
+        return tile
+
+    def _store(self, key, tile):
+        try:
+            data = json.dumps(tile)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Tile could not be cached on disk: {e}")
+            return
+
+        # write to a temporary file first so a concurrent reader never gets a partial tile
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        with self.lock:
+            self.disk_size += len(data)
+            full = self.disk_size > self.max_size * 2**20
+        if full:
+            self._evict()
+
+    def _evict(self):
+        """Evict the least recently used tiles on disk, and count the size of the rest."""
+        if not self.evicting.acquire(blocking=False):
+            return # another thread is already evicting
+        try:
+            size = annotation_cache.evict(self.cache_dir, self.max_size * EVICT_FRACTION,
+                                          suffix=TILE_SUFFIX)
+            with self.lock:
+                self.disk_size = size
+        finally:
+            self.evicting.release()
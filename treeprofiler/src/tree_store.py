@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Parsed trees of the web app.
+# Every tree is kept as a tree object, so a request uses it directly instead
+# of parsing its newick again. A tree has versions: the base one (the
+# annotated tree) and the ones made by the operations that change it, like a
+# prune. Versions are never modified, an operation applies to a copy that
+# becomes the current version, and a reset goes back to the base version.
+# Each version has a token, derived from the token of its parent and the
+# operation, that identifies its content (for the tile cache).
+#
+# Trees take an estimated amount of memory each. Over the memory budget, the
+# least recently used ones are pickled to a directory and loaded back when
+# they are used again.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_MEMORY = 2048 # MiB
+NODE_BYTES = 600 # estimated memory of a node, without its properties
+
+def text_token(text):
+    """Token of a version from its serialized content, like the annotated newick."""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def derive_token(token, operation):
+    """Token of the version made by operation (representable as JSON) on version token."""
+    payload = json.dumps([token, operation], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def copy_tree(tree):
+    """Copy of the nodes of tree and their properties (the values are shared)."""
+    root = type(tree)()
+    root.props = dict(tree.props)
+    copies = {tree: root}
+    for node in tree.traverse('preorder'):
+        if node is not tree:
+            child = type(tree)()
+            child.props = dict(node.props)
+            copies[node.up].add_child(child)
+            copies[node] = child
+    return root
+
+def estimated_size(tree):
+    """Estimated memory, in bytes, taken by a tree."""
+    return sum(NODE_BYTES + sum(len(str(v)) for v in node.props.values())
+               for node in tree.traverse())
+
+class TreeStore:
+    """Versions of the trees of the app, by name."""
+
+    def __init__(self, max_memory=DEFAULT_MAX_MEMORY, spill_dir=None):
+        self.max_memory = max_memory
+        self.spill_dir = spill_dir
+        self.versions = OrderedDict() # (name, token) -> tree, None if on disk
+        self.sizes = {} # (name, token) -> estimated size of the tree
+        self.base = {} # name -> token of its base version
+        self.current = {} # name -> token of its current version
+        self.lock = threading.RLock()
+
+    def __contains__(self, name):
+        return name in self.current
+
+    @property
+    def memory(self):
+        """Estimated memory, in bytes, of the trees in memory."""
+        return sum(self.sizes[key] for key, tree in self.versions.items() if tree is not None)
+
+    def add(self, name, tree, token):
+        """Store tree as the base and current version of name."""
+        with self.lock:
+            self.remove(name)
+            self.base[name] = self.current[name] = token
+            self._put(name, token, tree)
+
+    def get(self, name):
+        """Current version of name. It is shared, use edit() to change it."""
+        with self.lock:
+            return self._get(name, self.current[name])
+
+    def token(self, name):
+        """Token of the current version of name."""
+        return self.current[name]
+
+    def copy(self, name):
+        """Copy of the current version of name, that can be changed freely."""
+        return copy_tree(self.get(name))
+
+    def edit(self, name, operation, change):
+        """
+        Apply change(tree) to a copy of the current version of name, and make
+        the tree it returns the current version. operation describes the
+        change (like ['prune', query]) for the token of the new version.
+        """
+        with self.lock:
+            token = derive_token(self.current[name], operation)
+            tree = change(self.copy(name))
+            self._drop(name, self.current[name])
+            self.current[name] = token
+            self._put(name, token, tree)
+            return tree
+
+    def reset(self, name):
+        """Make the base version the current version of name."""
+        with self.lock:
+            self._drop(name, self.current[name])
+            self.current[name] = self.base[name]
+            return self.get(name)
+
+    def remove(self, name):
+        """Forget all the versions of name."""
+        with self.lock:
+            for key in [key for key in self.versions if key[0] == name]:
+                self._forget(key)
+            self.base.pop(name, None)
+            self.current.pop(name, None)
+
+    def _put(self, name, token, tree):
+        key = (name, token)
+        self.versions[key] = tree
+        self.sizes[key] = estimated_size(tree)
+        self._spill()
+
+    def _get(self, name, token):
+        key = (name, token)
+        tree = self.versions[key]
+        if tree is None:
+            with open(self._path(key), 'rb') as f:
+                tree = pickle.load(f)
+            os.remove(self._path(key)) # written again if spilled again
+            self.versions[key] = tree
+        self.versions.move_to_end(key)
+        self._spill()
+        return tree
+
+    def _drop(self, name, token):
+        """Forget a version that stops being current, unless it is the base one."""
+        if token != self.base[name]:
+            self._forget((name, token))
+
+    def _forget(self, key):
+        if self.versions.pop(key, 0) is None:
+            os.remove(self._path(key))
+        self.sizes.pop(key, None)
+
+    def _path(self, key):
+        name, token = key
+        digest = hashlib.sha256(name.encode()).hexdigest()[:16]
+        return os.path.join(self.spill_dir, f'{digest}-{token}.tree.pkl')
+
+    def _spill(self):
+        """Pickle the least recently used trees until the others fit in max_memory."""
+        memory = self.memory
+        for key, tree in list(self.versions.items())[:-1]: # the last one is in use
+            if memory <= self.max_memory * 2**20:
+                break
+            if tree is None:
+                continue
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix='treeprofiler-trees-')
+            try:
+                with open(self._path(key), 'wb') as f:
+                    pickle.dump(tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+            except (pickle.PicklingError, RecursionError, TypeError) as e:
+                logger.warning(f"Tree {key[0]} could not be moved to disk: {e}")
+                os.remove(self._path(key))
+                continue
+            self.versions[key] = None
+            memory -= self.sizes[key]
@@ -1,5 +1,9 @@
 from __future__ import annotations
 from treeprofiler.src import b64pickle
+from treeprofiler.src.columns import PropertyColumns
+from treeprofiler.src.counters import parse_counter
+from treeprofiler.src.booleans import bool_counts
+from treeprofiler.src.query import query_mask
 from ete4.parser.newick import NewickError
 from ete4.core.operations import remove
 from ete4 import Tree, PhyloTree
@@ -7,7 +11,6 @@ from Bio import AlignIO
 from Bio.Align import MultipleSeqAlignment
 from Bio.Align.AlignInfo import SummaryInfo
 from itertools import chain
-from distutils.util import strtobool
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import matplotlib.colors as mcolors
@@ -21,17 +24,9 @@ import math
 import Bio
 import re
 import sys, os
+import gzip
 from io import StringIO
-
-# conditional syntax calling
-operator_dict = {
-                '<':operator.lt,
-                '<=':operator.le,
-                '=':operator.eq,
-                '!=':operator.ne,
-                '>':operator.gt,
-                '>=':operator.ge,
-                }
+from functools import lru_cache
 
 _true_set = {'yes', 'true', 't', 'y', '1'}
 _false_set = {'no', 'false', 'f', 'n', '0'}
@@ -71,85 +66,6 @@ def check_nan(value):
     except ValueError:
         return False
 
-def counter_call(node, internal_prop, leaf_prop, datatype, operator_string, right_value):
-    pair_delimiter = "--"
-    item_seperator = "||"
-    if datatype == str:
-        counter_props = node.props.get(internal_prop)
-            
-        if counter_props:
-            counter_datas = counter_props.split(item_seperator)
-            for counter_data in counter_datas:
-                k, v = counter_data.split(pair_delimiter)
-                if k == leaf_prop:
-                    left_value = float(v)
-                    return operator_dict[operator_string](left_value, float(right_value))
-                else:
-                    pass
-        else:    
-            return False
-        
-    else:
-        return False
-
-def call(node, prop, datatype, operator_string, right_value):
-    num_operators = [ '<', '<=', '>', '>=' ] 
-    if datatype == str or datatype is None:
-        if operator_string in num_operators:
-            return False
-        elif operator_string == 'contains':
-            left_value = node.props.get(prop)
-            if left_value:
-                return right_value in left_value 
-        elif operator_string == 'in':
-            left_value = right_value
-            right_value = node.props.get(prop)
-            if right_value:
-                return left_value in right_value 
-        else:
-            left_value = node.props.get(prop)
-            if left_value:
-                return operator_dict[operator_string](left_value, right_value)
-    
-    elif datatype == float:
-        left_value = node.props.get(prop)
-        if left_value:
-            return operator_dict[operator_string](float(left_value), float(right_value))
-        else:
-            return False
-    
-    elif datatype == list:
-        if operator_string in num_operators:
-            return False
-        elif operator_string == 'contains':
-            left_value = node.props.get(prop)
-            if left_value:
-                return right_value in left_value 
-        
-
-def to_code(condition_strings):
-    conditional_output = []
-    operators = [ '<', '<=', '>', '>=', '=', '!=', 'contains'] 
-    
-    r = re.compile( '|'.join( '(?:{})'.format(re.escape(o)) for o in sorted(operators, reverse=True, key=len)) )
-
-    #codes = string.split(',')
-    # code = code.replace(",", " and ") # ',' means and
-    # code = code.replace(";", " or ") # ';' means or
-    # code = code.replace("=", " = ")
-    # code = code.replace('>', " > ")
-    # code = code.replace('>=', ' >= ')
-
-    #condition_strings = strings.split(',')
-    for condition_string in condition_strings:
-        ops = r.findall(condition_string)
-        for op in ops:
-            condition_string = re.sub(op, ' '+op+' ', condition_string)
-            left_value, op, right_value = condition_string.split(None,2)
-            conditional_output.append([left_value, op, right_value])
-
-    return conditional_output
-
 SeqRecord = Bio.SeqRecord.SeqRecord
 def get_consensus_seq(matrix_string: Path | str, threshold=0.7) -> SeqRecord:
     #https://stackoverflow.com/questions/73702044/how-to-get-a-consensus-of-multiple-sequence-alignments-using-biopython
@@ -161,27 +77,8 @@ def get_consensus_seq(matrix_string: Path | str, threshold=0.7) -> SeqRecord:
     return consensus
 
 def counter2ratio(node, prop, minimum=0.05):
-    counter_separator = '||'
-    items_separator = '--'
-    count_missing = True
-    total = 0
-    positive = 0
-
-    counter_props = node.props.get(prop).split(counter_separator)
-    for counter_prop in counter_props:
-        k, v = counter_prop.split('--')
-        if count_missing:
-            if not check_nan(k):
-                if strtobool(k):
-                    positive = float(v)
-            total += float(v) # here consider missing data in total
-        else:
-            if not check_nan(k):
-                total += float(v) # here doesn't consider missing data in total
-                if strtobool(k):
-                    positive = float(v)
-            
-    total = int(total)
+    # missing data is considered in total
+    positive, total = bool_counts(node.props.get(prop), count_missing=True)
     if total != 0:
         ratio = positive / total
     else:
@@ -193,21 +90,12 @@ def counter2ratio(node, prop, minimum=0.05):
     return ratio
 
 def categorical2ratio(node, prop, all_values, minimum=0.05):
-    counter_separator = '||'
-    items_separator = '--'
-    count_missing = True
-    total = 0
-    positive = 0
     ratios = []
 
-    counter_props = node.props.get(prop).split(counter_separator)
-    counter_dict = {k: v for k, v in [counter_prop.split('--') for counter_prop in counter_props]}
-    total = sum([int(v) for v in counter_dict.values()])
+    counts = parse_counter(node.props.get(prop))
+    total = sum([int(v) for v in counts.values()])
     for value in all_values:
-        if value in counter_dict:
-            positive = int(counter_dict[value])
-        else:
-            positive = 0
+        positive = int(counts.get(value, 0))
         ratio = positive / total
         if ratio < minimum and ratio != 0: # show minimum color for too low
             ratio = 0.05
@@ -255,7 +143,11 @@ def validate_tree(tree_path, input_type, internal_parser=None):
             if not os.path.exists(tree_path):
                 raise FileNotFoundError(f"Input tree {tree_path} does not exist.")
             
-            tree = ete4_parse(open(tree_path), internal_parser=internal_parser)
+            if tree_path.endswith('.gz'):
+                tree_file = gzip.open(tree_path, 'rt')
+            else:
+                tree_file = open(tree_path)
+            tree = ete4_parse(tree_file, internal_parser=internal_parser)
         #except Exception as e:
         #    raise TreeFormatError(f"Error loading tree in 'newick' format: {e}\n"
         #                          "Please try using the correct parser with --internal-parser option, or check the newick format.")
@@ -324,46 +216,31 @@ def taxatree_prune(tree, rank_limit='subspecies'):
     return tree
 
 def conditional_prune(tree, conditions_input, prop2type):
-    conditional_output = []
-    single_one = to_code(conditions_input)
-    conditional_output.append(single_one)
+    """
+    Remove every clade whose root matches the given query.
 
-    ex = False
-    while not ex:
-        ex = True
-        for n in tree.traverse():
-            if not n.is_root:
-                final_call = False
-                for or_condition in conditional_output:
-                    for condition in or_condition:
-                        op = condition[1]
-                        if op == 'in':
-                            value = condition[0]
-                            prop = condition[2]
-                            datatype = prop2type.get(prop)
-                            final_call = call(n, prop, datatype, op, value)
-                        elif ":" in condition[0]:
-                            internal_prop, leaf_prop = condition[0].split(':')
-                            value = condition[2]
-                            datatype = prop2type[internal_prop]
-                            final_call = counter_call(n, internal_prop, leaf_prop, datatype, op, value)
-                        else:
-                            prop = condition[0]
-                            value = condition[2]
-                            datatype = prop2type.get(prop)
-                            final_call = call(n, prop, datatype, op, value)
-                        if final_call == False:
-                            break
-                        else:
-                            continue
-                    if final_call:
-                        n.detach()
-                        ex = False
-                    else:
-                        pass
-            # else:
-            #     if n.dist == 0: 
-            #         n.dist = 1
+    The query is evaluated for all nodes at once over a columnar view of their
+    properties, then a single preorder pass detaches the topmost matching
+    nodes without descending into them.
+
+    :param conditions_input: Query string or list of query strings that all need to be fulfilled.
+    """
+    nodes = list(tree.traverse("preorder"))
+    mask = query_mask(conditions_input, PropertyColumns(nodes), prop2type)
+    mask[0] = False # never prune the root
+    matched_nodes = {nodes[i] for i in np.flatnonzero(mask)}
+
+    matched = []
+    stack = list(reversed(tree.children))
+    while stack:
+        n = stack.pop()
+        if n in matched_nodes:
+            matched.append(n)
+        else:
+            stack.extend(reversed(n.children))
+
+    for n in matched:
+        n.detach()
     return tree
 
 # def _tree_prop_array(node, prop, leaf_only=False, numeric=False, list_type=False):
@@ -589,7 +466,8 @@ def rgba_to_hex(rgba):
 def assign_colors(variables, cmap_name='tab20'):
     """Assigns colors to variables using a matplotlib colormap."""
     cmap = plt.cm.get_cmap(cmap_name, len(variables))  # Get the colormap
-    colors = [rgba_to_hex(cmap(i)) for i in range(cmap.N)]  # Generate colors in hex format
+    # hex colors of all the entries at once, truncated like rgba_to_hex
+    colors = hex_colors(np.floor(cmap(np.arange(cmap.N))[:, :3] * 255)).tolist()
     #random.shuffle(colors)
     return dict(zip(variables, colors))
 
@@ -605,10 +483,13 @@ def build_color_gradient(n_colors, colormap_name="viridis"):
     Returns:
     dict: A dictionary mapping indices to colors in the specified colormap.
     """
+    return dict(enumerate(_colormap_gradient(n_colors, colormap_name), 1))
+
+@lru_cache(maxsize=256)
+def _colormap_gradient(n_colors, colormap_name):
     cmap = plt.get_cmap(colormap_name)
-    indices = np.linspace(0, 1, n_colors)
-    color_gradient = {i: mcolors.rgb2hex(cmap(idx)) for i, idx in enumerate(indices, 1)}
-    return color_gradient
+    rgb = cmap(np.linspace(0, 1, n_colors))[:, :3]
+    return tuple(rgb_to_hex(rgb).tolist())
 
 def build_custom_gradient(n_colors, min_color, max_color, mid_color=None):
     """
@@ -622,33 +503,29 @@ def build_custom_gradient(n_colors, min_color, max_color, mid_color=None):
     Returns:
     dict: A dictionary mapping indices to colors in the generated gradient.
     """
+    return dict(enumerate(_custom_gradient(n_colors, min_color, max_color, mid_color), 1))
+
+@lru_cache(maxsize=256)
+def _custom_gradient(n_colors, min_color, max_color, mid_color):
     # Convert min and max colors to RGB
-    min_rgb = mcolors.to_rgb(min_color)
-    max_rgb = mcolors.to_rgb(max_color)
-    mid_rgb = mcolors.to_rgb(mid_color) if mid_color else None
-    
-    color_gradient = {}
+    min_rgb = np.array(to_rgb(min_color))
+    max_rgb = np.array(to_rgb(max_color))
+    steps = np.arange(n_colors)[:, None]  # i - 1 for the colors i = 1..n_colors
+
     # Determine if we're using a mid_color and split the range accordingly
     if mid_color:
+        mid_rgb = np.array(to_rgb(mid_color))
         # Halfway point for the gradient transition
         mid_point = n_colors // 2
-        
-        for i in range(1, n_colors + 1):
-            if i <= mid_point:
-                # Transition from min_color to mid_color
-                interpolated_rgb = [(mid_c - min_c) * (i - 1) / (mid_point - 1) + min_c for min_c, mid_c in zip(min_rgb, mid_rgb)]
-            else:
-                # Transition from mid_color to max_color
-                interpolated_rgb = [(max_c - mid_c) * (i - mid_point - 1) / (n_colors - mid_point - 1) + mid_c for mid_c, max_c in zip(mid_rgb, max_rgb)]
-            color_gradient[i] = mcolors.to_hex(interpolated_rgb)
+        # Transition from min_color to mid_color, then from mid_color to max_color
+        lower = (mid_rgb - min_rgb) * steps[:mid_point] / (mid_point - 1) + min_rgb
+        upper = (max_rgb - mid_rgb) * (steps[mid_point:] - mid_point) / (n_colors - mid_point - 1) + mid_rgb
+        rgb = np.concatenate((lower, upper))
     else:
         # If no mid_color, interpolate between min_color and max_color directly
-        for i in range(1, n_colors + 1):
-            interpolated_rgb = [(max_c - min_c) * (i - 1) / (n_colors - 1) + min_c for min_c, max_c in zip(min_rgb, max_rgb)]
-            color_gradient[i] = mcolors.to_hex(interpolated_rgb)
-    
-    return color_gradient
-    
+        rgb = (max_rgb - min_rgb) * steps / (n_colors - 1) + min_rgb
+    return tuple(rgb_to_hex(rgb).tolist())
+
 def clear_extra_features(forest, features):
     features = set(features) | {'name', 'dist', 'support'}
     for tree in forest:
@@ -747,26 +624,71 @@ def find_bool_representations(column, rep=True):
     return count 
 
 
+# Color engine.
+# Colors are converted from names or hex codes to RGB once (to_rgb is
+# memoized) and the hex codes of whole RGB arrays are written at once,
+# rounded as matplotlib's to_hex does. The per-color functions used while
+# drawing (color_gradient, make_color_darker*) keep their results in bounded
+# LRU caches, and blend_colors / darken_colors_scaled color whole arrays of
+# ratios or counts in one call.
+
+COLOR_CACHE_SIZE = 65536
+
+@lru_cache(maxsize=1024)
+def to_rgb(color):
+    """RGB tuple of a color name or hex code."""
+    return mcolors.to_rgb(color)
+
+def hex_colors(rgb255):
+    """Hex codes of an (..., 3) array of integer RGB values in [0, 255]."""
+    rgb255 = np.asarray(rgb255).astype(np.int64)
+    codes = rgb255[..., 0] << 16 | rgb255[..., 1] << 8 | rgb255[..., 2]
+    # only the distinct colors are written
+    unique, inverse = np.unique(codes, return_inverse=True)
+    written = np.array(['#%06x' % code for code in unique.tolist()], dtype=object)
+    return written[inverse].reshape(codes.shape)
+
+def rgb_to_hex(rgb):
+    """
+    Hex codes of an (..., 3) array of RGB values in [0, 1], the same ones
+    as matplotlib's to_hex.
+    """
+    rgb = np.asarray(rgb, dtype=np.float64)
+    if not ((rgb >= 0) & (rgb <= 1)).all():
+        raise ValueError("RGBA values should be within 0-1 range")
+    return hex_colors(np.round(rgb * 255))
+
+def blend_colors(c1, c2, mixes):
+    """Array with color_gradient(c1, c2, mix) for each mix of mixes."""
+    mixes = np.asarray(mixes, dtype=np.float64)[..., None]
+    c1 = np.array(to_rgb(c1))
+    c2 = np.array(to_rgb(c2))
+    return rgb_to_hex((1-mixes)*c1 + mixes*c2)
+
+@lru_cache(maxsize=COLOR_CACHE_SIZE)
 def color_gradient(c1, c2, mix=0):
     """ Fade (linear interpolate) from color c1 (at mix=0) to c2 (mix=1) """
     # https://stackoverflow.com/questions/25668828/how-to-create-colour-gradient-in-python
-    c1 = np.array(mpl.colors.to_rgb(c1))
-    c2 = np.array(mpl.colors.to_rgb(c2))
+    c1 = np.array(to_rgb(c1))
+    c2 = np.array(to_rgb(c2))
     return mpl.colors.to_hex((1-mix)*c1 + mix*c2)
 
+@lru_cache(maxsize=COLOR_CACHE_SIZE)
 def make_color_darker_log(hex_color, total, base=10):
     """Darkens the hex color based on a logarithmic scale of the total."""
     # Calculate darkening factor using a logarithmic scale
     darkening_factor = math.log(1 + total, base) / 50  # Adjust base and divisor as needed
     return make_color_darker(hex_color, darkening_factor)
-    
+
+@lru_cache(maxsize=COLOR_CACHE_SIZE)
 def make_color_darker(hex_color, darkening_factor):
     """Darkens the hex color by a factor. Simplified version for illustration."""
     # Simple darkening logic for demonstration
-    c = mcolors.hex2color(hex_color)  # Convert hex to RGB
+    c = to_rgb(hex_color)  # Convert hex to RGB
     darker_c = [max(0, x - darkening_factor) for x in c]  # Darken color
     return mcolors.to_hex(darker_c)
 
+@lru_cache(maxsize=COLOR_CACHE_SIZE)
 def make_color_darker_scaled(hex_color, positive, maximum, base=10, scale_factor=10, min_darkness=0.6):
     """
     Darkens the hex color based on the positive count, maximum count, and a scaling factor.
@@ -793,13 +715,23 @@ def make_color_darker_scaled(hex_color, positive, maximum, base=10, scale_factor
         log_position = min_darkness
 
     # Convert hex to RGB
-    rgb = mcolors.hex2color(hex_color)
+    rgb = to_rgb(hex_color)
     
     # Apply the darkening based on log_position
     darkened_rgb = [(1 - log_position) * channel for channel in rgb]
     
     return mcolors.to_hex(darkened_rgb)
 
+def darken_colors_scaled(hex_color, positives, maximum, base=10, scale_factor=10, min_darkness=0.6):
+    """Array with make_color_darker_scaled(hex_color, positive, maximum, ...) for each of positives."""
+    positives = np.asarray(positives, dtype=np.float64)
+    if (positives > maximum).any():
+        raise ValueError("Positive count cannot exceed the maximum specified.")
+    normalized = positives / maximum if maximum != 0 else np.zeros_like(positives)
+    log_position = np.log(1 + normalized * (scale_factor - 1)) / math.log(base) / math.log(scale_factor, base)
+    log_position = np.minimum(log_position, min_darkness)
+    return rgb_to_hex((1 - log_position)[..., None] * np.array(to_rgb(hex_color)))
+
 # def transform_columns(columns, treat_as_whole=True, normalization_method="min-max"):
 #     transformed = defaultdict(dict)
     
@@ -23,6 +23,13 @@ from ete4 import NCBITaxa
 from treeprofiler.src import utils
 from treeprofiler.src.phylosignal import run_acr_discrete, run_acr_continuous, run_delta
 from treeprofiler.src.ls import run_ls
+from treeprofiler.src.species_overlap import annotate_species_overlap
+from treeprofiler.src.counters import counter_string
+from treeprofiler.src.query import QueryError
+from treeprofiler.src import table
+from treeprofiler.src.newick_writer import write_newick
+from treeprofiler.src.matrix import LeafMatrix, load_matrix
+from treeprofiler.src import annotation_cache
 from treeprofiler.src import b64pickle
 
 from multiprocessing import Pool
@@ -58,6 +65,20 @@ DISCRETE_MODELS = ['JC', 'F81', 'EFT']
 CONTINUOUS_METHODS = ['ML', 'BAYESIAN']
 CONTINUOUS_MODELS = ['BM', 'OU']
 
+# Annotation cache, input files are hashed by content, the other options by
+# value except those which don't change the annotated tree
+CACHE_INPUT_FILES = ['tree', 'metadata', 'delta_metadata', 'data_matrix', 'prop2type', 'emapper_annotations',
+                     'emapper_pfam', 'emapper_smart', 'alignment', 'taxa_dump']
+CACHE_IGNORED_OPTIONS = ['func', 'quiet', 'stdout', 'outdir', 'table_format', 'compress_newick',
+                         'threads', 'matrix_cache_dir', 'cache_dir', 'cache_max_size']
+
+def annotation_cache_key(args):
+    """Key of the annotation cache of the parsed arguments of a run."""
+    return annotation_cache.cache_key(
+        {prop: getattr(args, prop) for prop in CACHE_INPUT_FILES},
+        {prop: value for prop, value in vars(args).items()
+            if prop not in CACHE_INPUT_FILES and prop not in CACHE_IGNORED_OPTIONS})
+
 # Set up the logger with INFO level by default
 logger = logging.getLogger(__name__)
 def setup_logger():
@@ -79,6 +100,11 @@ def populate_annotate_args(parser):
     #     help="<metadata.csv> .csv, .tsv. optional input")
     add('--data-matrix',  nargs='+',
         help="<datamatrix.csv> .csv, .tsv. matrix data metadata table as array to tree, please do not provide column headers in this file")
+    add('--matrix-cache-dir', default=None,
+        help="directory to cache the parsed --data-matrix files as binary arrays, reused while the files are unchanged")
+    add('--delta-metadata', nargs='+',
+        help=("<delta.csv> .csv, .tsv. new or edited columns for a tree annotated before (--annotated-tree), "
+              "only these columns are updated and only in the ancestors of the nodes listed in the table"))
     add('-s', '--metadata-sep', default='\t',
         help="column separator of metadata table [default: \\t]")
     add('--no-headers', action='store_true',
@@ -252,6 +278,26 @@ def populate_annotate_args(parser):
         type=str,
         required=False,
         help="Directory for annotated outputs.")
+    group.add_argument('--table-format',
+        default='tsv',
+        choices=table.TABLE_FORMATS,
+        required=False,
+        help="Format of the annotated table, tsv or npz for a compressed columnar archive. [default: tsv]")
+    group.add_argument('--compress-newick',
+        default=False,
+        action='store_true',
+        help="Write the annotated newick tree gzip compressed, as _annotated.nw.gz")
+    group.add_argument('--cache-dir',
+        type=str,
+        required=False,
+        help=("Directory to cache annotated trees. A run with the same tree, metadata "
+              "and annotation options reuses the cached tree instead of annotating again. "
+              "Taxonomic databases are only part of the key when given with --taxa-dump."))
+    group.add_argument('--cache-max-size',
+        type=int,
+        default=annotation_cache.DEFAULT_MAX_SIZE,
+        required=False,
+        help=f"Size limit of --cache-dir in MiB, least recently used trees are removed first. [default: {annotation_cache.DEFAULT_MAX_SIZE}]")
 
 def run_tree_annotate(tree, input_annotated_tree=False,
         metadata_dict={}, node_props=[], columns={}, prop2type={},
@@ -266,7 +312,16 @@ def run_tree_annotate(tree, input_annotated_tree=False,
         delta_stats=False, ent_type="SE", 
         iteration=100, lambda0=0.1, se=0.5, thin=10, burn=100, 
         ls_columns=None, prec_cutoff=0.95, sens_cutoff=0.95, 
-        threads=1, outdir='./'):
+        threads=1, outdir='./', progress=None):
+    """
+    Annotate tree with the metadata and the analyses asked for, return the
+    annotated tree and its prop2type. progress(stage), if given, is called at
+    the start of each stage (it is where a job of the web app stops when it
+    is cancelled).
+    """
+    def report(stage):
+        if progress:
+            progress(stage)
 
     total_color_dict = []
     layouts = []
@@ -388,6 +443,7 @@ def run_tree_annotate(tree, input_annotated_tree=False,
                 })
 
     # load annotations to leaves
+    report('annotating leaves')
     start = time.time()
 
     # alignment annotation
@@ -439,6 +495,7 @@ def run_tree_annotate(tree, input_annotated_tree=False,
     # Ancestor Character Reconstruction analysis
     # discrete data preparation
     if acr_discrete_columns:
+        report('reconstructing discrete ancestral characters')
         logger.info(f"Performing ACR analysis with discrete traits {acr_discrete_columns} via {prediction_method} method with {model} model.......\n")
         # need to be discrete traits
         discrete_traits = text_prop + bool_prop
@@ -514,6 +571,7 @@ def run_tree_annotate(tree, input_annotated_tree=False,
 
     # continuous data preparation
     if acr_continuous_columns:
+        report('reconstructing continuous ancestral characters')
         logger.info(f"Performing ACR analysis with continuous traits {acr_continuous_columns} via {prediction_method} method with {model} model.......\n")
         # need to be discrete traits
         continuous_traits = num_prop
@@ -544,6 +602,7 @@ def run_tree_annotate(tree, input_annotated_tree=False,
 
     # lineage specificity analysis
     if ls_columns:
+        report('analyzing lineage specificity')
         logger.info(f"Performing Lineage Specificity analysis with Character {ls_columns}...\n")
         if all(column in bool_prop for column in ls_columns):
             best_node, qualified_nodes = run_ls(annotated_tree, props=ls_columns, 
@@ -562,27 +621,11 @@ def run_tree_annotate(tree, input_annotated_tree=False,
     num_stat = num_stat
     
     # merge annotations depends on the column datatype
+    report('summarizing internal nodes')
     start = time.time()
     # choose summary method based on datatype
-    for prop in text_prop+multiple_text_prop+bool_prop:
-        if not prop in column2method:
-            column2method[prop] = counter_stat
-        if column2method[prop] != 'none':
-            prop2type[utils.add_suffix(prop, "counter")] = str
-
-    for prop in num_prop:
-        if not prop in column2method:
-            column2method[prop] = num_stat
-        if column2method[prop] == 'all':
-            prop2type[utils.add_suffix(prop, "avg")] = float
-            prop2type[utils.add_suffix(prop, "sum")] = float
-            prop2type[utils.add_suffix(prop, "max")] = float
-            prop2type[utils.add_suffix(prop, "min")] = float
-            prop2type[utils.add_suffix(prop, "std")] = float
-        elif column2method[prop] == 'none':
-            pass
-        else:
-            prop2type[utils.add_suffix(prop, column2method[prop])] = float
+    set_summary_methods(column2method, prop2type, text_prop+multiple_text_prop+bool_prop, num_prop,
+        counter_stat=counter_stat, num_stat=num_stat)
 
     if not input_annotated_tree:
         node2leaves = annotated_tree.get_cached_content()
@@ -620,6 +663,7 @@ def run_tree_annotate(tree, input_annotated_tree=False,
     logger.info(f'Time for merge annotations to run: {end - start}')
 
     # taxa annotations
+    report('annotating taxonomy')
     start = time.time()
     if taxon_column:
         if not taxadb:
@@ -668,68 +712,152 @@ def run_tree_annotate(tree, input_annotated_tree=False,
     # prune tree by condition
     if pruned_by: # need to be wrap with quotes
         condition_strings = pruned_by
-        annotated_tree = utils.conditional_prune(annotated_tree, condition_strings, prop2type)
+        try:
+            annotated_tree = utils.conditional_prune(annotated_tree, condition_strings, prop2type)
+        except QueryError as e:
+            logger.error(f"Invalid condition in --pruned-by: {e}")
+            sys.exit(1)
     
     # name internal nodes
     annotated_tree = name_nodes(annotated_tree)
     return annotated_tree, prop2type
 
 
+def set_summary_methods(column2method, prop2type, categorical_props, num_props, counter_stat='raw', num_stat='all'):
+    """
+    Fill the summary method of each column missing in column2method and
+    register the types of the summary properties in prop2type.
+    """
+    for prop in categorical_props:
+        if not prop in column2method:
+            column2method[prop] = counter_stat
+        if column2method[prop] != 'none':
+            prop2type[utils.add_suffix(prop, "counter")] = str
+
+    for prop in num_props:
+        if not prop in column2method:
+            column2method[prop] = num_stat
+        if column2method[prop] == 'all':
+            prop2type[utils.add_suffix(prop, "avg")] = float
+            prop2type[utils.add_suffix(prop, "sum")] = float
+            prop2type[utils.add_suffix(prop, "max")] = float
+            prop2type[utils.add_suffix(prop, "min")] = float
+            prop2type[utils.add_suffix(prop, "std")] = float
+        elif column2method[prop] == 'none':
+            pass
+        else:
+            prop2type[utils.add_suffix(prop, column2method[prop])] = float
+
+def run_incremental_annotate(tree, metadata_dict, node_props, prop2type, delta_prop2type={},
+        counter_stat='raw', num_stat='all', column2method={}):
+    """
+    Update an annotated tree with a delta metadata table.
+
+    Only the columns of the delta table are touched. Their values are
+    replaced in the nodes listed in the table and their summaries are
+    recomputed in the ancestors of those nodes. Columns which the tree didn't
+    have before are summarized in every internal node, as a full annotation
+    would do.
+
+    :param metadata_dict: Delta metadata, as returned by parse_csv.
+    :param node_props: Columns of the delta metadata.
+    :param prop2type: Types of the properties of the annotated tree, updated in place.
+    :param delta_prop2type: Types inferred from the delta metadata, used for new columns.
+    :return: The updated tree and prop2type.
+    """
+    common_ancestor_seperator = '||'
+
+    column2type = {prop: prop2type.get(prop, delta_prop2type.get(prop, str)) for prop in node_props}
+    new_props = [prop for prop in node_props if prop not in prop2type]
+    prop2type.update(column2type)
+
+    text_prop = [prop for prop, dtype in column2type.items() if dtype == str]
+    multiple_text_prop = [prop for prop, dtype in column2type.items() if dtype == list]
+    bool_prop = [prop for prop, dtype in column2type.items() if dtype == bool]
+    num_prop = [prop for prop, dtype in column2type.items() if dtype == float]
+    column2method = dict(column2method)
+    set_summary_methods(column2method, prop2type, text_prop+multiple_text_prop+bool_prop, num_prop,
+        counter_stat=counter_stat, num_stat=num_stat)
+
+    # replace the values of the changed nodes, an empty cell removes the value
+    name2node = defaultdict(list)
+    for node in tree.traverse():
+        if node.name:
+            name2node[node.name].append(node)
+
+    changed_nodes = []
+    for name in metadata_dict:
+        if name in name2node:
+            changed_nodes.extend(name2node[name])
+        elif common_ancestor_seperator in name:
+            changed_nodes.append(tree.common_ancestor(name.split(common_ancestor_seperator)))
+    for node in changed_nodes:
+        for prop in node_props:
+            node.props.pop(prop, None)
+    load_metadata_to_tree(tree, metadata_dict, prop2type=prop2type)
+
+    # internal nodes whose summaries are outdated
+    affected = set()
+    for node in changed_nodes:
+        while node is not None and node not in affected:
+            if not node.is_leaf:
+                affected.add(node)
+            node = node.up
+
+    summary_suffixes = ['counter', 'avg', 'sum', 'max', 'min', 'std']
+    if new_props:
+        node2leaves = tree.get_cached_content()
+        targets = [node for node in tree.traverse() if not node.is_leaf]
+    else:
+        node2leaves = None
+        targets = affected
+
+    for node in targets:
+        props = node_props if node in affected else new_props
+        for prop in props:
+            for suffix in summary_suffixes:
+                node.props.pop(utils.add_suffix(prop, suffix), None)
+
+        node_leaves = node2leaves[node] if node2leaves else list(node.leaves())
+        internal_props, _ = process_node((node, node_leaves,
+            [p for p in text_prop if p in props],
+            [p for p in multiple_text_prop if p in props],
+            [p for p in bool_prop if p in props],
+            [p for p in num_prop if p in props],
+            column2method, None, None, None, False))
+        for key, value in internal_props.items():
+            node.add_prop(key, value)
+
+    return tree, prop2type
+
 def run_array_annotate(tree, array_dict, num_stat='none', column2method={}):
     matrix_props = list(array_dict.keys())
     # annotate to the leaves
     for node in tree.traverse():
         if node.is_leaf:
             for filename, array in array_dict.items():
-                if array.get(node.name):
-                    node.add_prop(filename, array.get(node.name))
+                values = array.get(node.name)
+                if values:
+                    node.add_prop(filename, values)
 
 
     # merge annotations to internal nodes
-    for node in tree.traverse():
-        if not node.is_leaf:
-            for prop in matrix_props:
-                # get the array from the children leaf nodes
-                arrays = [child.get_prop(prop) for child in node.leaves() if child.get_prop(prop) is not None]
-                
-                if column2method.get(prop) is not None:
-                    num_stat = column2method.get(prop)
-
-                stats = compute_matrix_statistics(arrays, num_stat=num_stat)
-                if stats:
-                    for stat, value in stats.items():
-                        node.add_prop(utils.add_suffix(prop, stat), value.tolist())
-                        #prop2type[utils.add_suffix(prop, stat)] = float
+    for prop in matrix_props:
+        prop_num_stat = column2method.get(prop, num_stat)
+        node2stats = compute_clade_matrix_statistics(tree, array_dict[prop], num_stat=prop_num_stat)
+        for node, stats in node2stats.items():
+            for stat, value in stats.items():
+                node.add_prop(utils.add_suffix(prop, stat), value.tolist())
+                #prop2type[utils.add_suffix(prop, stat)] = float
     return tree
 
 
-def run(args):
-    total_color_dict = []
-    layouts = []
-    level = 1 # level 1 is the leaf name
+def annotate_from_args(args):
+    """Parse the inputs given in the command line arguments and annotate the tree."""
     prop2type = {}
     metadata_dict = {}
     column2method = {}
 
-    setup_logger()
-
-    if args.metadata:
-        for metadata_file in args.metadata:
-            if not os.path.exists(metadata_file):
-                logger.error(f"Metadata {metadata_file} does not exist.") 
-                sys.exit(1)
-
-    # Validation: Ensure at least one of --outdir or --stdout is selected
-    if not args.outdir and not args.stdout:
-        logger.error("You must specify either --outdir or --stdout to output results.")
-        sys.exit(1)
-
-    if args.outdir:
-        if not os.path.exists(args.outdir):
-            logger.error(f"Output directory {args.outdir} does not exist.") 
-            sys.exit(1)
-        
-
     # parsing tree
     try:
         tree, eteformat_flag = utils.validate_tree(args.tree, args.input_type, args.internal)
@@ -751,10 +879,6 @@ def run(args):
     if args.resolve_polytomy:
         tree.resolve_polytomy()
     
-    # set logger level
-    if args.quiet:
-        logger.setLevel(logging.CRITICAL)  # Mute all log levels below CRITICA
-
     logger.info(f'Loaded tree: {args.tree} \n{tree.describe()}')
 
     # parse csv to metadata table
@@ -770,7 +894,8 @@ def run(args):
         columns = {}
     
     if args.data_matrix:
-        array_dict = parse_tsv_to_array(args.data_matrix, delimiter=args.metadata_sep)
+        array_dict = parse_tsv_to_array(args.data_matrix, delimiter=args.metadata_sep,
+            cache_dir=args.matrix_cache_dir)
     end = time.time()
     logger.info(f'Time for parse_csv to run: {end - start}')
     
@@ -890,15 +1015,66 @@ def run(args):
         **output_options
     )
 
+    if args.delta_metadata:
+        delta_metadata_dict, delta_node_props, delta_columns, delta_prop2type = parse_csv(args.delta_metadata,
+            delimiter=args.metadata_sep, no_headers=args.no_headers, duplicate=args.duplicate)
+        annotated_tree, prop2type = run_incremental_annotate(annotated_tree, delta_metadata_dict,
+            delta_node_props, prop2type, delta_prop2type=delta_prop2type,
+            counter_stat=args.counter_stat, num_stat=args.num_stat, column2method=column2method)
+
     if args.data_matrix:
         annotated_tree = run_array_annotate(annotated_tree, array_dict, num_stat=args.num_stat, column2method=column2method)
 
+    return annotated_tree, prop2type
+
+def run(args):
+    setup_logger()
+
+    for metadata_file in (args.metadata or []) + (args.delta_metadata or []):
+        if not os.path.exists(metadata_file):
+            logger.error(f"Metadata {metadata_file} does not exist.") 
+            sys.exit(1)
+
+    if args.delta_metadata and not args.annotated_tree:
+        logger.error("--delta-metadata updates a tree annotated before, please provide it with --annotated-tree.")
+        sys.exit(1)
+
+    # Validation: Ensure at least one of --outdir or --stdout is selected
+    if not args.outdir and not args.stdout:
+        logger.error("You must specify either --outdir or --stdout to output results.")
+        sys.exit(1)
+
+    if args.outdir:
+        if not os.path.exists(args.outdir):
+            logger.error(f"Output directory {args.outdir} does not exist.") 
+            sys.exit(1)
+
+    # set logger level
+    if args.quiet:
+        logger.setLevel(logging.CRITICAL)  # Mute all log levels below CRITICA
+
+    cached = None
+    if args.cache_dir and args.tree == '-':
+        logger.warning("Annotation cache is not used for a tree read from standard input.")
+    elif args.cache_dir:
+        key = annotation_cache_key(args)
+        cached = annotation_cache.load(args.cache_dir, key)
+
+    if cached:
+        logger.info(f'Loaded annotated tree from cache {args.cache_dir}')
+        annotated_tree, prop2type = cached
+    else:
+        annotated_tree, prop2type = annotate_from_args(args)
+        if args.cache_dir and args.tree != '-':
+            annotation_cache.store(args.cache_dir, key, annotated_tree, prop2type,
+                max_size=args.cache_max_size)
+
     if args.outdir:
         base=os.path.splitext(os.path.basename(args.tree))[0]
         out_newick = base + '_annotated.nw'
         out_prop2tpye = base + '_prop2type.txt'
         out_ete = base+'_annotated.ete'
-        out_tsv = base+'_annotated.tsv'
+        out_tsv = base+'_annotated.'+args.table_format
 
         
         ### output prop2type
@@ -916,29 +1092,22 @@ def run(args):
         if args.taxon_column:
             prop_keys.extend(list(TAXONOMICDICT.keys()))
         if args.annotated_tree:
-            tree2table(annotated_tree, internal_node=True, props=None, outfile=os.path.join(args.outdir, out_tsv))
+            tree2table(annotated_tree, internal_node=True, props=None, outfile=os.path.join(args.outdir, out_tsv), table_format=args.table_format)
         else:
-            tree2table(annotated_tree, internal_node=True, props=prop_keys, outfile=os.path.join(args.outdir, out_tsv))
+            tree2table(annotated_tree, internal_node=True, props=prop_keys, outfile=os.path.join(args.outdir, out_tsv), table_format=args.table_format)
 
         ### out newick
-        ## need to correct wrong symbols in the newick tree, such as ',' -> '||'
-        # Find all keys where the value is of type list
-        list_keys = [key for key, value in prop2type.items() if value == list]
-        # Replace all commas in the tree with '||'
-        list_sep = '||'
-        for node in annotated_tree.leaves():
-            for key in list_keys:
-                if node.props.get(key):
-                    list2str = list_sep.join(str(node.props.get(key)))
-                    node.add_prop(key, list2str)
+        ## list props are written joined by '||' instead of ',' which would break the newick tree
         avail_props = list(prop2type.keys())
 
         #del avail_props[avail_props.index('name')]
         del avail_props[avail_props.index('dist')]
         if 'support' in avail_props:
             del avail_props[avail_props.index('support')]
-    
-        annotated_tree.write(outfile=os.path.join(args.outdir, out_newick), props=avail_props, 
+
+        if args.compress_newick:
+            out_newick += '.gz'
+        write_newick(annotated_tree, os.path.join(args.outdir, out_newick), props=avail_props,
                     parser=utils.get_internal_parser(args.internal), format_root_node=True)
     
     if args.stdout:
@@ -947,8 +1116,8 @@ def run(args):
         del avail_props[avail_props.index('dist')]
         if 'support' in avail_props:
             del avail_props[avail_props.index('support')]
-        print(annotated_tree.write(props=avail_props, parser=utils.get_internal_parser(args.internal), 
-        format_root_node=True))
+        write_newick(annotated_tree, sys.stdout, props=avail_props, 
+            parser=utils.get_internal_parser(args.internal), format_root_node=True)
 
     # if args.outtsv:
     #     tree2table(annotated_tree, internal_node=True, outfile=args.outtsv)
@@ -1101,38 +1270,23 @@ def parse_csv(input_files, delimiter='\t', no_headers=False, duplicate=False):
     
     return metadata, node_props, columns, prop2type
 
-def parse_tsv_to_array(input_files, delimiter='\t', no_headers=True):
+def parse_tsv_to_array(input_files, delimiter='\t', no_headers=True, cache_dir=None):
     """
-    Parses a TSV file into a dictionary with the first item of each row as the key
-    and the rest of the items in the row as a list in the value.
+    Parses matrix files into arrays with one row per leaf, the first item of
+    each row being the leaf name and the rest of the items its values.
 
-    :param filename: Path to the TSV file to be parsed.
-    :return: A dictionary with keys as the first item of each row and values as lists of the remaining items.
+    :param input_files: Paths to the matrix files to be parsed.
+    :param cache_dir: Directory of the memory-mapped binary cache of the parsed matrices, no cache if None.
+    :return: A dictionary with the basename of each file as key and its LeafMatrix as value.
     """
-    is_float = True
     matrix2array = {}
-    
+
     for input_file in input_files:
-        leaf2array = {}
         prefix = os.path.basename(input_file)
-        with open(input_file, 'r') as file:
-            for line in file:
-                # Split each line by tab, strip removes trailing newline
-                row = line.strip().split(delimiter)
-                node = row[0]  
-                value = row[1:]  # The rest of the items as value
-                # Replace empty string with np.nan
-                value_list = [np.nan if x == '' else x for x in value]
-                try:
-                    np_array = np.array(value_list).astype(np.float64)
-                    leaf2array[node] = np_array.tolist()
-                except ValueError:
-                    # Handle the case where conversion fails
-                    logger.warning(f"Warning: Non-numeric data found in {prefix} for node {node}. Skipping.")
-                    leaf2array[node] = None
-                    is_float = False
-
-        matrix2array[prefix] = leaf2array        
+        leaf_matrix = load_matrix(input_file, delimiter=delimiter, cache_dir=cache_dir)
+        for row in np.flatnonzero(~leaf_matrix.numeric):
+            logger.warning(f"Warning: Non-numeric data found in {prefix} for node {leaf_matrix.names[row]}. Skipping.")
+        matrix2array[prefix] = leaf_matrix
     return matrix2array
 
 def process_column_summary_methods(column_summary_methods):
@@ -1376,8 +1530,6 @@ def process_node(node_data):
     return internal_props, consensus_seq
 
 def merge_text_annotations(nodes, target_props, column2method, emapper_mode=False):
-    pair_seperator = "--"
-    item_seperator = "||"
     internal_props = {}
     counters = {}
     
@@ -1396,9 +1548,7 @@ def merge_text_annotations(nodes, target_props, column2method, emapper_mode=Fals
                 internal_props[target_prop] = most_common_key
 
             # Add the raw counts to internal_props
-            internal_props[utils.add_suffix(target_prop, 'counter')] = item_seperator.join(
-                [utils.add_suffix(str(key), value, pair_seperator) for key, value in sorted(counter.items())]
-            )
+            internal_props[utils.add_suffix(target_prop, 'counter')] = counter_string(counter)
 
         elif counter_stat == 'relative':
             # Find the key with the highest count
@@ -1406,12 +1556,8 @@ def merge_text_annotations(nodes, target_props, column2method, emapper_mode=Fals
                 most_common_key = max(counter, key=counter.get)
                 internal_props[target_prop] = most_common_key
 
-            total = sum(counter.values())
-
             # Add the relative counts to internal_props
-            internal_props[utils.add_suffix(target_prop, 'counter')] = item_seperator.join(
-                [utils.add_suffix(str(key), '{0:.2f}'.format(float(value)/total), pair_seperator) for key, value in sorted(counter.items())]
-            )
+            internal_props[utils.add_suffix(target_prop, 'counter')] = counter_string(counter, relative=True)
         elif counter_stat == 'none':
             pass
         else:
@@ -1423,8 +1569,6 @@ def merge_multitext_annotations(nodes, target_props, column2method):
     # Seperator of multiple text 'GO:0000003,GO:0000902,GO:0000904'
     
     multi_text_seperator = ','
-    pair_seperator = "--"
-    item_seperator = "||"
 
     internal_props = {}
     counters = {}
@@ -1439,17 +1583,11 @@ def merge_multitext_annotations(nodes, target_props, column2method):
 
         if counter_stat == 'raw':
             # Add the raw counts to internal_props
-            internal_props[utils.add_suffix(target_prop, 'counter')] = item_seperator.join(
-                [utils.add_suffix(str(key), value, pair_seperator) for key, value in sorted(counter.items())]
-            )
+            internal_props[utils.add_suffix(target_prop, 'counter')] = counter_string(counter)
 
         elif counter_stat == 'relative':
-            total = sum(counter.values())
-
             # Add the relative counts to internal_props
-            internal_props[utils.add_suffix(target_prop, 'counter')] = item_seperator.join(
-                [utils.add_suffix(str(key), '{0:.2f}'.format(float(value) / total), pair_seperator) for key, value in sorted(counter.items())]
-            )
+            internal_props[utils.add_suffix(target_prop, 'counter')] = counter_string(counter, relative=True)
 
         else:
             # Handle invalid counter_stat, if necessary
@@ -1512,48 +1650,104 @@ def merge_num_annotations(nodes, target_props, column2method):
     else:
         return None
 
-def compute_matrix_statistics(matrix, num_stat=None):
+def compute_clade_matrix_statistics(tree, leaf2array, num_stat=None):
     """
-    Computes specified statistics for the given matrix based on the num_stat parameter.
-    
-    :param matrix: A list of lists representing the matrix.
+    Computes specified statistics of the leaf arrays under every internal node.
+
+    Leaf arrays are loaded once into a 2-D float matrix and each clade is
+    summarized bottom-up from its children's count, sum, sum of squares,
+    minimum and maximum, so every leaf row is read only once. Leaves without
+    an array are not counted. NaN values propagate to every statistic of
+    their column, as numpy's mean/max/min/sum/std do.
+
+    :param tree: Tree whose internal nodes are summarized.
+    :param leaf2array: LeafMatrix, or dictionary of leaf name and its list of values.
     :param num_stat: Specifies which statistics to compute. Can be "avg", "max", "min", "sum", "std", "all", or None.
-    :return: A dictionary with the requested statistics or an empty dict/message.
+    :return: A dictionary of internal node and a dictionary of its requested statistics.
     """
-    
-    stats = {}
-
+    available_stats = ['avg', 'max', 'min', 'sum', 'std']
     if num_stat == 'none':
-        return stats  # Return an empty dictionary if no statistics are requested
-    
-    # Replace None with np.nan or another appropriate value before creating the array
-    if matrix is not None:
-        cleaned_matrix = [[0 if x is None else x for x in row] for row in matrix]
-        np_matrix = np.array(cleaned_matrix, dtype=np.float64)
+        return {}  # Return an empty dictionary if no statistics are requested
+    elif num_stat == 'all':
+        requested = available_stats
+    elif num_stat in available_stats:
+        requested = [num_stat]
     else:
-        return {}  # Return an empty dictionary if the matrix is empty
-
-    if np_matrix.size == 0:
-        return {}  # Return an empty dictionary if the matrix is empty
-
- 
-    if np_matrix.ndim == 2 and np_matrix.shape[1] > 0:
-        available_stats = {
-            'avg': np_matrix.mean(axis=0),
-            'max': np_matrix.max(axis=0),
-            'min': np_matrix.min(axis=0),
-            'sum': np_matrix.sum(axis=0),
-            'std': np_matrix.std(axis=0)
-        }
+        logger.error(f"Unsupported stat '{num_stat}'. Supported stats are 'avg', 'max', 'min', 'sum', 'std', or 'all'.")
+        sys.exit(1)
 
-        if num_stat == "all":
-            return available_stats
-        elif num_stat in available_stats:
-            stats[num_stat] = available_stats[num_stat]
-        else:
-            logger.error(f"Unsupported stat '{num_stat}'. Supported stats are 'avg', 'max', 'min', 'sum', 'std', or 'all'.")
-            sys.exit(1)
-    return stats
+    if isinstance(leaf2array, LeafMatrix):
+        # rows are taken straight from the loaded matrix
+        leaves, rows = [], []
+        for leaf in tree.leaves():
+            row = leaf2array.index.get(leaf.name)
+            if row is not None and leaf2array.numeric[row]:
+                leaves.append(leaf)
+                rows.append(row)
+        if not leaves:
+            return {}
+        matrix = np.asarray(leaf2array.values, dtype=np.float64)[rows]
+    else:
+        leaves = [leaf for leaf in tree.leaves() if leaf2array.get(leaf.name)]
+        if not leaves:
+            return {}
+        matrix = np.array([[0 if x is None else x for x in leaf2array[leaf.name]] for leaf in leaves], dtype=np.float64)
+    if matrix.ndim != 2 or matrix.shape[1] == 0:
+        return {}
+
+    # sums are accumulated on values shifted by the column mean, which keeps
+    # the sum of squares precise for the variance
+    present = ~np.isnan(matrix)
+    shift = np.where(present, matrix, 0).sum(axis=0) / np.maximum(present.sum(axis=0), 1)
+    shifted = matrix - shift
+    leaf2row = {leaf: row for row, leaf in enumerate(leaves)}
+
+    need_sums = any(stat in requested for stat in ('avg', 'sum', 'std'))
+    need_squares = 'std' in requested
+    need_min = 'min' in requested
+    need_max = 'max' in requested
+
+    node2stats = {}
+    node2acc = {} # [count, sum, sum of squares, min, max] of the pending clades
+    for node in tree.traverse("postorder"):
+        if node.is_leaf:
+            row = leaf2row.get(node)
+            if row is not None:
+                values = shifted[row]
+                node2acc[node] = [1, values, values * values if need_squares else None,
+                    matrix[row], matrix[row]]
+            continue
+
+        children_acc = [node2acc.pop(ch) for ch in node.children if ch in node2acc]
+        if not children_acc:
+            continue
+        acc = children_acc[0]
+        for child_acc in children_acc[1:]:
+            acc = [
+                acc[0] + child_acc[0],
+                acc[1] + child_acc[1] if need_sums else None,
+                acc[2] + child_acc[2] if need_squares else None,
+                np.minimum(acc[3], child_acc[3]) if need_min else None,
+                np.maximum(acc[4], child_acc[4]) if need_max else None,
+            ]
+        node2acc[node] = acc
+
+        count, sums, squares, mins, maxs = acc
+        stats = {}
+        for stat in requested:
+            if stat == 'avg':
+                stats[stat] = sums / count + shift
+            elif stat == 'max':
+                stats[stat] = maxs
+            elif stat == 'min':
+                stats[stat] = mins
+            elif stat == 'sum':
+                stats[stat] = sums + count * shift
+            elif stat == 'std':
+                mean = sums / count
+                stats[stat] = np.sqrt(np.maximum(squares / count - mean * mean, 0))
+        node2stats[node] = stats
+    return node2stats
 
 def name_nodes(tree):
     for i, node in enumerate(tree.traverse("postorder")):
@@ -1691,20 +1885,8 @@ def annotate_evol_events(tree, sp_delimiter='.', sp_field=0):
         except (IndexError, ValueError):
             return leaf.name
 
-    tree.set_species_naming_function(return_spcode)
-
-    node2species = tree.get_cached_content('species')
-    for n in tree.traverse():
-        n.props['species'] = node2species[n]
-        if len(n.children) == 2:
-            dup_sp = node2species[n.children[0]] & node2species[n.children[1]]
-            if dup_sp:
-                n.props['evoltype'] = 'D'
-                n.props['dup_sp'] = ','.join(dup_sp)
-                n.props['dup_percent'] = round(len(dup_sp)/len(node2species[n]), 3) * 100
-            else:
-                n.props['evoltype'] = 'S'
-        n.del_prop('_speciesFunction')
+    # species sets are handled as integer bitsets, see src/species_overlap.py
+    tree = annotate_species_overlap(tree, return_spcode)
     return tree
 
 def get_range(input_range):
@@ -1920,40 +2102,11 @@ def build_matrix_string(node, name2seq):
             matrix += f">{leaf.name}\n{name2seq.get(leaf.name)}\n"
     return matrix
 
-def tree2table(tree, internal_node=True, props=None, outfile='tree2table.csv'):
-    node2leaves = {}
-    leaf2annotations = {}
-    if not props:
-        props = set()
-        for node in tree.traverse():
-            props |= node.props.keys()
-        props = [ p for p in props if not p.startswith("_") ]
-
-    with open(outfile, 'w', newline='') as csvfile:
-        if '_speciesFunction' in props:
-            props.remove('_speciesFunction')
-        fieldnames = ['name', 'dist', 'support']
-        fieldnames.extend(x for x in sorted(props) if x not in fieldnames)
-
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, delimiter='\t', extrasaction='ignore')
-        writer.writeheader()
-        for node in tree.traverse():
-            if node.name:
-                # if '_speciesFunction' in node.props:
-                #     node.del_prop('_speciesFunction')
-
-                if node.is_leaf:
-                    output_row = dict(node.props)
-                    for k, prop in output_row.items():
-                        if type(prop) == list:
-                            output_row[k] = '|'.join(str(v) for v in prop)
-                    writer.writerow(output_row)
-                else:
-                    if internal_node:
-                        output_row = dict(node.props)
-                        for k, prop in output_row.items():
-                            if type(prop) == list:
-                                output_row[k] = '|'.join(str(v) for v in prop)
-                        writer.writerow(output_row)
-                    else:
-                        pass
+def tree2table(tree, internal_node=True, props=None, outfile='tree2table.csv', leaf_node=True, table_format='tsv'):
+    """
+    Export the properties of the named nodes of the tree as a table.
+
+    :param table_format: 'tsv', or 'npz' for a compressed columnar archive readable with table.read_table.
+    """
+    table.write_table(tree, outfile, props=props, internal_node=internal_node,
+        leaf_node=leaf_node, table_format=table_format)
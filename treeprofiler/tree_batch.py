@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+import os
+import sys
+import csv
+import time
+import shlex
+import argparse
+from functools import lru_cache
+from multiprocessing import Pool
+
+from treeprofiler.main import populate_main_args
+
+DESC = "render many trees"
+
+# Batch rendering.
+# A manifest lists the figures to render, one per row: the tree, the output
+# file and the plot options of the figure (the same as in `treeprofiler plot`).
+# Options shared by all the figures, like a color config, are given once with
+# --shared-options. The figures are rendered in process (plot --render) by a
+# pool of workers, each one rendering many of them, so the modules are loaded
+# and the shared files (color configs, prop2type) are read once per worker.
+# Every figure writes its own output file, so jobs never collide.
+#
+# Manifest (tab-separated, lines starting with # are ignored):
+# TREE	OUTPUT	OPTIONS
+# fam1.ete	fam1.svg	--heatmap-layout abundance
+# fam2.ete	fam2.png	--heatmap-layout abundance --collapsed-by "size < 5"
+
+MANIFEST_COLUMNS = ['TREE', 'OUTPUT', 'OPTIONS']
+
+def populate_batch_args(batch_args_p):
+    group = batch_args_p.add_argument_group(title='Batch arguments',
+        description="Batch rendering parameters")
+    group.add_argument('-m', '--manifest',
+        type=str,
+        required=True,
+        help="tsv file with the columns TREE, OUTPUT and OPTIONS, one figure per row")
+    group.add_argument('--shared-options',
+        type=str,
+        default='',
+        help="plot options of all the figures, like '--color-config colors.tsv'")
+    group.add_argument('--threads',
+        default=4,
+        type=int,
+        required=False,
+        help="Number of worker processes rendering the figures [default: 4]")
+    group.add_argument('--outdir',
+        type=str,
+        default='./',
+        help="directory of the relative OUTPUT paths [default: ./]")
+
+def read_manifest(filename, outdir='./'):
+    """
+    Return the jobs of a manifest, as (tree, output, options) tuples with the
+    options split like a shell would. Relative trees are taken from the
+    directory of the manifest and relative outputs put in outdir.
+    """
+    basedir = os.path.dirname(os.path.abspath(filename))
+    with open(filename, 'r') as f:
+        lines = [line for line in f if line.strip() and not line.startswith('#')]
+
+    reader = csv.reader(lines, delimiter='\t')
+    headers = [header.strip().upper() for header in next(reader, [])]
+    if headers[:2] != MANIFEST_COLUMNS[:2]:
+        raise ValueError(f"manifest {filename} must start with the columns "
+                         f"{', '.join(MANIFEST_COLUMNS)}")
+
+    jobs = []
+    for row in reader:
+        row = dict(zip(headers, row))
+        tree = os.path.join(basedir, row['TREE'].strip())
+        output = os.path.join(outdir, row['OUTPUT'].strip())
+        options = shlex.split(row.get('OPTIONS') or '')
+        jobs.append((tree, output, options))
+    return jobs
+
+def job_argv(tree, output, options, shared_options=()):
+    """Command line arguments of `treeprofiler plot` that render one figure."""
+    return (['--tree', tree] + list(shared_options) + list(options) +
+            ['--render', '--render-file', output])
+
+@lru_cache(maxsize=1)
+def plot_parser():
+    """Parser of the arguments of `treeprofiler plot`."""
+    from treeprofiler import tree_plot  # loads the layouts and ete4's smartview
+
+    parser = argparse.ArgumentParser(prog='treeprofiler plot', add_help=False)
+    populate_main_args(parser)
+    tree_plot.poplulate_plot_args(parser)
+    return parser
+
+def parse_job(parser, argv):
+    """Parsed arguments of a job, or the error message if they are wrong."""
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit:
+        return None, f"wrong options: {shlex.join(argv)}"
+    args.argv = argv # gives the order of the layouts
+    return args, None
+
+def render_job(argv):
+    """Render one figure, return its output, error (None if fine) and time."""
+    from treeprofiler import tree_plot
+
+    start = time.time()
+    output = argv[argv.index('--render-file') + 1]
+    args, error = parse_job(plot_parser(), argv)
+    if not error:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            tree_plot.run(args)
+        except SystemExit: # errors of plot are reported before exiting
+            error = "plot exited with an error"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    return output, error, time.time() - start
+
+def run_batch(jobs, shared_options=(), threads=4):
+    """Render the jobs of a manifest, return the (output, error, time) of each."""
+    argvs = [job_argv(tree, output, options, shared_options) for tree, output, options in jobs]
+
+    # jobs with wrong options are reported without rendering them
+    parser = plot_parser()
+    errors = [parse_job(parser, argv)[1] for argv in argvs]
+    valid = [argv for argv, error in zip(argvs, errors) if not error]
+
+    if threads > 1 and len(valid) > 1:
+        with Pool(min(threads, len(valid))) as pool:
+            rendered = iter(pool.map(render_job, valid, chunksize=1))
+    else:
+        rendered = map(render_job, valid)
+
+    return [(argv[-1], error, 0) if error else next(rendered)
+            for argv, error in zip(argvs, errors)]
+
+def run(args):
+    start = time.time()
+    try:
+        jobs = read_manifest(args.manifest, args.outdir)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    results = run_batch(jobs, shlex.split(args.shared_options), args.threads)
+
+    failed = [(output, error) for output, error, _ in results if error]
+    for output, error in failed:
+        print(f"Failed {output}: {error}")
+    print(f"Rendered {len(results) - len(failed)} of {len(results)} figures "
+          f"in {time.time() - start:.1f}s")
+    if failed:
+        sys.exit(1)
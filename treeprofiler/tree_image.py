@@ -1,212 +1,163 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.action_chains import ActionChains
-from webdriver_manager.chrome import ChromeDriverManager
-from pyvirtualdisplay import Display  # Import pyvirtualdisplay to create a virtual X server
-import time
-import os
-from ete4 import Tree
-from multiprocessing import Process
-import subprocess
-import re
-import shutil
-
-# Custom directory to store downloaded drivers
-DRIVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'drivers')
-
-# Step 1: Get the installed Chrome browser version
-def get_chrome_version():
-    try:
-        version_output = subprocess.check_output(["google-chrome", "--version"], text=True)
-        version = re.search(r"(\d+\.\d+\.\d+\.\d+)", version_output).group(1)
-        return version
-    except Exception as e:
-        print(f"Error checking Chrome version: {e}")
-        return None
-
-# Step 2: Get the ChromeDriver version stored in the custom path
-def get_chromedriver_version(driver_path):
-    try:
-        version_output = subprocess.check_output([driver_path, "--version"], text=True)
-        version = re.search(r"(\d+\.\d+\.\d+\.\d+)", version_output).group(1)
-        return version
-    except Exception as e:
-        print(f"Error checking ChromeDriver version: {e}")
-        return None
-
-# Step 3: Check if there's already a driver in the custom path that matches the installed Chrome version
-def find_existing_driver(custom_path, chrome_version):
-    if not os.path.exists(custom_path):
-        return None
-    
-    for root, dirs, files in os.walk(custom_path):
-        for file in files:
-            if file == "chromedriver":  # Adjust for your OS (e.g., chromedriver.exe on Windows)
-                driver_path = os.path.join(root, file)
-                driver_version = get_chromedriver_version(driver_path)
-                if driver_version and driver_version.split('.')[0] == chrome_version.split('.')[0]:
-                    print(f"Found matching ChromeDriver (v{driver_version}) in {driver_path}")
-                    return driver_path
-    return None
-
-# Step 4: Download the ChromeDriver and move it to the custom path
-def download_and_move_driver(custom_path):
-    # Download the driver using ChromeDriverManager
-    downloaded_driver = ChromeDriverManager().install()
-
-    if not os.path.exists(custom_path):
-        os.makedirs(custom_path)
-
-    driver_filename = "chromedriver"  # Adjust for your OS (e.g., chromedriver.exe on Windows)
-    destination = os.path.join(custom_path, driver_filename)
-
-    # Copy the downloaded driver to the custom path
-    shutil.copy(downloaded_driver, destination)
-    return destination
-
-# Step 5: Set up the ChromeDriver in headless mode
-# def setup_driver(custom_path):
-#     # Check if Chrome is available in /usr/bin
-#     chrome_binary = shutil.which("google-chrome")
-    
-#     if chrome_binary:
-#         print(f"Google Chrome found at {chrome_binary}")
-#         return chrome_binary, True  # Return the Chrome binary and flag it as found
-#     else:
-#         print("Google Chrome not found in /usr/bin. Using ChromeDriver instead.")
-#         chrome_version = get_chrome_version()
-#         if chrome_version:
-#             print(f"Installed Chrome version: {chrome_version}")
-#         else:
-#             print("Could not determine Chrome version. Downloading ChromeDriver automatically.")
-        
-#         # Check for existing ChromeDriver in the custom path
-#         existing_driver = find_existing_driver(custom_path, chrome_version)
-        
-#         if existing_driver:
-#             print("Using existing ChromeDriver.")
-#             driver_path = existing_driver
-#         else:
-#             print("No matching ChromeDriver found. Downloading new driver.")
-#             driver_path = download_and_move_driver(custom_path)
-
-#         return driver_path, False  # Return the ChromeDriver path and flag it as ChromeDriver
-
-def setup_driver(custom_path):
-    chrome_version = get_chrome_version()
-    if chrome_version:
-        print(f"Installed Chrome version: {chrome_version}")
-    else:
-        print("Could not determine Chrome version. Downloading ChromeDriver automatically.")
-    
-    # Check for existing ChromeDriver in the custom path
-    existing_driver = find_existing_driver(custom_path, chrome_version)
-    
-    if existing_driver:
-        print("Using existing ChromeDriver.")
-        driver_path = existing_driver
-    else:
-        print("No matching ChromeDriver found. Downloading new driver.")
-        driver_path = download_and_move_driver(custom_path)
-
-    return driver_path, False  # Return the ChromeDriver path and flag it as ChromeDriver
-
-# Step 6: Updated tree_session and snap_tree functions with Xvfb virtual display
-def tree_session(tree, layouts, port):
-    # Start the ETE tree exploration session
-    tree.explore(layouts=layouts, keep_server=True, open_browser=False, compress=False,  
-                show_leaf_name=True, show_branch_length=True, show_branch_support=True, port=port)
-
-def snap_tree(port, plot_file, driver_path, is_chrome_binary):
-    # Start a virtual display (for headless environments)
-    display = Display(visible=0, size=(1920, 1080))  # Set larger display size
-    display.start()
-    print("Virtual display started")
-    
-    try:
-        url = 'http://127.0.0.1:{}/'.format(str(port))
-        print(f"Opening URL: {url}")
-        
-        options = Options()
-        options.headless = False  # Disable headless mode for debugging, change to True later
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--disable-gpu")
-        #options.add_argument("--remote-debugging-port=9222")  # Required for remote debugging
-        options.add_argument("--disable-software-rasterizer")  # Fix for headless environments
-        options.add_argument("--remote-debugging-port=9230")
-
-        # Specify the directory where the file will be downloaded
-        default_download_dir = os.getcwd()  # Set to current working directory
-
-        # Set Chrome preferences for automatic download to the specific directory
-        prefs = {
-            "download.default_directory": default_download_dir,  # Set download directory
-            "download.prompt_for_download": False,  # Disable download confirmation dialog
-            "download.directory_upgrade": True,  # Automatically upgrade download directory
-            "safebrowsing.enabled": True  # Enable safe browsing
-        }
-        options.add_experimental_option("prefs", prefs)
-
-        # If we're using Chrome, set the binary location
-        if is_chrome_binary:
-            options.binary_location = driver_path
-
-        # Set up Chrome with the driver or binary
-        print("Setting up Chrome browser")
-        driver = webdriver.Chrome(service=Service(driver_path), options=options)
-        driver.get(url)
-        print("Page loaded. Current URL:", driver.current_url)
-
-        # Perform actions (ensure the page is focused before sending the 'd' key)
-        actions = ActionChains(driver)
-        actions.click().send_keys('d').perform()  # Ensure page has focus before sending key
-        print("Sent 'd' key to the page")
-        
-        # Wait for the file to download
-        default_download_dir = os.getcwd()  # Specify the directory where the file will be downloaded
-        file_name = 'tree-1.svg'  # Specify the name of the downloaded file
-        file_path = os.path.join(default_download_dir, file_name)
-        print(f"Looking for file at: {file_path}")
-
-        # Wait for the file to appear in the directory
-        wait_time = 0
-        while not os.path.exists(file_path):
-            print("Waiting for the file to download...")
-            time.sleep(1)
-            wait_time += 1
-            if wait_time > 30:  # Timeout after 30 seconds
-                print("Timeout waiting for file download.")
-                break
-
-        # Check if the file was downloaded and move it
-        if os.path.exists(file_path):
-            os.rename(file_path, plot_file)
-            print(f"File downloaded and moved to: {plot_file}")
-        else:
-            print("File was not downloaded.")
-
-        driver.quit()
-
-    except Exception as e:
-        print(f"Error occurred: {e}")
-    
-    finally:
-        print("Stopping virtual display")
-        display.stop()  # Stop the virtual display when done
-
-# Step 7: Get image function using multiprocessing
-def get_image(tree, layouts, port, plot_file):
-    driver_path, is_chrome_binary = setup_driver(DRIVER_DIR)  # Set up ChromeDriver or Chrome binary
-    #driver_path = "/home/deng/Projects/metatree_drawer/test_selenium/drivers/chromedriver"
-    #is_chrome_binary = False
-    p1 = Process(target=tree_session, args=(tree, layouts, port,))
-    p2 = Process(target=snap_tree, args=(port, plot_file, driver_path, is_chrome_binary,))
-    
-    p1.start()
-    time.sleep(4)  # Give the tree session some time to initialize
-    p2.start()
-    time.sleep(4)  # Wait for the snapshot process
-    p1.kill()
-    p2.kill()
\ No newline at end of file
+import threading
+
+from ete4.smartview import TreeStyle, TreeLayout, TextFace
+from ete4.smartview.renderer import drawer as drawer_module
+from ete4.smartview.renderer.draw_helpers import Box
+
+from treeprofiler.src.graphics import panel_shapes, write_image, to_svg
+from treeprofiler.src.payloads import prepare_layouts
+from treeprofiler.src.tile_cache import TILE_SIZE, tile_key
+
+# Headless rendering of a tree with its layouts.
+# The smartview drawers are run in process over a viewport that covers the
+# whole tree, at a fixed zoom, and their graphic elements are written as svg
+# (or png). No explore server, browser or display is involved, so a figure
+# takes the time of one draw of the tree and the same tree and layouts always
+# give the same file.
+
+TREE_FRACTION = 0.6  # of the width of the tree panel taken by the branches
+ALIGNED_WIDTH = 100000  # pixels available to the aligned faces
+MAX_LEVEL = 20  # deepest zoom level of the tiles
+
+class LayoutLeafName(TreeLayout):
+    """Names of the leaves, as shown by explore with show_leaf_name."""
+
+    def __init__(self, name="Leaf name"):
+        super().__init__(name)
+
+    def set_node_style(self, node):
+        if node.is_leaf and node.name:
+            node.add_face(TextFace(node.name), column=0, position='branch_right')
+
+def tree_size(tree):
+    """Largest distance from the root to a leaf, and number of leaves."""
+    width, nleaves = 0, 0
+    distances = {tree: 0}
+    for node in tree.traverse('preorder'):
+        if node is not tree:
+            distances[node] = distances[node.up] + (node.dist or 0)
+        if node.is_leaf:
+            nleaves += 1
+            width = max(width, distances[node])
+    return width or 1, nleaves
+
+def draw_panel(tree, layouts, tree_style, panel, viewport, zoom):
+    """Graphic elements of one panel of the tree (0: the tree, 1: aligned faces)."""
+    drawer = drawer_module.DrawerAlignRectFaces(tree, viewport, panel, zoom,
+        layouts=layouts, tree_style=tree_style)
+    return drawer.draw()
+
+def tree_style_of(tree, layouts):
+    """Tree style with the settings of the layouts (legends, headers...)."""
+    tree_style = TreeStyle()
+    for layout in layouts:
+        if hasattr(layout, 'set_tree_style'):
+            layout.set_tree_style(tree, tree_style)
+    return tree_style
+
+def tree_shapes(tree, layouts, width=800, leaf_height=16):
+    """
+    Yield the shapes, in pixels, of the tree drawn with its layouts. The tree
+    panel is width pixels wide and each leaf leaf_height pixels high, the
+    aligned faces go to the right of the tree panel.
+    """
+    tree_style = tree_style_of(tree, layouts)
+
+    tree_width, nleaves = tree_size(tree)
+    zoom = (TREE_FRACTION * width / tree_width, leaf_height)
+    viewport = Box(0, 0, width / zoom[0], nleaves)
+    yield from panel_shapes(draw_panel(tree, layouts, tree_style, 0, viewport, zoom), zoom)
+
+    viewport = Box(0, 0, ALIGNED_WIDTH / zoom[0], nleaves)
+    yield from panel_shapes(draw_panel(tree, layouts, tree_style, 1, viewport, zoom), zoom,
+                            offset=(width, 0))
+
+class TileRenderer:
+    """
+    Tiles of a tree drawn with its layouts, kept in a TileCache under key
+    (see tile_cache.layouts_key). At level 0 the whole tree fits in one tile,
+    and each level doubles the zoom, so level l has 2**l x 2**l tiles of
+    the tree panel. The aligned panel has as many columns of tiles as its
+    faces need.
+    """
+
+    def __init__(self, tree, layouts, cache, key, version=None):
+        self.tree = tree
+        self.layouts = [layout for layout in layouts if getattr(layout, 'active', True)]
+        # payloads shared with the tree it is a copy of, if prepared with the same version
+        prepare_layouts(tree, self.layouts, version)
+        self.cache = cache
+        self.key = key
+        self.tree_style = tree_style_of(tree, self.layouts)
+        self.size = tree_size(tree)
+        self.lock = threading.Lock() # drawers set the faces of the nodes
+
+    def zoom(self, level):
+        width, nleaves = self.size
+        scale = TILE_SIZE * 2**level
+        return TREE_FRACTION * scale / width, scale / nleaves
+
+    @staticmethod
+    def has_tile(panel, level, x, y):
+        """
+        If tile (x, y) of panel at level can have something drawn: the tree
+        fills 2**level tiles in each direction, and the aligned faces go
+        ALIGNED_WIDTH pixels to the right.
+        """
+        if panel not in (0, 1) or not 0 <= level <= MAX_LEVEL:
+            return False
+        columns = 2**level if panel == 0 else -(-ALIGNED_WIDTH // TILE_SIZE)
+        return 0 <= x < columns and 0 <= y < 2**level
+
+    def origin(self, level, x, y):
+        """Tree coordinates of the top left corner of tile (x, y) of level."""
+        zx, zy = self.zoom(level)
+        return x * TILE_SIZE / zx, y * TILE_SIZE / zy
+
+    def draw(self, panel, level, x, y):
+        zoom = self.zoom(level)
+        viewport = Box(*self.origin(level, x, y), TILE_SIZE / zoom[0], TILE_SIZE / zoom[1])
+        with self.lock:
+            return list(draw_panel(self.tree, self.layouts, self.tree_style, panel, viewport, zoom))
+
+    def tile(self, panel, level, x, y):
+        """Graphic elements of tile (x, y) of panel at level, drawn once."""
+        return self.cache.get_or_draw(tile_key(self.key, panel, level, x, y),
+                                      lambda: self.draw(panel, level, x, y))
+
+    def tile_svg(self, panel, level, x, y):
+        """Svg of TILE_SIZE x TILE_SIZE pixels with tile (x, y) of panel at level."""
+        shapes = panel_shapes(self.tile(panel, level, x, y), self.zoom(level),
+                              origin=self.origin(level, x, y))
+        return to_svg(shapes, box=(0, 0, TILE_SIZE, TILE_SIZE), background=None)
+
+    def prewarm(self, levels=3, max_aligned_tiles=16, cancelled=None):
+        """
+        Draw the tiles of the top levels: all the tiles of the tree panel, and
+        the ones of the aligned panel up to the first empty one of each row.
+        Stop when cancelled(), if given, is true (checked for each row).
+        """
+        for level in range(levels):
+            for y in range(2**level):
+                if cancelled and cancelled():
+                    return
+                for x in range(2**level):
+                    self.tile(0, level, x, y)
+                for x in range(max_aligned_tiles):
+                    if not self.tile(1, level, x, y):
+                        break
+
+def render_tree(tree, layouts, plot_file, width=800, leaf_height=16,
+                show_leaf_name=True, margin=10, scale=1):
+    """Write an svg (or png, if plot_file ends in .png) of the tree with its layouts."""
+    layouts = [layout for layout in layouts if getattr(layout, 'active', True)]
+    prepare_layouts(tree, layouts)
+    if show_leaf_name:
+        layouts = [LayoutLeafName()] + layouts
+    shapes = tree_shapes(tree, layouts, width, leaf_height)
+    write_image(shapes, plot_file, margin=margin, scale=scale)
+    return plot_file
+
+def get_image(tree, layouts, plot_file, **kwargs):
+    render_tree(tree, layouts, plot_file, **kwargs)
+    print(f"Tree rendered to: {plot_file}")
@@ -4,11 +4,13 @@ import sys
 import os
 import argparse
 import csv
+import copy
 import logging
 
 from collections import defaultdict
 from collections import OrderedDict
 from collections import Counter
+from functools import lru_cache
 from itertools import islice
 from io import StringIO
 import matplotlib.pyplot as plt
@@ -20,11 +22,16 @@ from ete4 import GTDBTaxa
 from ete4 import NCBITaxa
 from ete4.smartview import TreeStyle, NodeStyle, TreeLayout
 from treeprofiler.tree_image import get_image
+from treeprofiler.src.payloads import prepare_layouts
 from treeprofiler.layouts import (
     text_layouts, taxon_layouts, staple_layouts, 
     conditional_layouts, seq_layouts, profile_layouts, phylosignal_layouts)
 
 import treeprofiler.src.utils as utils
+from treeprofiler.src.color_scale import ColorScale, NORM_METHODS
+from treeprofiler.src.matrix import NodeMatrix, presence_matrix
+from treeprofiler.src.booleans import to_bool
+from treeprofiler.src.query import compile_query, QueryError
 from treeprofiler.tree_annotate import can_convert_to_bool
 
 import sys
@@ -58,7 +65,9 @@ logger = logging.getLogger(__name__)
 def setup_logger(level=logging.ERROR):
     """Sets up logging configuration."""
     logger.setLevel(level)
-    
+    if logger.handlers: # already set up by a previous run in this process
+        return
+
     # Create a StreamHandler to output to sys.stdout
     handler = logging.StreamHandler(sys.stdout)
     
@@ -327,7 +336,12 @@ def poplulate_plot_args(plot_args_p):
         #type=str,
         action="store_true", 
         required=False,
-        help="output as svg")
+        help="render the tree to --render-file in process, instead of starting the explore session")
+    group.add_argument('--render-file',
+        type=str,
+        default="tree-1.svg",
+        required=False,
+        help="file of the rendered tree, png if it ends in .png (requires pillow).[default: tree-1.svg]")
     group.add_argument('--out-colordict',
         action="store_true", 
         required=False,
@@ -364,13 +378,8 @@ def run(args):
             logger.error("prop2type is not supported for ete format tree, only for newick tree.")
             sys.exit(1)
         else:
-            prop2type = {}
-            with open(args.prop2type, 'r') as f:
-                for line in f:
-                    line = line.rstrip()
-                    prop, value = line.split('\t')
-                    prop2type[prop] = eval(value)
-            
+            prop2type = dict(read_prop2type(args.prop2type, os.path.getmtime(args.prop2type)))
+
             popup_prop_keys = list(prop2type.keys()) 
 
     else:
@@ -400,10 +409,9 @@ def run(args):
             if os.path.isfile(condition):
                 color2conditions = build_color2conditions(condition, args.config_sep)
             else:
-                syntax_sep = ','
-                condition_list = condition.split(syntax_sep)
                 color2conditions  = {}
-                color2conditions[paired_color[idx]] = condition_list
+                color2conditions[paired_color[idx]] = [condition]
+            check_conditions(color2conditions, prop2type)
             c_layout = conditional_layouts.LayoutCollapse(name='Collapsed-by_'+condition, color2conditions=color2conditions, column=level, prop2type = prop2type)
             layouts.append(c_layout)
 
@@ -414,10 +422,9 @@ def run(args):
             if os.path.isfile(condition):
                 color2conditions = build_color2conditions(condition, args.config_sep)
             else:
-                syntax_sep = ','
-                condition_list = condition.split(syntax_sep)
                 color2conditions  = {}
-                color2conditions[paired_color[idx]] = condition_list
+                color2conditions[paired_color[idx]] = [condition]
+            check_conditions(color2conditions, prop2type)
             s_layout = conditional_layouts.LayoutHighlight(name='Highlighted-by_'+condition, color2conditions=color2conditions, column=level, prop2type = prop2type)
             layouts.append(s_layout)
     
@@ -428,16 +435,16 @@ def run(args):
     # color configuration
     color_config = {}
     if args.color_config:
-        color_config = read_config_to_dict(args.color_config, delimiter=args.config_sep)
+        config_file = args.color_config.name
+        if os.path.isfile(config_file):
+            color_config = copy.deepcopy(read_color_config(config_file,
+                os.path.getmtime(config_file), args.config_sep))
+        else: # like stdin
+            color_config = read_config_to_dict(args.color_config, delimiter=args.config_sep)
 
     # Get the input arguments in order
-    input_order = []
-    for arg in sys.argv[1:]:
-        if arg.startswith('-') and arg.endswith('layout'):
-            input_order.append(arg[2:])
-        else:
-            continue
-    
+    input_order = layout_order(getattr(args, 'argv', None) or sys.argv[1:])
+
     visualized_props = []
     for layout in input_order:
         if layout == 'acr-discrete-layout':
@@ -875,7 +882,11 @@ def run(args):
     # prune tree by condition 
     if args.pruned_by: # need to be wrap with quotes
         condition_strings = args.pruned_by
-        tree = utils.conditional_prune(tree, condition_strings, prop2type)
+        try:
+            tree = utils.conditional_prune(tree, condition_strings, prop2type)
+        except QueryError as e:
+            logger.error(f"Invalid condition in --pruned-by: {e}")
+            sys.exit(1)
 
     #### Output #####
     popup_prop_keys.extend(list(set(visualized_props)))
@@ -883,9 +894,13 @@ def run(args):
     
     if args.out_colordict:
         wrtie_color(total_color_dict)
+
+    # face parameters of every node, computed once instead of on each redraw
+    prepare_layouts(tree, layouts)
+
     if args.render:
-        file_path = "tree-1.svg"
-        get_image(tree, layouts, args.port, os.path.abspath(file_path))
+        get_image(tree, layouts, os.path.abspath(args.render_file),
+            show_leaf_name=args.hide_leaf_name)
     else:
         tree.explore(keep_server=True, compress=False, quiet=args.verbose, 
         layouts=layouts, port=args.port, include_props=popup_prop_keys,
@@ -907,6 +922,33 @@ def wrtie_color(color_dict):
                         f.write('COLOR'+'\t'+ sub_v+'\n')
                     f.write('\n')
 
+def layout_order(argv):
+    """Names of the layout arguments (like 'heatmap-layout') in the order given."""
+    return [arg[2:] for arg in argv if arg.startswith('-') and arg.endswith('layout')]
+
+@lru_cache(maxsize=32)
+def read_prop2type(filename, mtime):
+    """
+    Property types of a prop2type file, read once per file and modification
+    time (mtime) in a process.
+    """
+    prop2type = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.rstrip()
+            prop, value = line.split('\t')
+            prop2type[prop] = eval(value)
+    return prop2type
+
+@lru_cache(maxsize=32)
+def read_color_config(filename, mtime, delimiter):
+    """
+    read_config_to_dict of a color config file, read once per file and
+    modification time (mtime) in a process.
+    """
+    with open(filename, 'r') as f:
+        return read_config_to_dict(f, delimiter)
+
 def read_config_to_dict(file_obj, delimiter):
     """
     Reads a configuration file to a dictionary.
@@ -968,6 +1010,16 @@ def process_common_ancestors(color_dict, tree, common_ancestor_separator='||'):
                     ancestor.name = key
     return color_dict
 
+def check_conditions(color2conditions, prop2type):
+    # layouts only compile their queries when the tree is drawn, so a
+    # malformed condition is reported here before any rendering starts
+    for conditions in color2conditions.values():
+        try:
+            compile_query(conditions, prop2type)
+        except QueryError as e:
+            logger.error(f"Invalid condition {conditions}: {e}")
+            sys.exit(1)
+
 def build_color2conditions(condition_file, config_sep):
     color2conditions = {}
     
@@ -987,7 +1039,7 @@ def build_color2conditions(condition_file, config_sep):
                         operator = parts[3]
                         
                         # Construct the condition string
-                        condition_string = ''.join([left, operator, right])
+                        condition_string = ' '.join([left, operator, right])
                         
                         # Add the condition string to the dictionary under the corresponding color
                         if color not in color2conditions:
@@ -1042,14 +1094,9 @@ def get_acr_continuous_layouts(tree, props, level, prop2type, padding_x=1, paddi
             sys.exit(1)
         all_values = all_values[~np.isnan(all_values)]
         minval, maxval = all_values.min(), all_values.max()
-        num = len(gradientscolor)
-        index_values = np.linspace(minval, maxval, num)
-        value2color = {}
-        for search_value in all_values:
-            index = np.abs(index_values - search_value).argmin()+1
-            value2color[search_value] = gradientscolor[index]
+        color_scale = ColorScale(gradientscolor, minval, maxval)
         layout = phylosignal_layouts.LayoutACRContinuous(name='ACR_'+prop, column=level, \
-            color_dict=value2color, prop=prop, value_range=[minval, maxval], \
+            color_dict=color_scale, prop=prop, value_range=[minval, maxval], \
             color_range=[gradientscolor[20], gradientscolor[10], gradientscolor[1]])
         layouts.append(layout)
     return layouts
@@ -1065,26 +1112,19 @@ def get_ls_layouts(tree, props, level, prop2type, padding_x=1, padding_y=0, colo
     layouts = []
     ls_props = []
     for prop in props:
-        value2color = {}
         gradientscolor = utils.build_color_gradient(20, colormap_name='bwr')
+        minval, maxval = 0, 1
+        color_scale = ColorScale(gradientscolor, minval, maxval)
 
         for suffix in [precision_suffix, sensitivity_suffix, f1_suffix]:
             
             ls_prop = utils.add_suffix(prop, suffix)
-            minval, maxval = 0, 1
             
             # get value
             internalnode_all_values = np.array(sorted(list(set(utils.tree_prop_array(tree, ls_prop, numeric=True))))).astype('float64')
             all_values = internalnode_all_values[~np.isnan(internalnode_all_values)]
-            num = len(gradientscolor)
-            index_values = np.linspace(minval, maxval, num)
-
-            if all_values.any():
-                for search_value in all_values:
-                    if search_value not in value2color:
-                        index = np.abs(index_values - search_value).argmin()+1
-                        value2color[search_value] = gradientscolor[index]
-            else:
+
+            if not all_values.any():
                 logger.error(f"Property {ls_prop} is empty. Please check annotation.")
                 sys.exit(1)
             # layout = staple_layouts.LayoutBranchScore(name='BranchScore_'+prop, \
@@ -1093,12 +1133,12 @@ def get_ls_layouts(tree, props, level, prop2type, padding_x=1, padding_y=0, colo
             # color_range=[gradientscolor[20], gradientscolor[10], gradientscolor[1]])
             if suffix != "f1":
                 layout = staple_layouts.LayoutBranchScore(name='LS_'+ls_prop, \
-                    color_dict=value2color, prop=ls_prop, value_range=[minval, maxval], \
+                    color_dict=color_scale, prop=ls_prop, value_range=[minval, maxval], \
                     color_range=[gradientscolor[20], gradientscolor[10], gradientscolor[1]], 
                     show_score=True, active=False)
             else:
                 layout = staple_layouts.LayoutBranchScore(name='LS_'+ls_prop, \
-                    color_dict=value2color, prop=ls_prop, value_range=[minval, maxval], \
+                    color_dict=color_scale, prop=ls_prop, value_range=[minval, maxval], \
                     color_range=[gradientscolor[20], gradientscolor[10], gradientscolor[1]], 
                     show_score=True)
             
@@ -1372,19 +1412,11 @@ def get_branchscore_layouts(tree, props, prop2type, padding_x=1, padding_y=0, in
         else:
             gradientscolor = utils.build_color_gradient(20, colormap_name='jet')
 
-        # Preload corresponding gradient color of each value
-        num = len(gradientscolor)
-        index_values = np.linspace(minval, maxval, num)
-
-        for search_value in all_values:
-            if search_value not in value2color:
-                index = np.abs(index_values - search_value).argmin() + 1
-                value2color[search_value] = gradientscolor[index]
-
         # Get corresponding gradient color on the fly of visualization
+        color_scale = ColorScale(gradientscolor, minval, maxval, value2color=value2color)
         layout = staple_layouts.LayoutBranchScore(
             name='BranchScore_' + prop,
-            color_dict=value2color,
+            color_dict=color_scale,
             prop=prop,
             internal_rep=internal_rep,
             value_range=[minval, maxval],
@@ -1624,16 +1656,6 @@ def get_numerical_bubble_layouts(tree, props, level, prop2type, padding_x=0, pad
     return layouts, level, prop_color_dict
 
 def get_heatmap_layouts(tree, props, level, column_width=70, padding_x=1, padding_y=0, internal_rep='avg', color_config=None, norm_method='min-max', global_scaling=True):
-    # Helper functions for normalization
-    def min_max_normalize(value, minval, maxval):
-        return 0 if maxval - minval == 0 else (value - minval) / (maxval - minval)
-
-    def mean_normalize(value, mean_val, minval, maxval):
-        return 0 if maxval - minval == 0 else (value - mean_val) / (maxval - minval)
-
-    def z_score_normalize(value, mean_val, std_val):
-        return 0 if std_val == 0 else (value - mean_val) / std_val
-
     # Helper function to parse color configuration
     def parse_color_config(prop, color_config, minval, maxval):
         # Default colors
@@ -1702,31 +1724,16 @@ def get_heatmap_layouts(tree, props, level, column_width=70, padding_x=1, paddin
         if not gradientscolor:
             gradientscolor = utils.build_color_gradient(20, colormap_name="Reds" if norm_method == 'min-max' else "coolwarm")
 
-        # Normalize values and map colors
-        index_values = np.linspace(0, 1 if norm_method == 'min-max' else (-3 if norm_method == 'zscore' else -1), len(gradientscolor))
-        for value in prop_all_values:
-            if np.isnan(value):
-                value2color[value] = nan_color
-            else:
-                if norm_method == "min-max":
-                    normalized_value = min_max_normalize(value, minval, maxval)
-                elif norm_method == "mean":
-                    normalized_value = mean_normalize(value, mean_val, minval, maxval)
-                elif norm_method == "zscore":
-                    normalized_value = z_score_normalize(value, mean_val, std_val)
-                else:
-                    raise ValueError("Unsupported normalization method.")
-
-                index = np.abs(index_values - normalized_value).argmin() + 1
-                if value not in value2color:  # Ensure color is not overwritten
-                    value2color[value] = gradientscolor.get(index, "")
+        # Normalize values and map colors by gradient bin
+        color_scale = ColorScale(gradientscolor, minval, maxval, norm_method=norm_method,
+            mean_val=mean_val, std_val=std_val, value2color=value2color, nan_color=nan_color)
 
         # Add layout for the current property
         layout = staple_layouts.LayoutHeatmap(
             name=f'Heatmap_{prop}_{norm_method}', column=level,
             width=column_width, padding_x=padding_x, padding_y=padding_y,
             internal_rep=internal_rep, prop=prop,
-            maxval=maxval, minval=minval, value_color=value2color,
+            maxval=maxval, minval=minval, value_color=color_scale,
             value_range=[minval, maxval], color_range=gradientscolor,
             absence_color=nan_color
         )
@@ -1782,22 +1789,19 @@ def categorical2matrix(tree, profiling_props, dtype=str, color_config=None):
     profiling_props: A list of property names to be processed for each leaf in the tree.
     
     Output:
-    A dictionary of matrix representation of the tree leaves and their properties.
+    A NodeMatrix of the tree leaves and their properties.
     A sorted dictionary mapping property values to their corresponding colors.
     """
     absence_value = "NaN"
     absence_color = "#EBEBEB"
-    leaf2matrix = {}
-    for node in tree.traverse():
-        if node.is_leaf:
-            leaf2matrix[node.name] = []
-            for profiling_prop in profiling_props:
-                if node.props.get(profiling_prop) is not None:
-                    if dtype == str:
-                        val = node.props.get(profiling_prop)
-                    leaf2matrix[node.name].append(val)
-                else:
-                    leaf2matrix[node.name].append(absence_value)
+    leaves = [node for node in tree.traverse() if node.is_leaf]
+    values = np.full((len(leaves), len(profiling_props)), absence_value, dtype=object)
+    for row, leaf in enumerate(leaves):
+        for col, profiling_prop in enumerate(profiling_props):
+            val = leaf.props.get(profiling_prop)
+            if val is not None:
+                values[row, col] = val
+    leaf2matrix = NodeMatrix([leaf.name for leaf in leaves], values)
 
     # get color
     value2color = {} # key = value, value = color id
@@ -1808,7 +1812,7 @@ def categorical2matrix(tree, profiling_props, dtype=str, color_config=None):
             value2color = color_config.get(matrix_prop).get('value2color')
             value2color[absence_value] = absence_color
     else:
-        all_values = sorted(list(set(utils.flatten([sublist for sublist in leaf2matrix.values()]))))
+        all_values = sorted(set(values.ravel().tolist()))
         value2color = utils.assign_color_to_values(all_values, paired_color)
         if absence_value in value2color:
             value2color[absence_value] = absence_color
@@ -1822,49 +1826,9 @@ def numerical2matrix(tree, profiling_props, count_negative=True, internal_num_re
     profiling_props: A list of property names to be processed for each leaf in the tree.
 
     Output:
-    A dictionary of matrix representation of the tree leaves and their properties.
+    A NodeMatrix of the tree nodes and their properties.
     A sorted dictionary mapping property values to their corresponding colors.
     """
-    def flatten(l):
-        return [item for sublist in l for item in sublist]
-
-    def min_max_normalize(value, minval, maxval):
-        if maxval - minval == 0:
-            return 0
-        else:
-            return (value - minval) / (maxval - minval)
-
-    def mean_normalize(value, mean_val, minval, maxval):
-        if maxval - minval == 0:
-            return 0
-        else:
-            return (value - mean_val) / (maxval - minval)
-
-    def z_score_normalize(value, mean_val, std_val):
-        if std_val == 0:
-            return 0
-        else:
-            return (value - mean_val) / std_val
-
-    def _get_color(search_value, color_dict, norm_method='min-max'):
-        num = len(color_dict)
-        search_value = float(search_value)
-        if norm_method == "min-max":
-            normalized_value = min_max_normalize(search_value)
-            index_values = np.linspace(0, 1, num)
-        elif norm_method == "mean":
-            normalized_value = mean_normalize(search_value)
-            index_values = np.linspace(-1, 1, num)
-        elif norm_method == "zscore":
-            normalized_value = z_score_normalize(search_value)
-            index_values = np.linspace(-3, 3, num)
-        else:
-            logger.error("Unsupported normalization method.")
-            sys.exit(1)
-        index = np.abs(index_values - normalized_value).argmin() + 1
-        #index = np.abs(index_values - search_value).argmin() + 1
-        return color_dict.get(index, "")
-
     def parse_color_config(color_config, profiling_props, all_props_wildcard, minval, maxval):
         gradientscolor = None
         nan_color = '#EBEBEB'
@@ -1933,18 +1897,19 @@ def numerical2matrix(tree, profiling_props, count_negative=True, internal_num_re
         all_props_wildcard = '*'
 
         # Get color configuration
-        all_values_raw = list(set(flatten([sublist for sublist in node2matrix.values()])))
-        all_values = sorted(list(filter(lambda x: x is not None and not math.isnan(x), all_values_raw)))
+        matrix_values = node2matrix.values
+        all_values = np.unique(matrix_values[~np.isnan(matrix_values)])
 
         if not count_negative:
-            positive_values = sorted(list(filter(lambda x: x is not None and not math.isnan(x) and x >= 0, all_values)))
-            minval, maxval = min(positive_values), max(positive_values)
+            positive_values = all_values[all_values >= 0]
+            minval, maxval = positive_values.min(), positive_values.max()
             mean_val = np.mean(positive_values)
             std_val = np.std(positive_values)
         else:
-            minval, maxval = min(all_values), max(all_values)
+            minval, maxval = all_values.min(), all_values.max()
             mean_val = np.mean(all_values)
             std_val = np.std(all_values)
+        minval, maxval = float(minval), float(maxval)
 
         if color_config:
             value2color, gradientscolor, minval, maxval, nan_color = parse_color_config(color_config, profiling_props, all_props_wildcard, minval, maxval)
@@ -1958,78 +1923,62 @@ def numerical2matrix(tree, profiling_props, count_negative=True, internal_num_re
             else: # "mean" "zscore"
                 gradientscolor = utils.build_color_gradient(20, colormap_name="coolwarm")
         
-        num = len(gradientscolor)
-        for search_value in all_values_raw:
-            if search_value is None:
-                value2color[search_value] = nan_color
-            elif math.isnan(search_value):
-                value2color[search_value] = nan_color
-            #value2color[search_value] = _get_color(search_value, gradientscolor, norm_method)
-            else:
-                search_value = float(search_value)
-                if search_value not in value2color:
-                    if not count_negative and search_value < 0:
-                        value2color[search_value] = nan_color
-                    else:
-                        if norm_method == "min-max":
-                            normalized_value = min_max_normalize(search_value, minval, maxval)
-                            index_values = np.linspace(0, 1, num)
-                        elif norm_method == "mean":
-                            normalized_value = mean_normalize(search_value, mean_val, minval, maxval)
-                            index_values = np.linspace(-1, 1, num)
-                        elif norm_method == "zscore":
-                            normalized_value = z_score_normalize(search_value, mean_val, std_val)
-                            index_values = np.linspace(-3, 3, num)
-                        else:
-                            logger.error("Unsupported normalization method.")
-                            sys.exit(1)
-                        index = np.abs(index_values - normalized_value).argmin() + 1
-                        value2color[search_value] = gradientscolor.get(index, "")
+        if norm_method not in NORM_METHODS:
+            logger.error("Unsupported normalization method.")
+            sys.exit(1)
+        color_scale = ColorScale(gradientscolor, minval, maxval, norm_method=norm_method,
+            mean_val=mean_val, std_val=std_val, value2color=value2color, nan_color=nan_color)
+        value2color = {**value2color, **color_scale.color_map(all_values)}
+        if not count_negative:
+            for value in value2color:
+                if value < 0 and value not in color_scale.value2color:
+                    value2color[value] = nan_color
+        if len(all_values) < matrix_values.size:
+            value2color[None] = nan_color # missing values
         return minval, maxval, value2color
 
-    node2matrix_single = {}
+    # values of the single valued props, one column per prop
+    nodes = list(tree.traverse())
+    single_values = np.full((len(nodes), len(profiling_props)), np.nan)
+    single_rows = np.zeros(len(nodes), dtype=bool)
     node2matrix_list = {prop: {} for prop in profiling_props}
 
     single_props = set()
     list_props = set()
     
-    for node in tree.traverse():
-        node2matrix_single[node.name] = []
-        for profiling_prop in profiling_props:
+    for row, node in enumerate(nodes):
+        for col, profiling_prop in enumerate(profiling_props):
             prop_value = node.props.get(profiling_prop)
             if prop_value is not None:
                 if isinstance(prop_value, list):
                     list_props.add(profiling_prop)
-                    prop_value = list(map(float, prop_value))
-                    if node.name not in node2matrix_list[profiling_prop]:
-                        node2matrix_list[profiling_prop][node.name] = []
                     node2matrix_list[profiling_prop][node.name] = prop_value
                 else:
                     single_props.add(profiling_prop)
-                    node2matrix_single[node.name].append(float(prop_value))
+                    single_values[row, col] = float(prop_value)
+                    single_rows[row] = True
             else:
                 if internal_num_rep != 'none':
+                    single_rows[row] = True
                     representative_prop = utils.add_suffix(profiling_prop, internal_num_rep)
                     prop_value = node.props.get(representative_prop)
                     if prop_value is not None:
                         if isinstance(prop_value, list):
                             list_props.add(profiling_prop)
-                            prop_value = list(map(float, prop_value))
-                            if node.name not in node2matrix_list[profiling_prop]:
-                                node2matrix_list[profiling_prop][node.name] = []
                             node2matrix_list[profiling_prop][node.name] = prop_value
                         else:
-                            node2matrix_single[node.name].append(float(prop_value))
+                            single_values[row, col] = float(prop_value)
                     else:
-                        node2matrix_single[node.name].append(None)
-                        if node.name not in node2matrix_list[profiling_prop]:
-                            node2matrix_list[profiling_prop][node.name] = []
-                        node2matrix_list[profiling_prop][node.name].append(None)
+                        node2matrix_list[profiling_prop][node.name] = [None]
 
     # Process single values
     if single_props:
+        single_cols = [col for col, prop in enumerate(profiling_props) if prop in single_props]
+        node2matrix_single = NodeMatrix([node.name for node, has_row in zip(nodes, single_rows) if has_row],
+            single_values[np.ix_(single_rows, single_cols)])
         minval_single, maxval_single, value2color_single = process_color_configuration(node2matrix_single, profiling_props)
     else:
+        node2matrix_single = NodeMatrix([], np.empty((0, 0)))
         minval_single, maxval_single, value2color_single = None, None, None
     
     if list_props:
@@ -2037,8 +1986,9 @@ def numerical2matrix(tree, profiling_props, count_negative=True, internal_num_re
         results_list = {}
         for prop in profiling_props:
             if prop in list_props:
-                minval_list, maxval_list, value2color_list = process_color_configuration(node2matrix_list[prop])
-                results_list[prop] = (node2matrix_list[prop], minval_list, maxval_list, value2color_list)
+                node2matrix = NodeMatrix.from_rows(node2matrix_list[prop])
+                minval_list, maxval_list, value2color_list = process_color_configuration(node2matrix)
+                results_list[prop] = (node2matrix, minval_list, maxval_list, value2color_list)
             else:
                 results_list[prop] = (None, None, None, None)
     else:
@@ -2053,7 +2003,7 @@ def binary2matrix(tree, profiling_props, color_config=None):
     profiling_props: A list of property names to be processed for each leaf in the tree.
 
     Output:
-    A dictionary of matrix representation of the tree leaves and their properties.
+    A NodeMatrix of the tree nodes and their properties.
     A sorted dictionary mapping property values to their corresponding colors.
     """
     is_list = False
@@ -2064,25 +2014,30 @@ def binary2matrix(tree, profiling_props, color_config=None):
     value2color = {}
 
     for node in tree.traverse():
-        node2matrix[node.name] = []
-        for profiling_prop in profiling_props:
-            if node.is_leaf:
+        if node.is_leaf:
+            row = []
+            for profiling_prop in profiling_props:
                 prop_value = node.props.get(profiling_prop)  
                 if prop_value is not None:  
                     if isinstance(prop_value, list):  # Check if the property value is a list
                         is_list = True  # Set is_array to True upon finding the first list
                         for array_element in prop_value:
-                            node2matrix[node.name].append(binary2color.get(utils.str2bool(array_element)))
+                            row.append(binary2color.get(to_bool(array_element)))
                     else:  # If not a list, directly handle the single value case
-                        node2matrix[node.name].append(binary2color.get(utils.str2bool(prop_value)))
+                        row.append(binary2color.get(to_bool(prop_value)))
                 else:  # If prop_value is None, append None
-                    node2matrix[node.name].append(None)
-            
-            else: # for internal nodes parse counter of True/Total percentage 
+                    row.append(None)
+            node2matrix[node.name] = row
+        else: # for internal nodes parse counter of True/Total percentage 
+            row = [None] * len(profiling_props)
+            for col, profiling_prop in enumerate(profiling_props):
                 representative_prop = utils.add_suffix(profiling_prop, "counter")
                 if node.props.get(representative_prop):
-                    ratio = utils.counter2ratio(node, representative_prop)
-                    node2matrix[node.name].append(ratio)
+                    row[col] = utils.counter2ratio(node, representative_prop)
+            # internal nodes without counters are drawn with their first leaf
+            if any(ratio is not None for ratio in row):
+                node2matrix[node.name] = row
+    node2matrix = NodeMatrix.from_rows(node2matrix)
 
     if color_config:
         if color_config.get(all_props_wildcard) is not None:
@@ -2101,14 +2056,9 @@ def binary2matrix(tree, profiling_props, color_config=None):
     gradientscolor = utils.build_color_gradient(20, colormap_name='Reds')
     
     # get color for binary value 0 to 1
-    all_values_raw = list(set(utils.flatten([sublist for sublist in node2matrix.values()])))
-    all_values = sorted(list(filter(lambda x: x is not None and not math.isnan(x), all_values_raw)))
-    num = len(gradientscolor)
-    index_values = np.linspace(0, 1, num) # binary value 0 to 1
-    for search_value in all_values:
-        if search_value not in value2color:
-            index = np.abs(index_values - search_value).argmin() + 1
-            value2color[search_value] = gradientscolor[index]
+    all_values = node2matrix.values[~np.isnan(node2matrix.values)]
+    color_scale = ColorScale(gradientscolor, 0, 1, value2color=value2color) # binary value 0 to 1
+    value2color = {**value2color, **color_scale.color_map(all_values)}
     
     return node2matrix, value2color, is_list
 
@@ -2245,13 +2195,9 @@ def single2matrix(tree, profiling_prop):
     value2color = {1: precence_color, 0: absence_color}
     # get color for binary value 0 to 1
     all_values_raw = list(set(utils.flatten([sublist for sublist in node2matrix.values()])))
-    all_values = sorted(list(filter(lambda x: x is not None and not math.isnan(x), all_values_raw)))
-    num = len(gradientscolor)
-    index_values = np.linspace(0, 1, num) # binary value 0 to 1
-    for search_value in all_values:
-        if search_value not in value2color:
-            index = np.abs(index_values - search_value).argmin() + 1
-            value2color[search_value] = gradientscolor[index]
+    all_values = [x for x in all_values_raw if x is not None and not math.isnan(x)]
+    color_scale = ColorScale(gradientscolor, 0, 1, value2color=value2color) # binary value 0 to 1
+    value2color = {**value2color, **color_scale.color_map(all_values)}
     
     #value2color = {1: precence_color, 0: absence_color}
     return node2matrix, value2color, all_categorical_values
@@ -2293,7 +2239,7 @@ def multiple2matrix(tree, profiling_prop, prop2type=None, color_config=None, ete
     absence_color = '#EBEBEB'   # grey
 
     # Determine the data type of the profiling property
-    data_type = prop2type.get(profiling_prop)
+    data_type = prop2type.get(profiling_prop) if prop2type else None
     # Get all categorical values based on whether data_type is a list and eteformat_flag
     if data_type and data_type == list:
         tree_prop_array = utils.tree_prop_array(tree, profiling_prop, leaf_only=True, list_type=not eteformat_flag)
@@ -2302,33 +2248,33 @@ def multiple2matrix(tree, profiling_prop, prop2type=None, color_config=None, ete
 
     all_categorical_values = sorted(list(set(utils.flatten(tree_prop_array))), key=lambda x: (x != 'NaN', x))
 
-    # Create node to matrix mappings
-    node2matrix = {}
-    for node in tree.traverse():
-        node_prop = node.props.get(profiling_prop)
-        if node.is_leaf and node_prop:
-            node2matrix[node.name] = [1 if val in node_prop else 0 for val in all_categorical_values]
-        else:
-            representative_prop = utils.add_suffix(profiling_prop, "counter")
-            if node.props.get(representative_prop):
-                ratios = utils.categorical2ratio(node, representative_prop, all_categorical_values)
-                node2matrix[node.name] = ratios
+    # Create node to matrix mappings, presence of each value in the leaves
+    # and ratios of the leaves having it in the internal nodes
+    value2col = {val: col for col, val in enumerate(all_categorical_values)}
+    representative_prop = utils.add_suffix(profiling_prop, "counter")
+
+    def leaf_columns(leaf):
+        leaf_prop = leaf.props.get(profiling_prop)
+        if not leaf_prop:
+            return None
+        if isinstance(leaf_prop, str):
+            # the value itself and each of its list items
+            leaf_prop = [leaf_prop] + leaf_prop.split('||')
+        return [value2col[val] for val in leaf_prop if val in value2col]
+
+    node2matrix = presence_matrix(tree, leaf_columns, len(all_categorical_values),
+        has_row=lambda node: node.props.get(representative_prop))
 
     # Build a color gradient for binary values
     gradientscolor = utils.build_color_gradient(20, colormap_name='Reds')
     value2color = {1: precence_color, 0: absence_color}
 
-    # Get unique values from node2matrix and sort non-NaN values
-    all_values_raw = list(set(utils.flatten(node2matrix.values())))
-    all_values = sorted([x for x in all_values_raw if x is not None and not math.isnan(x)])
+    # Get unique values stored in the sparse matrix
+    all_values = np.unique(node2matrix.values.data)
 
     # Map non-binary values to gradient colors
-    num = len(gradientscolor)
-    index_values = np.linspace(0, 1, num)
-    for search_value in all_values:
-        if search_value not in value2color:
-            index = np.abs(index_values - search_value).argmin() + 1
-            value2color[search_value] = gradientscolor[index]
+    color_scale = ColorScale(gradientscolor, 0, 1, value2color=value2color)
+    value2color = {**value2color, **color_scale.color_map(all_values)}
 
     return node2matrix, value2color, all_categorical_values
 